@@ -0,0 +1,242 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Ack Batcher - groups queue message acknowledgements into multi-acks.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+from functools import partial
+from collections import deque
+
+import pika
+from src.common.logger import LoggingUtil
+
+
+class AckBatcher:
+    """
+    Tracks the delivery tags received on a channel and acknowledges them once they have been processed.
+
+    Acks are only issued for the contiguous run of completed delivery tags (the watermark) and are grouped
+    into a single basic_ack(multiple=True) every batch_size messages or batch_ms milliseconds, whichever
+    comes first.
+
+    Note: all methods of this class, except complete_threadsafe(), must be called on the connection's I/O thread.
+    """
+
+    def __init__(self, batch_size: int, batch_ms: int, _logger=None):
+        """
+        init the ack batcher object
+
+        :param batch_size: the number of completed messages that triggers an ack
+        :param batch_ms: the maximum time in milliseconds a completed message waits for an ack
+        :param _logger:
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.Msg-Handler.AckBatcher", level=log_level, line_format='medium', log_file_path=log_path)
+
+        # save the batching limits
+        self.batch_size: int = max(batch_size, 1)
+        self.batch_ms: int = max(batch_ms, 0)
+
+        # the channel the delivery tags belong to. this is bound on the first message received
+        self.channel = None
+
+        # the delivery tags received but not yet acknowledged, in delivery order
+        self.pending_tags: deque = deque()
+
+        # the delivery tags that have been processed but are still waiting on earlier tags
+        self.completed_tags: set = set()
+
+        # the highest delivery tag that can be acknowledged and the number of messages it covers
+        self.ack_tag: int = 0
+        self.ack_count: int = 0
+
+        # the handle to the pending ack timer
+        self.timer = None
+
+    def wrap(self, callback):
+        """
+        wraps a queue callback so that its message is acknowledged once the callback returns.
+
+        :param callback:
+        :return:
+        """
+        def on_message(channel, method, properties, body):
+            # start tracking this message
+            self.track(channel, method.delivery_tag)
+
+            try:
+                # process the message
+                callback(channel, method, properties, body)
+            finally:
+                # the message has been handled, it can now be acknowledged
+                self.complete(method.delivery_tag)
+
+        # return the wrapped callback
+        return on_message
+
+    def track(self, channel, delivery_tag: int):
+        """
+        starts tracking a received delivery tag
+
+        :param channel:
+        :param delivery_tag:
+        :return:
+        """
+        # bind the channel on the first message
+        self.channel = channel
+
+        # save the tag in delivery order
+        self.pending_tags.append(delivery_tag)
+
+    def complete(self, delivery_tag: int):
+        """
+        marks a delivery tag as processed and acks the batch if a limit has been reached.
+
+        :param delivery_tag:
+        :return:
+        """
+        # save the completed tag
+        self.completed_tags.add(delivery_tag)
+
+        # move the ack watermark past every contiguous completed tag
+        while self.pending_tags and self.pending_tags[0] in self.completed_tags:
+            # get the tag off the front of the list
+            self.ack_tag = self.pending_tags.popleft()
+
+            # this tag is no longer outstanding
+            self.completed_tags.discard(self.ack_tag)
+
+            # count it toward the batch
+            self.ack_count += 1
+
+        # have we reached the batch size limit
+        if self.ack_count >= self.batch_size:
+            self.flush()
+        # else make sure the waiting acks get sent in time
+        elif self.ack_count > 0 and self.timer is None:
+            self.start_timer()
+
+    def complete_threadsafe(self, delivery_tag: int):
+        """
+        marks a delivery tag as processed from a thread other than the connection's I/O thread.
+        the completion is handed to the I/O thread which then does the actual work.
+
+        :param delivery_tag:
+        :return:
+        """
+        # get the connection the channel belongs to
+        connection = self.channel.connection
+
+        try:
+            # the blocking connection has its own thread safe callback handling
+            if isinstance(connection, pika.BlockingConnection):
+                connection.add_callback_threadsafe(partial(self.complete, delivery_tag))
+            # the asyncio connection exposes the event loop directly
+            else:
+                connection.ioloop.call_soon_threadsafe(partial(self.complete, delivery_tag))
+        except Exception:
+            # the message will be redelivered by the broker
+            self.logger.warning('Warning: Could not hand off the ack for delivery tag %s, the connection is closed.', delivery_tag)
+
+    def start_timer(self):
+        """
+        starts the timer that acks the waiting messages on the connection's I/O loop
+
+        :return:
+        """
+        self.timer = self.call_later(self.channel.connection, self.batch_ms / 1000, self.on_timer)
+
+    def stop_timer(self):
+        """
+        cancels the pending ack timer
+
+        :return:
+        """
+        self.remove_timer(self.channel.connection, self.timer)
+
+        # the timer is gone
+        self.timer = None
+
+    @staticmethod
+    def call_later(connection, delay: float, callback):
+        """
+        schedules a callback on the connection's I/O loop
+
+        :param connection:
+        :param delay: the delay in seconds
+        :param callback:
+        :return: the timer handle
+        """
+        # the blocking connection has its own timer handling
+        if isinstance(connection, pika.BlockingConnection):
+            return connection.call_later(delay, callback)
+
+        # the asyncio connection exposes the event loop directly
+        return connection.ioloop.call_later(delay, callback)
+
+    @staticmethod
+    def remove_timer(connection, timer):
+        """
+        cancels a timer created with call_later()
+
+        :param connection:
+        :param timer:
+        :return:
+        """
+        # the blocking connection has its own timer handling
+        if isinstance(connection, pika.BlockingConnection):
+            connection.remove_timeout(timer)
+        # the asyncio connection returns a cancellable timer handle
+        else:
+            timer.cancel()
+
+    def on_timer(self):
+        """
+        acks the waiting messages when the batch time limit expires
+
+        :return:
+        """
+        # the timer has fired
+        self.timer = None
+
+        # send the acks
+        self.flush()
+
+    def flush(self):
+        """
+        acknowledges all completed messages up to the watermark with a single multi-ack
+
+        :return:
+        """
+        # cancel any pending timer
+        if self.timer is not None:
+            self.stop_timer()
+
+        # is there anything to ack
+        if self.ack_count > 0:
+            try:
+                # ack everything up to and including the watermark tag
+                self.channel.basic_ack(delivery_tag=self.ack_tag, multiple=True)
+
+                self.logger.debug('Acknowledged %s message(s) up to delivery tag %s.', self.ack_count, self.ack_tag)
+            except Exception:
+                # the messages will be redelivered by the broker
+                self.logger.exception('Error: Exception acknowledging messages up to delivery tag %s.', self.ack_tag)
+
+            # reset the batch
+            self.ack_count = 0
@@ -0,0 +1,273 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Async Queue Consumer - an asyncio based queue consumer engine.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from pika.adapters.asyncio_connection import AsyncioConnection
+from src.common.logger import LoggingUtil
+from src.common.ack_batcher import AckBatcher
+from src.common.ordered_worker_pool import OrderedWorkerPool
+
+
+class AsyncQueueConsumer:
+    """
+    Consumes queue messages over a pika AsyncioConnection.
+
+    The broker connection (and its heartbeats) is serviced by the asyncio event loop. Each message is handled by
+    a coroutine that runs the existing (blocking) queue callback in a thread pool so the connection is never stalled.
+    The messages of a queue that has a shard key (all the run time status and run properties queues) are handled on
+    an ordered worker pool, in order per key. The pool has WORKER_POOL_SIZE workers, or ASYNC_MAX_INFLIGHT (default 4)
+    workers when that is not set, so up to that many runs are handled at the same time.
+
+    The messages of a queue without a shard key are handled one at a time, in order. ASYNC_MAX_INFLIGHT has no effect
+    on them, handling them at the same time would break their order. Setting ASYNC_MAX_INFLIGHT to 1 makes every queue serial.
+
+    Any number of queues can be consumed over the one connection, each on its own channel.
+    """
+
+    def __init__(self, _queue_utils, _logger=None):
+        """
+        init the async queue consumer object
+
+        :param _queue_utils: the QueueUtils object that has the queue name and consumer settings
+        :param _logger:
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.Msg-Handler.AsyncQueueConsumer", level=log_level, line_format='medium',
+                                                   log_file_path=log_path)
+
+        # save the queue utilities, they have the queue name and consumer settings
+        self.queue_utils = _queue_utils
+
+        # get the max number of messages from a queue that can be processed at the same time. this is only used for
+        # queues that have a shard key, their messages are processed on an ordered worker pool to keep them in order
+        self.max_inflight: int = max(int(os.environ.get('ASYNC_MAX_INFLIGHT', '4')), 1)
+
+        # the ack batchers (only used when manual acks are enabled) and the locks that keep the messages of each queue in order
+        self.ack_batchers: dict = {}
+        self.inflight: dict = {}
+
+        # the thread pool that runs the callbacks
+        self.executor = None
+
+        # the ordered worker pools of queues that have a shard key
+        self.worker_pools: list = []
+
+        # the tasks that are currently handling messages. a reference is kept so they are not garbage collected
+        self.tasks: set = set()
+
+    def start_consuming(self, queue_callbacks: dict, shard_keys: dict):
+        """
+        Runs the event loop and consumes queue messages until the connection closes
+
+        :param queue_callbacks: a dict of queue name: callback
+        :param shard_keys: a dict of queue name: shard key function
+        :return:
+        """
+        try:
+            # run the consumer until the connection is closed
+            asyncio.run(self.consume(queue_callbacks, shard_keys))
+        except Exception:
+            self.logger.exception("Error: Exception consuming queue(s) %s.", list(queue_callbacks))
+        finally:
+            # wait for the workers to finish the messages they have
+            for worker_pool in self.worker_pools:
+                worker_pool.stop()
+
+    async def consume(self, queue_callbacks: dict, shard_keys: dict):
+        """
+        Creates the connection and a channel per queue and consumes queue messages until the connection closes
+
+        :param queue_callbacks: a dict of queue name: callback
+        :param shard_keys: a dict of queue name: shard key function
+        :return:
+        """
+        # get the running event loop
+        loop = asyncio.get_running_loop()
+
+        # create futures to signal the connection state
+        opened: asyncio.Future = loop.create_future()
+        closed: asyncio.Future = loop.create_future()
+
+        # create the connection to the queue host
+        connection = AsyncioConnection(self.queue_utils.get_connect_params(), on_open_callback=opened.set_result,
+                                       on_open_error_callback=lambda _conn, err: opened.set_exception(err),
+                                       on_close_callback=lambda _conn, err: closed.done() or closed.set_result(err), custom_ioloop=loop)
+
+        # wait for the connection to open
+        await opened
+
+        # create the thread pool that runs the callbacks. each queue handles one message at a time
+        with ThreadPoolExecutor(max_workers=len(queue_callbacks), thread_name_prefix='async-consumer') as self.executor:
+            # for each queue requested
+            for queue_name, callback in queue_callbacks.items():
+                # create the channel and start consuming the queue
+                await self.consume_queue(loop, connection, closed, queue_name, callback, shard_keys)
+
+            # let the supervisor know the consumers are back up
+            self.queue_utils.supervisor.on_connected()
+
+            # wait for the connection to close
+            err = await closed
+
+            self.logger.warning('%s async listener connection closed: %s', list(queue_callbacks), err)
+
+            # wait for the messages in progress to finish
+            if self.tasks:
+                await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def consume_queue(self, loop, connection, closed, queue_name: str, callback, shard_keys: dict):
+        """
+        Creates a channel on the connection and starts consuming the queue
+
+        :param loop:
+        :param connection:
+        :param closed: the future that signals the connection has closed
+        :param queue_name:
+        :param callback:
+        :param shard_keys: a dict of queue name: shard key function
+        :return:
+        """
+        # create a new queue channel
+        channel = await self.wait_for(loop, closed, lambda on_done: connection.channel(on_open_callback=on_done))
+
+        # close the connection if the channel goes away
+        channel.add_on_close_callback(lambda _chan, _err: connection.is_closing or connection.is_closed or connection.close())
+
+        # specify the queue that will be listened to
+        await self.wait_for(loop, closed, lambda on_done: channel.queue_declare(queue=queue_name, callback=on_done))
+
+        # the messages are handled one at a time in the order they were received. the waiters get the lock in order
+        self.inflight[queue_name] = asyncio.Lock()
+
+        # are we acknowledging messages after they have been processed
+        if self.queue_utils.manual_ack:
+            # limit the number of unacknowledged messages pushed to this consumer
+            await self.wait_for(loop, closed, lambda on_done: channel.basic_qos(prefetch_count=self.queue_utils.prefetch_count, callback=on_done))
+
+            # create the object that groups the acks
+            self.ack_batchers[queue_name] = AckBatcher(self.queue_utils.ack_batch_size, self.queue_utils.ack_batch_ms, _logger=self.logger)
+
+        def on_message(chan, method, properties, body):
+            # start tracking this message so acks are issued in delivery order
+            if queue_name in self.ack_batchers:
+                self.ack_batchers[queue_name].track(chan, method.delivery_tag)
+
+            # create a task to handle the message
+            task: asyncio.Task = loop.create_task(self.handle_msg(queue_name, callback, chan, method, properties, body))
+
+            # keep a reference to the task until it is done
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+        # failed messages are sent to the delay queues to be retried later
+        if self.queue_utils.retry_handler.enabled:
+            callback = self.queue_utils.retry_handler.wrap(queue_name, callback)
+
+        # get the worker pool for this queue if there is one
+        worker_pool = self.get_worker_pool(queue_name, shard_keys)
+
+        # the ordered worker pool handles the messages and the acks in place of the coroutines
+        if worker_pool is not None:
+            self.worker_pools.append(worker_pool)
+            on_message = worker_pool.wrap(callback, self.ack_batchers.get(queue_name))
+
+        # specify the queue callback handler
+        channel.basic_consume(queue_name, on_message, auto_ack=not self.queue_utils.manual_ack)
+
+        self.logger.info('%s async listener configured on %s:5672 and waiting for messages. max inflight: %s.', queue_name,
+                         os.environ.get("RABBITMQ_HOST"), len(worker_pool.workers) if worker_pool is not None else 1)
+
+    def get_worker_pool(self, queue_name: str, shard_keys: dict):
+        """
+        creates an ordered worker pool for the queue if one is configured or more than one message can be in flight
+
+        :param queue_name:
+        :param shard_keys: a dict of queue name: shard key function
+        :return:
+        """
+        # get the configured worker pool
+        worker_pool = self.queue_utils.get_worker_pool(queue_name, shard_keys)
+
+        # the messages can only be handled at the same time if they are kept in order by their shard key
+        if worker_pool is None and self.max_inflight > 1:
+            if shard_keys.get(queue_name) is not None:
+                worker_pool = OrderedWorkerPool(self.max_inflight, shard_keys[queue_name], name=queue_name, _logger=self.logger)
+
+                self.logger.info('%s ordered worker pool enabled for the async consumer. worker count: %s.', queue_name, self.max_inflight)
+            else:
+                self.logger.warning('%s has no shard key, ASYNC_MAX_INFLIGHT is ignored and its messages are handled one at a time to keep '
+                                    'them in order.', queue_name)
+
+        # return the pool
+        return worker_pool
+
+    async def handle_msg(self, queue_name: str, callback, channel, method, properties, body):
+        """
+        Handles a message by running the queue callback in the thread pool
+
+        :param queue_name:
+        :param callback:
+        :param channel:
+        :param method:
+        :param properties:
+        :param body:
+        :return:
+        """
+        # wait for the messages before this one
+        async with self.inflight[queue_name]:
+            try:
+                # run the callback off of the event loop
+                await asyncio.get_running_loop().run_in_executor(self.executor, callback, channel, method, properties, body)
+            except Exception:
+                self.logger.exception("Error: Exception handling a message from queue %s.", queue_name)
+            finally:
+                # the message has been handled, it can now be acknowledged
+                if queue_name in self.ack_batchers and channel.is_open:
+                    self.ack_batchers[queue_name].complete(method.delivery_tag)
+
+    @staticmethod
+    async def wait_for(loop, closed, request):
+        """
+        Issues a pika request that reports completion with a callback and waits for the result
+
+        :param loop:
+        :param closed: the future that signals the connection has closed
+        :param request: a callable that takes the completion callback
+        :return:
+        """
+        # create the future that receives the result
+        future: asyncio.Future = loop.create_future()
+
+        # issue the request
+        request(lambda result: future.done() or future.set_result(result))
+
+        # wait for the result or the connection to go away
+        await asyncio.wait((future, closed), return_when=asyncio.FIRST_COMPLETED)
+
+        # if the connection closed first there will never be a result
+        if not future.done():
+            raise ConnectionError('Connection closed while waiting on the queue host.')
+
+        # return the result
+        return future.result()
@@ -0,0 +1,435 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Confirm Relay Publisher - relays messages to another queue host using pipelined publisher confirms.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import Future
+from collections import deque, OrderedDict
+
+import pika
+from pika.adapters.asyncio_connection import AsyncioConnection
+from src.common.relay_publisher import RelayPublisher
+
+
+class ConfirmRelayPublisher(RelayPublisher):
+    """
+    Relays messages using publisher confirms with many unconfirmed messages in flight at once.
+
+    submit() queues the message and returns a future that gets the result of the relay, so a caller can have any number
+    of messages in flight. publish() waits a bounded time for the result. the publishing, confirm tracking and
+    reconnecting is done on an asyncio event loop running on a background thread. the unconfirmed messages are tracked
+    by delivery tag and are published again if the broker nacks them, they are not confirmed in time or the connection
+    is lost. a failed connection attempt also uses up an attempt. after RELAY_MAX_ATTEMPTS attempts the message fails
+    and the caller gets the error. at most RELAY_MAX_PENDING messages are held, submit() waits for room after that.
+    """
+
+    def __init__(self, host: str, user: str, password: str, _logger=None):
+        """
+        init the confirm relay publisher object. the background thread is started on the first publish.
+
+        :param host:
+        :param user:
+        :param password:
+        :param _logger:
+        """
+        # init the connection details and logger
+        super().__init__(host, user, password, _logger=_logger)
+
+        # get the confirm limits
+        self.max_unconfirmed: int = max(int(os.environ.get('RELAY_MAX_UNCONFIRMED', '1000')), 1)
+        self.confirm_timeout: float = float(os.environ.get('RELAY_CONFIRM_TIMEOUT', '30'))
+        self.max_attempts: int = max(int(os.environ.get('RELAY_MAX_ATTEMPTS', '5')), 1)
+        self.max_pending: int = max(int(os.environ.get('RELAY_MAX_PENDING', '10000')), 1)
+
+        # the number of messages held, waiting to be published or confirmed. the condition is notified when there is room
+        self.held: int = 0
+        self.room: threading.Condition = threading.Condition()
+
+        # the event loop and the thread that runs it
+        self.loop = None
+        self.thread = None
+
+        # the messages waiting to be published. each item is [queue name, body, properties, queue arguments, attempts, future]
+        self.pending: deque = deque()
+
+        # the published messages waiting for a confirm by delivery tag. each item is (publish time, message)
+        self.unconfirmed: OrderedDict = OrderedDict()
+
+        # the delivery tag of the last message published on the current channel
+        self.delivery_tag: int = 0
+
+        # set when the last attempt to connect to the relay host failed, cleared once a channel is ready
+        self.connect_failed: bool = False
+
+        # set when the publisher is shutting down
+        self.stopping: bool = False
+
+    def publish(self, queue_name: str, body: bytes, properties: pika.BasicProperties = None, arguments: dict = None):
+        """
+        publishes a message to the queue on the relay host and waits for the broker to confirm it. raises an exception on failure
+        or if the message is not confirmed within the time all its attempts are allowed.
+
+        :param queue_name:
+        :param body:
+        :param properties: optional message properties
+        :param arguments: optional arguments used when the queue is declared
+        :return:
+        """
+        self.submit(queue_name, body, properties, arguments).result(self.confirm_timeout * self.max_attempts)
+
+    def submit(self, queue_name: str, body: bytes, properties: pika.BasicProperties = None, arguments: dict = None) -> Future:
+        """
+        queues a message to be published to the queue on the relay host
+
+        :param queue_name:
+        :param body:
+        :param properties: optional message properties
+        :param arguments: optional arguments used when the queue is declared
+        :return: a future that is set once the broker confirms the message or has an exception if the message failed
+        """
+        with self.lock:
+            # start the event loop on the first publish
+            if self.thread is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.run, name='relay-publisher', daemon=True)
+                self.thread.start()
+            # when there is somewhere to spool the messages, do not hold them in memory while the relay host is down. a
+            # connection that is still opening is not down, the messages wait for it
+            elif self.connect_failed and self.outbox is not None:
+                raise ConnectionError(f'Not connected to the relay host {self.host}.')
+
+        with self.room:
+            # wait for room for the message
+            if not self.room.wait_for(lambda: self.held < self.max_pending, self.confirm_timeout):
+                raise ConnectionError(f'Relay to {self.host} is backed up, {self.held} message(s) waiting.')
+
+            self.held += 1
+
+        # add the message to the ones waiting to be published
+        future: Future = Future()
+
+        self.pending.append([queue_name, body, properties, arguments, 0, future])
+
+        # wake up the event loop
+        self.loop.call_soon_threadsafe(self.send_pending)
+
+        # return the future
+        return future
+
+    def run(self):
+        """
+        runs the event loop on the background thread
+
+        :return:
+        """
+        asyncio.set_event_loop(self.loop)
+
+        # connect and start checking for confirm timeouts
+        self.loop.call_soon(self.connect)
+        self.loop.call_later(1, self.check_timeouts)
+
+        # handle the relaying until stopped
+        self.loop.run_forever()
+
+    def connect(self):
+        """
+        opens a connection to the relay host
+
+        :return:
+        """
+        self.connection = AsyncioConnection(self.parameters, on_open_callback=self.on_connection_open,
+                                            on_open_error_callback=self.on_connection_error, on_close_callback=self.on_connection_closed,
+                                            custom_ioloop=self.loop)
+
+    def on_connection_open(self, connection):
+        """
+        opens a channel once the connection is open
+
+        :param connection:
+        :return:
+        """
+        connection.channel(on_open_callback=self.on_channel_open)
+
+    def on_channel_open(self, channel):
+        """
+        turns on publisher confirms once the channel is open
+
+        :param channel:
+        :return:
+        """
+        channel.add_on_close_callback(self.on_channel_closed)
+        channel.confirm_delivery(self.on_confirm, callback=lambda _frame: self.on_confirm_selected(channel))
+
+    def on_confirm_selected(self, channel):
+        """
+        starts publishing once publisher confirms are turned on
+
+        :param channel:
+        :return:
+        """
+        self.logger.info('Relay connection with publisher confirms established to %s:5672.', self.host)
+
+        # the delivery tags and queue declarations start over on a new channel
+        self.channel = channel
+        self.connect_failed = False
+        self.delivery_tag = 0
+        self.declared_queues = set()
+
+        # publish the messages that were waiting
+        self.send_pending()
+
+    def on_connection_error(self, _connection, error):
+        """
+        tries again later when the connection could not be opened. the waiting messages have used up an attempt.
+
+        :param _connection:
+        :param error:
+        :return:
+        """
+        self.logger.warning('Error: Could not connect to the relay host %s: %s. %s message(s) waiting.', self.host, error, len(self.pending))
+
+        # the relay host is down until a connection opens
+        self.connect_failed = True
+
+        # get the waiting messages
+        msgs: list = [self.pending.popleft() for _ in range(len(self.pending))]
+
+        # when there is somewhere to spool the messages they fail right away, the callers spool them
+        if self.outbox is not None:
+            self.finish(msgs, ConnectionError(f'Could not connect to the relay host {self.host}: {error}'))
+        else:
+            # this was one more attempt
+            for msg in msgs:
+                msg[4] += 1
+
+            self.retry(msgs)
+
+        # try again later
+        self.reconnect()
+
+    def on_connection_closed(self, _connection, reason):
+        """
+        queues the unconfirmed messages to be published again and reconnects when the connection is closed
+
+        :param _connection:
+        :param reason:
+        :return:
+        """
+        # the channel went down with the connection
+        self.channel = None
+
+        # the unconfirmed messages will never be confirmed now, they go back to the front of the line
+        self.pending.extendleft(reversed([msg for _, msg in self.unconfirmed.values()]))
+        self.unconfirmed.clear()
+
+        # is the publisher shutting down
+        if self.stopping:
+            self.loop.stop()
+        else:
+            self.logger.warning('Relay connection to %s closed: %s.', self.host, reason)
+
+            # try again later
+            self.reconnect()
+
+    def on_channel_closed(self, _channel, reason):
+        """
+        closes the connection when the channel is closed. the connection is reopened in on_connection_closed()
+
+        :param _channel:
+        :param reason:
+        :return:
+        """
+        self.logger.warning('Relay channel to %s closed: %s.', self.host, reason)
+
+        # close the connection if it is still open
+        if self.connection is not None and self.connection.is_open:
+            self.connection.close()
+
+    def reconnect(self):
+        """
+        schedules a new connection attempt
+
+        :return:
+        """
+        self.connection = None
+
+        if not self.stopping:
+            self.loop.call_later(5, self.connect)
+        else:
+            self.loop.stop()
+
+    def send_pending(self):
+        """
+        publishes the waiting messages as long as the unconfirmed limit allows
+
+        :return:
+        """
+        # is the channel ready for publishing
+        if self.channel is None or not self.channel.is_open:
+            return
+
+        # publish until there is nothing waiting or the unconfirmed limit is reached
+        while self.pending and len(self.unconfirmed) < self.max_unconfirmed:
+            msg: list = self.pending.popleft()
+            queue_name, body, properties, arguments = msg[:4]
+
+            # create the queue if it has not been declared on this channel. the broker handles the declaration before the publish
+            if queue_name not in self.declared_queues:
+                self.channel.queue_declare(queue=queue_name, arguments=arguments)
+                self.declared_queues.add(queue_name)
+
+            # push the message to the queue
+            self.channel.basic_publish(exchange='', routing_key=queue_name, body=body, properties=properties)
+
+            # the channel numbers the messages in publish order
+            self.delivery_tag += 1
+
+            # one more attempt, wait for the confirm
+            msg[4] += 1
+            self.unconfirmed[self.delivery_tag] = (time.monotonic(), msg)
+
+    def on_confirm(self, frame):
+        """
+        handles an ack or nack of one or more published messages
+
+        :param frame:
+        :return:
+        """
+        # get the delivery tags this confirm covers
+        if frame.method.multiple:
+            delivery_tags: list = [delivery_tag for delivery_tag in self.unconfirmed if delivery_tag <= frame.method.delivery_tag]
+        else:
+            delivery_tags: list = [frame.method.delivery_tag]
+
+        # get the confirmed messages
+        msgs: list = [entry[1] for entry in (self.unconfirmed.pop(delivery_tag, None) for delivery_tag in delivery_tags) if entry is not None]
+
+        # nacked messages are published again
+        if isinstance(frame.method, pika.spec.Basic.Nack):
+            self.logger.warning('Relay of %s message(s) to %s was nacked.', len(msgs), self.host)
+
+            self.retry(msgs)
+        else:
+            # the messages were relayed
+            self.finish(msgs)
+
+        # there may be room for more messages now
+        self.send_pending()
+
+    def check_timeouts(self):
+        """
+        publishes the messages that were not confirmed in time again
+
+        :return:
+        """
+        # get the messages published before the timeout. the unconfirmed messages are in publish order
+        deadline: float = time.monotonic() - self.confirm_timeout
+        expired: list = []
+
+        while self.unconfirmed and next(iter(self.unconfirmed.values()))[0] < deadline:
+            expired.append(self.unconfirmed.popitem(last=False)[1][1])
+
+        # publish them again
+        if expired:
+            self.logger.warning('Relay of %s message(s) to %s was not confirmed in %s seconds.', len(expired), self.host, self.confirm_timeout)
+
+            self.retry(expired)
+            self.send_pending()
+
+        # check again later
+        self.loop.call_later(1, self.check_timeouts)
+
+    def retry(self, msgs: list):
+        """
+        puts the messages back at the front of the line unless they are out of attempts
+
+        :param msgs:
+        :return:
+        """
+        # get the messages that have attempts left
+        retries: list = [msg for msg in msgs if msg[4] < self.max_attempts]
+
+        # the rest have failed, the callers get the error
+        if len(retries) < len(msgs):
+            self.logger.error('Error: Relay of %s message(s) to %s failed after %s attempts.', len(msgs) - len(retries), self.host, self.max_attempts)
+
+            self.finish([msg for msg in msgs if msg[4] >= self.max_attempts],
+                        ConnectionError(f'Relay to {self.host} failed after {self.max_attempts} attempts.'))
+
+        # the retries go back to the front of the line in their original order
+        self.pending.extendleft(reversed(retries))
+
+    def finish(self, msgs: list, error: Exception = None):
+        """
+        hands the result of the messages to their callers and frees up their room
+
+        :param msgs:
+        :param error: the exception the messages failed with, None if they were relayed
+        :return:
+        """
+        for msg in msgs:
+            if error is None:
+                msg[5].set_result(True)
+            else:
+                msg[5].set_exception(error)
+
+        # there is room for more messages
+        with self.room:
+            self.held -= len(msgs)
+            self.room.notify(len(msgs))
+
+    def stop(self, timeout: float = 5):
+        """
+        waits for the messages in flight to be confirmed and shuts down the event loop
+
+        :param timeout:
+        :return:
+        """
+        # was the event loop ever started
+        if self.thread is None:
+            return
+
+        # give the messages in flight a chance to be confirmed
+        deadline: float = time.monotonic() + timeout
+
+        while (self.pending or self.unconfirmed) and time.monotonic() < deadline:
+            time.sleep(.1)
+
+        if self.pending or self.unconfirmed:
+            self.logger.error('Error: %s relay message(s) to %s were not confirmed before shutdown.', len(self.pending) + len(self.unconfirmed),
+                              self.host)
+
+        # shut down the connection and event loop
+        self.stopping = True
+        self.loop.call_soon_threadsafe(self.shutdown)
+        self.thread.join(timeout)
+
+        # the messages left have failed
+        msgs: list = [self.pending.popleft() for _ in range(len(self.pending))] + [msg for _, msg in self.unconfirmed.values()]
+
+        self.unconfirmed.clear()
+
+        self.finish(msgs, ConnectionError(f'Relay publisher to {self.host} was shut down.'))
+
+    def shutdown(self):
+        """
+        closes the connection on the event loop. the loop stops once the connection is closed
+
+        :return:
+        """
+        if self.connection is not None and self.connection.is_open:
+            self.connection.close()
+        elif self.connection is None:
+            self.loop.stop()
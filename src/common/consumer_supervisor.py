@@ -0,0 +1,119 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Consumer Supervisor - restarts queue consumers when the queue host connection is lost.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import os
+import time
+import random
+
+from src.common.logger import LoggingUtil
+
+
+class ConsumerSupervisor:
+    """
+    Runs a queue consumer and starts it again, with a jittered exponential backoff, each time it stops.
+
+    The consumer calls on_connected() once its channels and consumers are set up. this resets the backoff
+    and adds the time spent without a connection to the downtime counter.
+    """
+
+    def __init__(self, _logger=None):
+        """
+        init the consumer supervisor object
+
+        :param _logger:
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.Msg-Handler.ConsumerSupervisor", level=log_level, line_format='medium',
+                                                   log_file_path=log_path)
+
+        # get the backoff limits in seconds and the number of failed attempts in a row before giving up (0 is never)
+        self.base_delay: float = float(os.environ.get('RECONNECT_BASE_DELAY', '1'))
+        self.max_delay: float = float(os.environ.get('RECONNECT_MAX_DELAY', '60'))
+        self.max_attempts: int = int(os.environ.get('RECONNECT_MAX_ATTEMPTS', '0'))
+
+        # the number of reconnects and the total seconds spent without a connection
+        self.reconnects: int = 0
+        self.downtime: float = 0
+
+        # when the connection was lost and the number of failed attempts since
+        self.down_since = None
+        self.attempts: int = 0
+
+    def run(self, consume, name: str):
+        """
+        runs the consumer until it stops, then backs off and runs it again
+
+        :param consume: a function that consumes queue messages until the connection is lost
+        :param name: the name of the consumer for logging
+        :return:
+        """
+        while True:
+            # consume messages until the connection is lost
+            consume()
+
+            # start the downtime clock if it is not already running
+            if self.down_since is None:
+                self.down_since = time.monotonic()
+
+            # one more failed attempt
+            self.attempts += 1
+
+            # have we run out of attempts
+            if 0 < self.max_attempts <= self.attempts:
+                self.logger.error('Error: %s consumer stopped after %s reconnect attempt(s). Giving up.', name, self.attempts)
+                return
+
+            # get the backoff time. half of it is random so that a group of consumers do not all reconnect at the same moment
+            delay: float = min(self.max_delay, self.base_delay * 2 ** (self.attempts - 1))
+            delay = delay / 2 + random.uniform(0, delay / 2)
+
+            self.logger.warning('%s consumer stopped. Reconnecting in %.1f second(s). attempt: %s, reconnects: %s, downtime: %.1f second(s).',
+                                name, delay, self.attempts, self.reconnects, self.get_downtime())
+
+            # wait and try again
+            time.sleep(delay)
+
+            self.reconnects += 1
+
+    def on_connected(self):
+        """
+        resets the backoff once the consumer is connected and updates the downtime
+
+        :return:
+        """
+        # was the connection lost
+        if self.down_since is not None:
+            # add the time without a connection to the total
+            self.downtime += time.monotonic() - self.down_since
+            self.down_since = None
+
+            self.logger.info('Consumer reconnected. reconnects: %s, downtime: %.1f second(s).', self.reconnects, self.downtime)
+
+        # start the backoff over
+        self.attempts = 0
+
+    def get_downtime(self) -> float:
+        """
+        gets the total seconds spent without a connection, including the current outage
+
+        :return:
+        """
+        return self.downtime + (time.monotonic() - self.down_since if self.down_since is not None else 0)
@@ -0,0 +1,276 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Dedup Cache - skips queue messages that have already been handled.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+from src.common.logger import LoggingUtil
+
+
+class DedupCache:
+    """
+    Remembers the fingerprints (content hashes) of the messages that were handled successfully so that redelivered
+    or resent copies are acknowledged and skipped without touching the DB.
+
+    The cache holds at most DEDUP_MAX_SIZE fingerprints for at most DEDUP_WINDOW_SECS seconds. If DEDUP_CACHE_PATH is
+    set the fingerprints are also appended to that file so they survive a restart.
+    """
+
+    def __init__(self, _logger=None):
+        """
+        init the dedup cache object
+
+        :param _logger:
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.Msg-Handler.DedupCache", level=log_level, line_format='medium', log_file_path=log_path)
+
+        # get the flag that turns on the dedup cache
+        self.enabled: bool = os.environ.get('DEDUP_ENABLED', 'False').lower() in ('true', '1', 't')
+
+        # get the cache limits
+        self.max_size: int = max(int(os.environ.get('DEDUP_MAX_SIZE', '10000')), 1)
+        self.window_secs: int = int(os.environ.get('DEDUP_WINDOW_SECS', '3600'))
+
+        # the fingerprints and the time they were added, oldest first
+        self.fingerprints: OrderedDict = OrderedDict()
+
+        # protects the fingerprints, messages may be handled on worker threads
+        self.lock: threading.Lock = threading.Lock()
+
+        # the file the fingerprints are saved to and the number of lines in it
+        self.path: str = os.environ.get('DEDUP_CACHE_PATH', '')
+        self.file_lines: int = 0
+
+        # load the fingerprints saved by the last run
+        if self.enabled and self.path:
+            self.load()
+
+    @staticmethod
+    def get_fingerprint(queue_name: str, body: bytes) -> str:
+        """
+        gets the fingerprint of a message
+
+        :param queue_name:
+        :param body:
+        :return:
+        """
+        # make sure we have a byte array
+        if isinstance(body, str):
+            body = body.encode()
+
+        return hashlib.blake2b(queue_name.encode() + b'\0' + body, digest_size=16).hexdigest()
+
+    def wrap(self, queue_name: str, callback):
+        """
+        creates a queue callback that skips messages that have already been handled
+
+        :param queue_name:
+        :param callback:
+        :return:
+        """
+        def on_message(channel, method, properties, body):
+            # get the fingerprint of the message
+            fingerprint: str = self.get_fingerprint(queue_name, body)
+
+            # skip the message if it has already been handled
+            if self.contains(fingerprint):
+                self.logger.info('%s duplicate message skipped.', queue_name)
+                return True
+
+            # handle the message
+            ret_val = callback(channel, method, properties, body)
+
+            # remember the message if it was handled, failures can be tried again
+            if ret_val is not False:
+                self.add([fingerprint])
+
+            # return the success flag
+            return ret_val
+
+        # return the queue callback
+        return on_message
+
+    def wrap_batch(self, queue_name: str, batch_callback):
+        """
+        creates a batch callback that skips messages that have already been handled
+
+        :param queue_name:
+        :param batch_callback:
+        :return:
+        """
+        def on_batch(bodies: list) -> list:
+            # get the fingerprints of the messages
+            fingerprints: list = [self.get_fingerprint(queue_name, body) for body in bodies]
+
+            # get the messages that have not been handled yet. a message repeated in the batch is only handled once
+            new_indexes: dict = {}
+
+            for index, fingerprint in enumerate(fingerprints):
+                if fingerprint not in new_indexes and not self.contains(fingerprint):
+                    new_indexes[fingerprint] = index
+
+            # duplicates count as handled
+            results: list = [True] * len(bodies)
+
+            if len(new_indexes) < len(bodies):
+                self.logger.info('%s %s duplicate message(s) skipped.', queue_name, len(bodies) - len(new_indexes))
+
+            # handle the new messages
+            if new_indexes:
+                new_results = batch_callback([bodies[index] for index in new_indexes.values()])
+
+                # the batch callback may not return results
+                new_results = new_results if new_results is not None else [True] * len(new_indexes)
+
+                # save the results of the new messages
+                for index, result in zip(new_indexes.values(), new_results):
+                    results[index] = result
+
+                # remember the messages that were handled
+                self.add([fingerprint for fingerprint, result in zip(new_indexes, new_results) if result is not False])
+
+            # return the success flags
+            return results
+
+        # return the batch callback
+        return on_batch
+
+    def contains(self, fingerprint: str) -> bool:
+        """
+        checks if a fingerprint is in the cache
+
+        :param fingerprint:
+        :return:
+        """
+        with self.lock:
+            # remove the expired fingerprints
+            self.expire()
+
+            return fingerprint in self.fingerprints
+
+    def add(self, fingerprints: list):
+        """
+        adds fingerprints to the cache and saves them
+
+        :param fingerprints:
+        :return:
+        """
+        # get the time they were added
+        now: float = time.time()
+
+        with self.lock:
+            for fingerprint in fingerprints:
+                self.fingerprints[fingerprint] = now
+                self.fingerprints.move_to_end(fingerprint)
+
+            # remove the oldest fingerprints if the cache is full
+            while len(self.fingerprints) > self.max_size:
+                self.fingerprints.popitem(last=False)
+
+            # save the fingerprints
+            if self.path and fingerprints:
+                self.save(fingerprints, now)
+
+    def expire(self):
+        """
+        removes the fingerprints that are older than the window. the lock must be held.
+
+        :return:
+        """
+        # get the oldest time allowed
+        oldest: float = time.time() - self.window_secs
+
+        # the fingerprints are in the order they were added
+        while self.fingerprints and next(iter(self.fingerprints.values())) < oldest:
+            self.fingerprints.popitem(last=False)
+
+    def load(self):
+        """
+        loads the fingerprints saved by the last run and compacts the file
+
+        :return:
+        """
+        try:
+            # is there anything to load
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as cache_file:
+                    # each line has the fingerprint and the time it was added
+                    for line in cache_file:
+                        items: list = line.split()
+
+                        # skip a partly written line
+                        if len(items) == 2:
+                            self.fingerprints[items[0]] = float(items[1])
+                            self.fingerprints.move_to_end(items[0])
+
+                # drop the expired and extra fingerprints
+                self.expire()
+
+                while len(self.fingerprints) > self.max_size:
+                    self.fingerprints.popitem(last=False)
+
+                self.logger.info('%s message fingerprint(s) loaded from %s.', len(self.fingerprints), self.path)
+
+            # rewrite the file with only the current fingerprints
+            self.compact()
+        except Exception:
+            # the cache still works, it just starts out empty
+            self.logger.exception('Error: Could not load the message fingerprints from %s.', self.path)
+
+            self.fingerprints.clear()
+
+    def save(self, fingerprints: list, added: float):
+        """
+        appends fingerprints to the file. the lock must be held.
+
+        :param fingerprints:
+        :param added:
+        :return:
+        """
+        try:
+            # the file is compacted once it has grown to twice the cache size
+            if self.file_lines + len(fingerprints) > self.max_size * 2:
+                self.compact()
+            else:
+                with open(self.path, 'a', encoding='utf-8') as cache_file:
+                    cache_file.writelines(f'{fingerprint} {added}\n' for fingerprint in fingerprints)
+
+                self.file_lines += len(fingerprints)
+        except Exception:
+            self.logger.exception('Error: Could not save the message fingerprints to %s.', self.path)
+
+    def compact(self):
+        """
+        rewrites the file with the fingerprints in the cache
+
+        :return:
+        """
+        # write the file next to the old one and swap them
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as cache_file:
+            cache_file.writelines(f'{fingerprint} {added}\n' for fingerprint, added in self.fingerprints.items())
+
+        os.replace(self.path + '.tmp', self.path)
+
+        self.file_lines = len(self.fingerprints)
@@ -0,0 +1,128 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    ID Cache - a bounded, thread-safe cache of DB record ids.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class IDCache:
+    """
+    Remembers the DB id found for a key so the DB does not have to be asked again.
+
+    The cache holds at most max_size ids, the least recently used are removed first. an id is only used for ttl
+    seconds after it was saved. the hits and misses are counted.
+    """
+
+    def __init__(self, name: str, max_size: int, ttl: float):
+        """
+        init the ID cache object
+
+        :param name: the name of the ids, used in the stats
+        :param max_size: the most ids to keep, 0 turns the cache off
+        :param ttl: the number of seconds an id can be used
+        """
+        # save the name and limits
+        self.name: str = name
+        self.max_size: int = max(max_size, 0)
+        self.ttl: float = ttl
+
+        # the ids and the time they were saved, least recently used first
+        self.ids: OrderedDict = OrderedDict()
+
+        # the lookup counters
+        self.hits: int = 0
+        self.misses: int = 0
+
+        # protects the ids, messages may be handled on worker threads
+        self.lock: threading.Lock = threading.Lock()
+
+    def get(self, key):
+        """
+        gets the id saved for a key and counts the hit or miss
+
+        :param key:
+        :return: the id, None if it is not cached or has expired
+        """
+        with self.lock:
+            # get the id and the time it was saved
+            cached = self.ids.get(key)
+
+            # drop it if it has expired
+            if cached is not None and time.monotonic() - cached[1] > self.ttl:
+                del self.ids[key]
+
+                cached = None
+
+            # count the lookup
+            if cached is None:
+                self.misses += 1
+
+                return None
+
+            self.hits += 1
+
+            # it was just used, it goes to the end of the line
+            self.ids.move_to_end(key)
+
+            return cached[0]
+
+    def put(self, key, _id: int):
+        """
+        saves the id for a key. a missing id removes the key instead.
+
+        :param key:
+        :param _id:
+        :return:
+        """
+        with self.lock:
+            # the next lookup goes to the DB
+            if _id is None or _id < 0 or self.max_size == 0:
+                self.ids.pop(key, None)
+
+                return
+
+            # save the id
+            self.ids[key] = (_id, time.monotonic())
+            self.ids.move_to_end(key)
+
+            # remove the least recently used ids if the cache is full
+            while len(self.ids) > self.max_size:
+                self.ids.popitem(last=False)
+
+    def remove(self, key):
+        """
+        removes the id saved for a key
+
+        :param key:
+        :return:
+        """
+        with self.lock:
+            self.ids.pop(key, None)
+
+    def clear(self):
+        """
+        removes all the ids
+
+        :return:
+        """
+        with self.lock:
+            self.ids.clear()
+
+    def get_stats(self) -> str:
+        """
+        gets the cache counters for logging
+
+        :return:
+        """
+        return f"{self.name} cache size: {len(self.ids)}, hits: {self.hits}, misses: {self.misses}"
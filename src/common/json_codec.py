@@ -0,0 +1,60 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    JSON Codec - decodes and encodes queue messages with the fastest JSON library available.
+
+    orjson is used when it is installed, otherwise the standard library json module is used.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# the name of the JSON library in use
+CODEC_NAME: str = 'orjson' if orjson is not None else 'json'
+
+
+def loads(body):
+    """
+    decodes a message body
+
+    :param body: the message as bytes or a string
+    :return:
+    """
+    # use the fast library if we have it
+    if orjson is not None:
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            # the standard library is more lenient (NaN, Infinity, etc.). it raises the error if the message is really bad
+            pass
+
+    return json.loads(body)
+
+
+def dumps(obj) -> bytes:
+    """
+    encodes an object into a message body
+
+    :param obj:
+    :return: the message as bytes
+    """
+    # use the fast library if we have it
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # the standard library handles some types orjson does not (int keys, very large ints, etc.)
+            pass
+
+    return json.dumps(obj).encode()
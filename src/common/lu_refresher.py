@@ -0,0 +1,286 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Lookup Refresher - keeps the in-memory lookup table data current.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import os
+import time
+import select
+import threading
+
+import psycopg2
+
+from src.common import json_codec
+from src.common.logger import LoggingUtil
+
+
+def is_lu_data(lu_data) -> bool:
+    """
+    checks that all the lookup data was loaded
+
+    :param lu_data:
+    :return:
+    """
+    return isinstance(lu_data, dict) and len(lu_data) > 0 and all(isinstance(items, dict) for items in lu_data.values())
+
+
+def load_snapshot(path: str, logger):
+    """
+    loads the lookup data saved by the last run
+
+    :param path:
+    :param logger:
+    :return: the lookup data, None if there is no good snapshot
+    """
+    try:
+        # is there anything to load
+        if os.path.exists(path):
+            with open(path, 'rb') as snapshot_file:
+                lu_data = json_codec.loads(snapshot_file.read())
+
+            # make sure it is all there
+            if is_lu_data(lu_data):
+                logger.info('Lookup data loaded from the snapshot %s.', path)
+
+                return lu_data
+
+            logger.warning('Lookup data snapshot %s is not complete. It will not be used.', path)
+    except Exception:
+        logger.exception('Error: Could not load the lookup data snapshot %s.', path)
+
+    # there is no good snapshot
+    return None
+
+
+def save_snapshot(path: str, lu_data: dict, logger):
+    """
+    saves the lookup data for the next run
+
+    :param path:
+    :param lu_data:
+    :param logger:
+    :return:
+    """
+    try:
+        # write the file next to the old one and swap them so a partly written file is never loaded
+        with open(path + '.tmp', 'wb') as snapshot_file:
+            snapshot_file.write(json_codec.dumps(lu_data))
+
+        os.replace(path + '.tmp', path)
+    except Exception:
+        logger.exception('Error: Could not save the lookup data snapshot %s.', path)
+
+
+def reload_lu_data(db_info, logger) -> bool:
+    """
+    loads the lookup data from the DB and swaps it in. the current data is kept if any of it cannot be loaded.
+
+    :param db_info: the PGImplementation object that has the lookup data
+    :param logger:
+    :return: True if the data was reloaded
+    """
+    try:
+        # load the new data
+        lu_data: dict = db_info.build_constants()
+
+        # make sure it all loaded
+        if not is_lu_data(lu_data):
+            logger.error('Error: Lookup data could not be loaded. Keeping the current lookup data.')
+
+            return False
+
+        # save it for the next run if it changed
+        if db_info.lu_snapshot_path and lu_data != db_info.legacy_constants:
+            save_snapshot(db_info.lu_snapshot_path, lu_data, logger)
+
+        # swap it in
+        db_info.legacy_constants = lu_data
+
+        logger.debug('Lookup data reloaded.')
+
+        return True
+    except Exception:
+        logger.exception('Error: Lookup data could not be reloaded. Keeping the current lookup data.')
+
+    return False
+
+
+class LookupRefresher:
+    """
+    Reloads the lookup table data of a DB object on a background thread so the message handlers never wait on it.
+
+    The thread listens on the LU_NOTIFY_CHANNEL channel for the notifications sent when a lookup table changes
+    (see src/sql/notify_lu_change.sql). A lookup miss can also ask for a reload, at most once every
+    LU_RELOAD_MIN_INTERVAL seconds. The new data is loaded off to the side and swapped in with a single
+    assignment so a lookup sees either all the old data or all the new data.
+    """
+
+    def __init__(self, db_info, _logger=None):
+        """
+        init the lookup refresher object and start listening
+
+        :param db_info: the PGImplementation object that has the lookup data
+        :param _logger:
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.Msg-Handler.LookupRefresher", level=log_level, line_format='medium',
+                                                   log_file_path=log_path)
+
+        # save the DB object
+        self.db_info = db_info
+
+        # get the notification channel and the least time between reloads requested by a lookup miss
+        self.channel: str = os.environ.get('LU_NOTIFY_CHANNEL', 'apsviz_lu_change')
+        self.min_interval: float = float(os.environ.get('LU_RELOAD_MIN_INTERVAL', '60'))
+
+        # the time of the last reload requested by a lookup miss. the data was just loaded
+        self.last_request: float = time.monotonic()
+
+        # protects the last request time
+        self.lock: threading.Lock = threading.Lock()
+
+        # the connection that listens for the notifications and if there has been one before
+        self.conn = None
+        self.reconnect: bool = False
+
+        # start the listener
+        self.reload_requested: threading.Event = threading.Event()
+        self.stopped: threading.Event = threading.Event()
+        self.thread: threading.Thread = threading.Thread(target=self.run, name='lu-refresher', daemon=True)
+        self.thread.start()
+
+    def request_reload(self) -> bool:
+        """
+        asks for the lookup data to be reloaded. this does not wait for the reload.
+
+        :return: True if a reload was requested, False if one was requested too recently
+        """
+        with self.lock:
+            # only one reload per interval
+            if time.monotonic() - self.last_request < self.min_interval:
+                return False
+
+            self.last_request = time.monotonic()
+
+        self.logger.info('Lookup miss, reloading the lookup data.')
+
+        # wake up the listener
+        self.reload_requested.set()
+
+        return True
+
+    def run(self):
+        """
+        listens for the lookup table notifications and reloads the lookup data when asked
+
+        :return:
+        """
+        # until stopped
+        while not self.stopped.is_set():
+            try:
+                # subscribe to the notifications if needed
+                if self.conn is None:
+                    self.listen()
+
+                # wait a bit for a notification
+                if select.select([self.conn], [], [], 1)[0]:
+                    # get the notifications
+                    self.conn.poll()
+
+                    if self.conn.notifies:
+                        self.logger.info('Lookup table(s) %s changed, reloading the lookup data.', {notify.payload for notify in self.conn.notifies})
+
+                        self.conn.notifies.clear()
+
+                        self.reload_requested.set()
+            except Exception:
+                self.logger.exception('Error: Lookup table notifications failed on channel %s. Reconnecting.', self.channel)
+
+                # start over with a new connection after a bit. a reload can still be done while waiting
+                self.close()
+
+                self.reload_requested.wait(5)
+
+            # reload the lookup data if asked
+            if self.reload_requested.is_set() and not self.stopped.is_set():
+                self.reload_requested.clear()
+
+                self.reload()
+
+    def listen(self):
+        """
+        opens the connection and subscribes to the notifications
+
+        :return:
+        """
+        # open a connection for the notifications only, it is not part of the pool
+        conn = psycopg2.connect(self.db_info.get_conn_config('apsviz'))
+        conn.autocommit = True
+
+        with conn.cursor() as cursor:
+            cursor.execute(f'LISTEN "{self.channel}"')
+
+        self.conn = conn
+
+        self.logger.debug('Listening for lookup table changes on channel %s.', self.channel)
+
+        # changes made while there was no connection were missed
+        if self.reconnect:
+            self.reload_requested.set()
+
+        self.reconnect = True
+
+    def reload(self):
+        """
+        loads the lookup data and swaps it in
+
+        :return:
+        """
+        reload_lu_data(self.db_info, self.logger)
+
+    def close(self):
+        """
+        closes the notification connection
+
+        :return:
+        """
+        try:
+            if self.conn is not None:
+                self.conn.close()
+        except Exception:
+            self.logger.warning('Error detected closing the lookup table notification connection.')
+
+        self.conn = None
+
+    def stop(self):
+        """
+        stops listening
+
+        :return:
+        """
+        self.stopped.set()
+
+        # wake up the listener if it is waiting to reconnect
+        self.reload_requested.set()
+
+        # wait for the listener to finish
+        if self.thread is not threading.current_thread():
+            self.thread.join(5)
+
+        self.close()
@@ -0,0 +1,167 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Msg Batcher - collects queue messages into micro-batches.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+from src.common.logger import LoggingUtil
+from src.common.ack_batcher import AckBatcher
+
+
+class MsgBatcher:
+    """
+    Collects queue messages and hands them to a batch callback every batch_size messages or
+    batch_ms milliseconds, whichever comes first.
+
+    The messages of a batch are only acknowledged after the batch callback returns.
+
+    Note: all methods of this class must be called on the connection's I/O thread.
+    """
+
+    def __init__(self, batch_size: int, batch_ms: int, on_failure=None, _logger=None):
+        """
+        init the msg batcher object
+
+        :param batch_size: the number of messages that triggers a batch
+        :param batch_ms: the maximum time in milliseconds a message waits for its batch
+        :param on_failure: if passed, this is called with the properties and body of each message the batch callback failed
+        :param _logger:
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.Msg-Handler.MsgBatcher", level=log_level, line_format='medium', log_file_path=log_path)
+
+        # save the batching limits
+        self.batch_size: int = max(batch_size, 1)
+        self.batch_ms: int = max(batch_ms, 0)
+
+        # save the failed message handler
+        self.on_failure = on_failure
+
+        # the batch callback and the ack batcher. these are set in wrap()
+        self.batch_callback = None
+        self.ack_batcher = None
+
+        # the channel the messages came in on. this is bound on the first message received
+        self.channel = None
+
+        # the delivery tags, properties and bodies of the messages in the current batch
+        self.msgs: list = []
+
+        # the handle to the pending batch timer
+        self.timer = None
+
+    def wrap(self, batch_callback, ack_batcher=None):
+        """
+        creates a queue callback that adds the messages to the batches handled by the batch callback.
+
+        :param batch_callback: a callback that takes a list of message bodies and returns a success flag for each
+        :param ack_batcher: if passed, the messages are acknowledged once the batch callback returns
+        :return:
+        """
+        # save the batch handling details
+        self.batch_callback = batch_callback
+        self.ack_batcher = ack_batcher
+
+        # return the queue callback
+        return self.on_message
+
+    def on_message(self, channel, method, properties, body):
+        """
+        adds a message to the current batch
+
+        :param channel:
+        :param method:
+        :param properties:
+        :param body:
+        :return:
+        """
+        # start tracking this message so acks are issued in delivery order
+        if self.ack_batcher is not None:
+            self.ack_batcher.track(channel, method.delivery_tag)
+
+        # bind the channel on the first message
+        self.channel = channel
+
+        # add the message to the batch
+        self.msgs.append((method.delivery_tag, properties, body))
+
+        # have we reached the batch size limit
+        if len(self.msgs) >= self.batch_size:
+            self.flush()
+        # else make sure the batch gets handled in time
+        elif self.timer is None:
+            self.timer = AckBatcher.call_later(channel.connection, self.batch_ms / 1000, self.on_timer)
+
+    def on_timer(self):
+        """
+        handles the current batch when the batch time limit expires
+
+        :return:
+        """
+        # the timer has fired
+        self.timer = None
+
+        # handle the batch
+        self.flush()
+
+    def flush(self):
+        """
+        hands the current batch to the batch callback and then acknowledges its messages
+
+        :return:
+        """
+        # cancel any pending timer
+        if self.timer is not None:
+            AckBatcher.remove_timer(self.channel.connection, self.timer)
+            self.timer = None
+
+        # get the batch and start a new one
+        msgs: list = self.msgs
+        self.msgs = []
+
+        # is there anything to handle
+        if msgs:
+            try:
+                # handle the batch
+                results = self.batch_callback([body for _, _, body in msgs])
+
+                # hand off the messages that failed
+                if self.on_failure is not None and results is not None:
+                    for (_, properties, body), result in zip(msgs, results):
+                        if result is False:
+                            self.on_failure(properties, body)
+            except Exception:
+                self.logger.exception("Error: Exception handling a batch of %s message(s).", len(msgs))
+            finally:
+                # the messages have been handled, they can now be acknowledged
+                if self.ack_batcher is not None:
+                    for delivery_tag, _, _ in msgs:
+                        self.ack_batcher.complete(delivery_tag)
+
+    def stop(self):
+        """
+        handles the messages waiting in the current batch
+
+        :return:
+        """
+        try:
+            # handle the batch
+            self.flush()
+        except Exception:
+            # any unacknowledged messages will be redelivered by the broker
+            self.logger.exception("Error: Exception handling the last batch of messages.")
@@ -0,0 +1,148 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Message Schemas - typed, validated forms of the ECFlow run time status and run properties messages.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import datetime
+
+from src.common import json_codec
+
+
+def get_time_stamp() -> str:
+    """
+    gets the time stamp used when a message does not have a date-time
+
+    :return:
+    """
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+
+
+def get_value(msg_obj: dict, key: str, default):
+    """
+    gets a message value, an empty value gets the default
+
+    :param msg_obj:
+    :param key:
+    :param default:
+    :return:
+    """
+    # get the value
+    value = msg_obj.get(key, default)
+
+    # empty strings are treated as missing
+    return default if value == "" else value
+
+
+def get_process_id(msg_obj: dict) -> int:
+    """
+    gets the process id (uid) of a message
+
+    :param msg_obj:
+    :return:
+    """
+    try:
+        return int(get_value(msg_obj, "uid", 0))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid uid in message: {msg_obj.get('uid')}") from e
+
+
+class RunTimeStatusMsg:
+    """
+    An ECFlow run time status message.
+
+    The message is validated and all the defaults (including the date-time fallback) are resolved once when it is
+    created so the DB calls can use the values as is.
+    """
+
+    __slots__ = ('physical_location', 'event_type', 'state', 'process_id', 'instance_name', 'date_time', 'advisory_id', 'storm_name',
+                 'storm_number', 'process', 'run_params', 'sub_pct_complete', 'message')
+
+    def __init__(self, msg_obj: dict):
+        """
+        init the run time status message object
+
+        :param msg_obj: the loaded message
+        """
+        # the message must be a json object
+        if not isinstance(msg_obj, dict):
+            raise ValueError(f"Run time status message is not a JSON object: {type(msg_obj).__name__}")
+
+        # the lookup names, these are checked against the lookup tables
+        self.physical_location = msg_obj.get("physical_location", "")
+        self.event_type = msg_obj.get("event_type", "")
+        self.state = msg_obj.get("state", "")
+
+        # the run identifiers
+        self.process_id: int = get_process_id(msg_obj)
+        self.instance_name = get_value(msg_obj, "instance_name", "N/A")
+
+        # the time of the status, now if the message does not have one
+        self.date_time = get_value(msg_obj, "date-time", None) or get_time_stamp()
+
+        # the storm and run details
+        self.advisory_id = get_value(msg_obj, "advisory_number", "N/A")
+        self.storm_name = get_value(msg_obj, "storm", "N/A")
+        self.storm_number = get_value(msg_obj, "storm_number", "N/A")
+        self.process = get_value(msg_obj, "process", "N/A")
+        self.run_params = get_value(msg_obj, "run_params", "N/A")
+
+        # the sub percent complete, None uses the percent complete of the event type
+        self.sub_pct_complete = msg_obj.get("subpctcomplete")
+
+        # the status text, None if there is none
+        self.message = msg_obj.get("message") or None
+
+    @classmethod
+    def decode(cls, body):
+        """
+        decodes and validates a run time status message body
+
+        :param body:
+        :return:
+        """
+        return cls(json_codec.loads(body))
+
+
+class RunPropsMsg:
+    """
+    An ECFlow or HEC/RAS run properties message that has been mapped to the legacy params.
+
+    The params are kept as is for the config items, the values used to find and create the instance are resolved
+    once when it is created.
+    """
+
+    __slots__ = ('params', 'physical_location', 'process_id', 'instance_name', 'date_time', 'run_params')
+
+    def __init__(self, params: dict):
+        """
+        init the run properties message object
+
+        :param params: the message params, extended to the legacy equivalents
+        """
+        # the message must be a json object
+        if not isinstance(params, dict):
+            raise ValueError(f"Run properties message is not a JSON object: {type(params).__name__}")
+
+        # save the params for the config items
+        self.params: dict = params
+
+        # the location, this is checked against the site lookup table
+        self.physical_location = params.get("physical_location", "")
+
+        # the run identifiers
+        self.process_id: int = get_process_id(params)
+        self.instance_name = get_value(params, "instance_name", "N/A")
+
+        # the time of the run, now if the message does not have one
+        self.date_time = get_value(params, "date-time", None) or get_time_stamp()
+
+        # the run params
+        self.run_params = get_value(params, "run_params", "N/A")
@@ -0,0 +1,153 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Message Transformer - maps run properties params to their legacy equivalents and reformats them.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+from enum import Enum
+
+from src.common.logger import LoggingUtil
+
+
+class ReformatType(int, Enum):
+    """
+    Enum class that defines the system that needs to be synchronized
+    with a copy/move/remove operation
+    """
+    SENTENCE_CASE = 1
+    UPPERCASE = 2
+    LOWERCASE = 3
+    INTEGER = 4
+    FLOAT = 5
+    STRING = 6
+    MAKE_INT = 7
+
+
+def make_int(param: str) -> str:
+    """
+    strips off all non-numeric characters and pads what is left to 2 digits
+
+    :param param:
+    :return:
+    """
+    # strip off all non-numeric characters
+    val = "".join(n for n in param if n.isnumeric())
+
+    # check to see if a number is left. if so, pad it, else this is not a number
+    return val.rjust(2, '0') if val.isnumeric() else 'NaN'
+
+
+# the function that does each type of reformatting. a new type only needs an entry here
+REFORMATTERS: dict = {ReformatType.INTEGER: lambda param: str(int(param)) if param.isdigit() else param,
+                      ReformatType.FLOAT: lambda param: str(float(param)) if param.replace('.', '1').replace('e', '1').isdigit() else param,
+                      ReformatType.UPPERCASE: lambda param: param.upper(), ReformatType.LOWERCASE: lambda param: param.lower(),
+                      ReformatType.SENTENCE_CASE: lambda param: param[:1].upper() + param[1:].lower(),
+                      ReformatType.STRING: str, ReformatType.MAKE_INT: make_int}
+
+
+class MsgTransformer:
+    """
+    Compiles the legacy mapping and reformatting tables into plans that build the new params in a single pass.
+
+    Each plan step is an output key, the message keys its value can come from (highest priority first) and the
+    reformatting to apply to it. The output starts as a copy of the message and only the keys in the plan are
+    looked at after that.
+    """
+
+    def __init__(self, extend_params: dict, transform_params: dict, _logger=None):
+        """
+        init the message transformer object
+
+        :param extend_params: a dict of message key: list of legacy keys that get its value
+        :param transform_params: a dict of key: ReformatType
+        :param _logger:
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.Msg-Handler.MsgTransformer", level=log_level, line_format='medium', log_file_path=log_path)
+
+        # get the reformatting function for each key
+        reformatters: dict = {}
+
+        for key, reformat_type in transform_params.items():
+            if reformat_type in REFORMATTERS:
+                reformatters[key] = (reformat_type, REFORMATTERS[reformat_type])
+            else:
+                self.logger.error("Invalid conversion type found.")
+
+        # get the message keys each legacy key gets its value from. a key mapped from more than one gets the last one
+        sources: dict = {}
+
+        for key, new_keys in extend_params.items():
+            for new_key in new_keys:
+                sources.setdefault(new_key, [new_key]).append(key)
+
+        # compile the plans for mapping, reformatting and both
+        self.extend_plan: tuple = tuple((new_key, tuple(reversed(keys)), None) for new_key, keys in sources.items())
+
+        self.transform_plan: tuple = tuple((key, (key,), reformatter) for key, reformatter in reformatters.items())
+
+        self.plan: tuple = tuple((new_key, tuple(reversed(keys)), reformatters.get(new_key)) for new_key, keys in sources.items()) + \
+            tuple((key, (key,), reformatter) for key, reformatter in reformatters.items() if key not in sources)
+
+    def run(self, run_params: dict, plan: tuple = None) -> dict:
+        """
+        builds the new params with a plan
+
+        :param run_params:
+        :param plan: the plan to use, the mapping and reformatting plan by default
+        :return:
+        """
+        # save the entire incoming dict into the return
+        ret_val: dict = run_params.copy()
+
+        # for each key the plan changes
+        for key, sources, reformatter in self.plan if plan is None else plan:
+            # get the value from the first source in the message
+            for source in sources:
+                if source in run_params:
+                    value = run_params[source]
+                    break
+            else:
+                # nothing to map or reformat
+                continue
+
+            # save the value, reformatted if needed
+            ret_val[key] = self.reformat(key, value, reformatter) if reformatter is not None else value
+
+        # return the new set of transformed params
+        return ret_val
+
+    def reformat(self, key: str, param, reformatter: tuple):
+        """
+        reformats a param value
+
+        :param key:
+        :param param:
+        :param reformatter: the ReformatType and its function
+        :return: the new value, the old value if it could not be reformatted
+        """
+        try:
+            # make sure there is something to reformat. if not just skip it...
+            if param is not None and len(param) > 0:
+                return reformatter[1](param)
+        except Exception:
+            # log the exception
+            self.logger.error('Error: Could not convert %s value %s into %s.', key, param, reformatter[0])
+
+        # return the value as is
+        return param
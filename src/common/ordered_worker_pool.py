@@ -0,0 +1,153 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Ordered Worker Pool - processes queue messages on worker threads, in order per shard key.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import os
+import time
+import zlib
+import queue
+import threading
+
+from src.common.logger import LoggingUtil
+
+
+class OrderedWorkerPool:
+    """
+    Shards queue messages over a set of worker threads using a key taken from the message.
+
+    All messages with the same key are handled by the same worker thread, so they are processed
+    strictly in the order they were received. Messages with different keys are processed in parallel.
+    """
+
+    def __init__(self, worker_count: int, shard_key, name: str = 'worker', _logger=None):
+        """
+        init the worker pool object and start the worker threads
+
+        :param worker_count: the number of worker threads
+        :param shard_key: a function that returns the shard key for a message body
+        :param name: the name prefix for the worker threads
+        :param _logger:
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.Msg-Handler.OrderedWorkerPool", level=log_level, line_format='medium',
+                                                   log_file_path=log_path)
+
+        # save the function that gets the key from a message
+        self.shard_key = shard_key
+
+        # get the number of seconds to wait for the workers to finish when stopping
+        self.stop_timeout: float = float(os.environ.get('WORKER_STOP_TIMEOUT', '30'))
+
+        # create a work queue for each worker
+        self.work_queues: list = [queue.Queue() for _ in range(max(worker_count, 1))]
+
+        # create and start the workers
+        self.workers: list = [threading.Thread(target=self.work, args=(work_queue,), name=f'{name}-{index}', daemon=True)
+                              for index, work_queue in enumerate(self.work_queues)]
+
+        for worker in self.workers:
+            worker.start()
+
+    def wrap(self, callback, ack_batcher=None):
+        """
+        wraps a queue callback so that its messages are handed to the worker threads.
+
+        :param callback:
+        :param ack_batcher: if passed, messages are acknowledged once the callback returns
+        :return:
+        """
+        def on_message(channel, method, properties, body):
+            # start tracking this message so acks are issued in delivery order
+            if ack_batcher is not None:
+                ack_batcher.track(channel, method.delivery_tag)
+
+            # hand the message to the worker that owns this key
+            self.submit(self.shard_key(body), (callback, ack_batcher, channel, method, properties, body))
+
+        # return the wrapped callback
+        return on_message
+
+    def submit(self, key: str, item: tuple):
+        """
+        adds a work item to the work queue of the worker that owns the key
+
+        :param key:
+        :param item:
+        :return:
+        """
+        # use a stable hash of the key to select the worker
+        self.work_queues[zlib.crc32(key.encode()) % len(self.work_queues)].put(item)
+
+    def work(self, work_queue: queue.Queue):
+        """
+        the worker thread loop. processes the work items in the order they were received.
+
+        :param work_queue:
+        :return:
+        """
+        while True:
+            # get the next work item
+            item = work_queue.get()
+
+            # a None item signals the worker to stop
+            if item is None:
+                break
+
+            # get the work item details
+            callback, ack_batcher, channel, method, properties, body = item
+
+            try:
+                # process the message
+                callback(channel, method, properties, body)
+            except Exception:
+                self.logger.exception("Error: Exception processing a message on worker %s.", threading.current_thread().name)
+            finally:
+                # hand the ack back to the connection's I/O thread
+                if ack_batcher is not None:
+                    ack_batcher.complete_threadsafe(method.delivery_tag)
+
+    def stop(self, timeout: float = None) -> bool:
+        """
+        stops the worker threads once the work already queued is done. the wait is bounded, the shards still
+        running after it are logged and left to finish on their own.
+
+        :param timeout: the number of seconds to wait for all the workers, WORKER_STOP_TIMEOUT if not passed
+        :return: True if all the workers finished
+        """
+        # signal each worker to stop
+        for work_queue in self.work_queues:
+            work_queue.put(None)
+
+        # all the workers share the same deadline
+        deadline: float = time.monotonic() + (self.stop_timeout if timeout is None else timeout)
+
+        # wait for the workers to finish
+        for worker in self.workers:
+            worker.join(max(deadline - time.monotonic(), 0))
+
+        # get the workers that are still running and their queued work, not counting the stop signal
+        running: list = [(worker.name, work_queue.qsize() - 1) for worker, work_queue in zip(self.workers, self.work_queues) if worker.is_alive()]
+
+        # log the shards that did not finish in time
+        for worker_name, queued in running:
+            self.logger.error("Error: Worker %s did not stop in time, %s work item(s) are still queued.", worker_name, queued)
+
+        # return the finished flag
+        return not running
@@ -0,0 +1,227 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    PG Connection Pool - a bounded, thread-safe pool of connections to a DB.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+
+from src.common.logger import LoggingUtil
+
+
+class PGConnectionPool:
+    """
+    Lends DB connections to threads. at most PG_POOL_MAX_SIZE connections are open at once, a thread that
+    needs one when they are all in use waits for one to be returned.
+
+    Connections older than PG_POOL_MAX_LIFETIME seconds are closed when they are returned and connections that
+    have not been used for PG_POOL_MAX_IDLE seconds are closed. a new connection is opened when one is needed.
+    """
+
+    def __init__(self, name: str, connect, _logger=None):
+        """
+        init the connection pool object
+
+        :param name: the name of the DB
+        :param connect: a function that opens a new connection
+        :param _logger:
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.Msg-Handler.PGConnectionPool", level=log_level, line_format='medium',
+                                                   log_file_path=log_path)
+
+        # save the DB name and the function that opens connections
+        self.name: str = name
+        self.connect = connect
+
+        # get the pool limits
+        self.max_size: int = max(int(os.environ.get('PG_POOL_MAX_SIZE', '5')), 1)
+        self.max_lifetime: float = float(os.environ.get('PG_POOL_MAX_LIFETIME', '3600'))
+        self.max_idle: float = float(os.environ.get('PG_POOL_MAX_IDLE', '300'))
+
+        # the connections waiting to be used (connection, time opened, time returned), the most recently returned last
+        self.idle: list = []
+
+        # the time each connection in use was opened
+        self.in_use: dict = {}
+
+        # the number of connections open or being opened
+        self.size: int = 0
+
+        # protects the pool and signals when a connection is returned
+        self.cond: threading.Condition = threading.Condition()
+
+    @contextmanager
+    def connection(self):
+        """
+        lends a connection for the duration of a with block
+
+        :return:
+        """
+        # get a connection
+        conn = self.checkout()
+
+        try:
+            yield conn
+        finally:
+            # give it back
+            self.checkin(conn)
+
+    def checkout(self):
+        """
+        gets a connection from the pool, waiting if they are all in use
+
+        :return:
+        """
+        with self.cond:
+            # close the connections that have not been used in a while
+            self.evict_idle()
+
+            while True:
+                # reuse the most recently returned connection
+                if self.idle:
+                    conn, opened, _ = self.idle.pop()
+                    break
+
+                # open a new one if the pool is not full
+                if self.size < self.max_size:
+                    conn, opened = None, None
+                    self.size += 1
+                    break
+
+                # wait for a connection to be returned
+                self.cond.wait()
+
+        # replace the connection if it is too old or known to be closed. this does not go to the DB, a lost connection
+        # is found when a statement fails (see PGUtilsMultiConnect.exec_autocommit_sql())
+        if conn is not None and (time.monotonic() - opened > self.max_lifetime or conn.closed):
+            self.close(conn)
+
+            conn = None
+
+        try:
+            # open a new connection if needed
+            if conn is None:
+                conn = self.connect()
+                opened = time.monotonic()
+        except Exception:
+            # the space for it is free again
+            self.discard(None)
+            raise
+
+        with self.cond:
+            # keep track of the connection
+            self.in_use[conn] = opened
+
+        # return the connection
+        return conn
+
+    def checkin(self, conn):
+        """
+        returns a connection to the pool
+
+        :param conn:
+        :return:
+        """
+        with self.cond:
+            # get the time the connection was opened
+            opened: float = self.in_use.pop(conn)
+
+            # keep the connection if it is still good
+            if not conn.closed and time.monotonic() - opened <= self.max_lifetime:
+                self.idle.append((conn, opened, time.monotonic()))
+
+                # wake up a thread waiting for a connection
+                self.cond.notify()
+
+                return
+
+        # close the connection and free its space
+        self.discard(conn)
+
+    def discard(self, conn):
+        """
+        closes a connection that is checked out and frees its space in the pool
+
+        :param conn: the connection, None if it was never opened
+        :return:
+        """
+        # close it
+        if conn is not None:
+            self.close(conn)
+
+        with self.cond:
+            # forget about it
+            if conn is not None:
+                self.in_use.pop(conn, None)
+
+            # a new connection can be opened
+            self.size -= 1
+            self.cond.notify()
+
+    def evict_idle(self):
+        """
+        closes the connections that have not been used for the max idle time. the lock must be held.
+
+        :return:
+        """
+        # get the oldest return time allowed
+        oldest: float = time.monotonic() - self.max_idle
+
+        # the idle connections are in the order they were returned
+        while self.idle and self.idle[0][2] < oldest:
+            self.close(self.idle.pop(0)[0])
+            self.size -= 1
+
+    def close(self, conn):
+        """
+        closes a connection
+
+        :param conn:
+        :return:
+        """
+        try:
+            conn.close()
+        except Exception:
+            self.logger.warning('Error detected closing the %s DB connection.', self.name)
+
+    def close_all(self):
+        """
+        closes the idle connections
+
+        :return:
+        """
+        with self.cond:
+            # close each idle connection
+            while self.idle:
+                self.close(self.idle.pop()[0])
+                self.size -= 1
+
+    def commit_all(self):
+        """
+        commits the work on the idle connections that do not auto commit
+
+        :return:
+        """
+        with self.cond:
+            for conn, _, _ in self.idle:
+                if not conn.autocommit:
+                    conn.commit()
@@ -11,11 +11,17 @@
 
     Author: Phil Owen, RENCI.org
 """
-import datetime
+import os
+import hashlib
+import threading
+from collections import OrderedDict
 
 from src.common.pg_utils_multi import PGUtilsMultiConnect
+from src.common.id_cache import IDCache
+from src.common.lu_refresher import LookupRefresher, is_lu_data, load_snapshot, save_snapshot, reload_lu_data
 from src.common.logger import LoggingUtil
 from src.common.queue_utils import QueueUtils
+from src.common.msg_schemas import RunTimeStatusMsg
 
 
 class PGImplementation(PGUtilsMultiConnect):
@@ -26,6 +32,38 @@ class PGImplementation(PGUtilsMultiConnect):
         which has all the connection and cursor handling.
     """
 
+    # the statements run for most messages. these are prepared once per connection (see exec_prepared())
+    # note get_existing_instance_id returns the newest instance when a run has more than one that is not defunct. the original
+    # query had no ORDER BY so the one returned was up to the planner, the newest one is the one a STRT created last.
+    STATEMENTS: dict = {
+        'get_existing_instance_id': 'SELECT id FROM "instance" WHERE site_id=$1 AND process_id=$2 AND instance_name=$3 AND inst_state_type_id!=9 '
+                                    'ORDER BY id DESC',
+        'get_existing_event_group_id': 'SELECT id FROM "event_group" WHERE instance_id=$1 AND advisory_id=$2 ORDER BY id DESC',
+        'update_instance': 'UPDATE "instance" SET inst_state_type_id=$1, end_ts=$2, run_params=$3 WHERE site_id=$4 AND id=$5 RETURNING 1',
+        'insert_instance': 'INSERT INTO "instance" (site_id, process_id, start_ts, end_ts, run_params, instance_name, inst_state_type_id) '
+                           'VALUES ($1, $2, $3, $4, $5, $6, $7) RETURNING id',
+        'insert_event': 'INSERT INTO "event" (site_id, event_group_id, event_type_id, event_ts, advisory_id, pct_complete, sub_pct_complete, '
+                        'process, raw_data) VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9) RETURNING 1',
+        'insert_event_no_msg': 'INSERT INTO "event" (site_id, event_group_id, event_type_id, event_ts, advisory_id, pct_complete, '
+                               'sub_pct_complete, process) VALUES ($1, $2, $3, $4, $5, $6, $7, $8) RETURNING 1',
+        'update_event_group': 'UPDATE "event_group" SET state_type_id=$1, storm_name=$2, advisory_id=$3 WHERE id=$4 RETURNING 1',
+        'insert_event_group': 'INSERT INTO "event_group" (state_type_id, instance_id, event_group_ts, storm_name, storm_number, advisory_id, '
+                              "final_product) VALUES ($1, $2, $3, $4, $5, $6, 'product') RETURNING id",
+        'apply_run_time_status': 'SELECT public.apply_run_time_status($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16)'}
+
+    # the state of an instance that has ended. instances in this state are not reused
+    DEFUNCT_STATE_ID: int = 9
+
+    # the lookup tables loaded into memory
+    LU_TABLES: tuple = ('site_lu', 'event_type_lu', 'state_type_lu', 'instance_state_type_lu')
+
+    # the config items that change with every message. they do not make a message different from the last one
+    VOLATILE_CONFIG_ITEMS: tuple = ('insertion_date',)
+
+    # the config items the supervisor changes after they are first written (the message always has supervisor_job_status='new').
+    # the diff upsert only adds them, it never overwrites or removes them, and they do not make a message different from the last one
+    SUPERVISOR_CONFIG_ITEMS: tuple = ('supervisor_job_status',)
+
     def __init__(self, db_names: tuple, _logger=None, _auto_commit=True):
         # if a reference to a logger passed in use it
         if _logger is not None:
@@ -42,11 +80,59 @@ class PGImplementation(PGUtilsMultiConnect):
         # create the general queue utilities class
         self.queue_utils = QueueUtils(_queue_name='', _logger=self.logger)
 
-        # init the base class
-        PGUtilsMultiConnect.__init__(self, 'APSViz.Msg-Handler', db_names, _logger=self.logger, _auto_commit=_auto_commit)
+        # get the file the last good lookup data is saved to, if any
+        self.lu_snapshot_path: str = os.environ.get('LU_SNAPSHOT_PATH', '')
+
+        # get the saved lookup data so the DB does not have to be waited on
+        snapshot = load_snapshot(self.lu_snapshot_path, self.logger) if self.lu_snapshot_path else None
+
+        # init the base class. with a snapshot the first connection is opened by the background check below
+        PGUtilsMultiConnect.__init__(self, 'APSViz.Msg-Handler', db_names, _logger=self.logger, _auto_commit=_auto_commit,
+                                     _connect=snapshot is None)
+
+        # register the prepared statements
+        for stmt_name, sql_stmt in self.STATEMENTS.items():
+            self.register_statement(stmt_name, sql_stmt)
+
+        # get the flag that turns on applying run time status messages with the server-side function (see src/sql/apply_run_time_status.sql)
+        self.run_time_status_function: bool = os.environ.get('RUN_TIME_STATUS_FUNCTION_ENABLED', 'False').lower() in ('true', '1', 't')
+
+        # get the flag that turns on only writing the config items that changed
+        self.config_item_diff: bool = os.environ.get('CONFIG_ITEM_DIFF_ENABLED', 'False').lower() in ('true', '1', 't')
+
+        # the content hash of the config items last written for each (instance id, uid), oldest first
+        self.config_item_hashes: OrderedDict = OrderedDict()
+        self.config_item_cache_size: int = int(os.environ.get('CONFIG_ITEM_CACHE_SIZE', '1000'))
+        self.config_item_lock: threading.Lock = threading.Lock()
+
+        # the current instance id of each run (site id, process id, instance name)
+        self.instance_cache: IDCache = IDCache('instance', int(os.environ.get('INSTANCE_CACHE_SIZE', '1000')),
+                                               float(os.environ.get('INSTANCE_CACHE_TTL', '300')))
 
-        # load the legacy constants into memory
-        self.legacy_constants = self.build_constants()
+        # the current event group id of each (instance id, advisory id)
+        self.event_group_cache: IDCache = IDCache('event group', int(os.environ.get('EVENT_GROUP_CACHE_SIZE', '1000')),
+                                                  float(os.environ.get('EVENT_GROUP_CACHE_TTL', '300')))
+
+        # start with the saved lookup data
+        if snapshot is not None:
+            self.legacy_constants = snapshot
+        else:
+            # load the legacy constants into memory
+            self.legacy_constants = self.build_constants()
+
+            # save them for the next start
+            if self.lu_snapshot_path and is_lu_data(self.legacy_constants):
+                save_snapshot(self.lu_snapshot_path, self.legacy_constants, self.logger)
+
+        # keep the lookup data current if turned on (see src/sql/notify_lu_change.sql)
+        if os.environ.get('LU_REFRESH_ENABLED', 'False').lower() in ('true', '1', 't'):
+            self.lu_refresher = LookupRefresher(self, _logger=self.logger)
+        else:
+            self.lu_refresher = None
+
+        # check the saved lookup data against the DB in the background. this waits for the DB if it is down
+        if snapshot is not None:
+            threading.Thread(target=reload_lu_data, args=(self, self.logger), name='lu-revalidate', daemon=True).start()
 
     def __del__(self):
         """
@@ -54,6 +140,10 @@ class PGImplementation(PGUtilsMultiConnect):
 
         :return:
         """
+        # stop keeping the lookup data current
+        if getattr(self, 'lu_refresher', None) is not None:
+            self.lu_refresher.stop()
+
         # clean up connections and cursors
         PGUtilsMultiConnect.__del__(self)
 
@@ -63,15 +153,15 @@ class PGImplementation(PGUtilsMultiConnect):
 
         :return:
         """
-        # create a list of target lu tables
-        lu_tables = ['site_lu', 'event_type_lu', 'state_type_lu', 'instance_state_type_lu']
+        # get all the lookup tables in one round trip
+        sql_stmt = 'SELECT json_build_object(' + \
+                   ', '.join(f"'{lu_name.removesuffix('_lu')}', public.get_lu_items(lu_name := '{lu_name}')" for lu_name in self.LU_TABLES) + ')'
 
-        # init the lu_data storage
-        lu_data: dict = {}
+        lu_data = self.exec_sql('apsviz', sql_stmt)
 
-        # make the call to get the data
-        for lu_item in lu_tables:
-            lu_data.update({lu_item.removeprefix('').removesuffix('_lu'): self.get_lu_items(lu_item)})
+        # nothing was loaded if the call failed
+        if not isinstance(lu_data, dict):
+            lu_data = {lu_name.removesuffix('_lu'): None for lu_name in self.LU_TABLES}
 
         # add in the pct_complete items
         lu_data.update(
@@ -147,6 +237,10 @@ class PGImplementation(PGUtilsMultiConnect):
         else:
             self.logger.error("FAILURE - Invalid or no element name: %s not found in: %s, context: %s", element_name, lu_name, context)
 
+            # the lookup table may have changed, ask for the data to be reloaded for the next message
+            if self.lu_refresher is not None and lu_name != 'pct_complete':
+                self.lu_refresher.request_reload()
+
         # return to the caller
         return ret_id
 
@@ -170,61 +264,70 @@ class PGImplementation(PGUtilsMultiConnect):
         """
         self.logger.debug("instance_id: %s, advisory_id %s, context: %s", instance_id, advisory_id, context)
 
+        # get the cached event group id, it only changes on a RSTR or a new advisory
+        key: tuple = (instance_id, str(advisory_id))
+
+        existing_group_id = self.event_group_cache.get(key)
+
         # see if there are any event groups yet that have this instance_id
         # this could be caused by a new install that does not have any data in the DB yet
-        sql_stmt = f"SELECT id FROM \"event_group\" WHERE instance_id={instance_id} AND advisory_id='{advisory_id}' ORDER BY id DESC"
+        if existing_group_id is None:
+            group = self.exec_prepared('apsviz', 'get_existing_event_group_id', key)
 
-        group = self.exec_sql('apsviz', sql_stmt)
+            if group > 0:
+                existing_group_id = group
 
-        if group > 0:
-            existing_group_id = group
-        else:
-            existing_group_id = -1
+                self.event_group_cache.put(key, existing_group_id)
+            else:
+                existing_group_id = -1
 
-        self.logger.debug("existing_group_id: %s, context: %s", existing_group_id, context)
+        self.logger.debug("existing_group_id: %s, context: %s, %s", existing_group_id, context, self.event_group_cache.get_stats())
 
         return existing_group_id
 
-    def get_existing_instance_id(self, site_id, msg_obj):
+    def get_existing_instance_id(self, site_id, msg):
         """
         just a check to see if there are any instances defined for this site yet
 
         :param site_id:
-        :param msg_obj:
+        :param msg: a RunTimeStatusMsg or RunPropsMsg
         :return:
         """
 
         self.logger.debug("site_id: %s", site_id)
 
-        # get the instance name from the message
-        instance_name = msg_obj.get("instance_name", "N/A") if (msg_obj.get("instance_name", "N/A") != "") else "N/A"
-
-        # get the process id from the message
-        process_id = int(msg_obj.get("uid", "0")) if (msg_obj.get("uid", "0") != "") else 0
+        # get the instance name and process id from the message
+        instance_name = msg.instance_name
+        process_id = msg.process_id
 
         # see if there are any instances yet that have this site_id and instance_name
         # this could be caused by a new install that does not have any data in the DB yet
-        sql_stmt = f"SELECT id FROM \"instance\" WHERE site_id={site_id} AND process_id={process_id} AND instance_name='{instance_name}' " \
-                   f"AND inst_state_type_id!=9"
-
         # +++++++++++++++FIX THIS++++++++++++++++++++Add query to get correct stat id for Defunct++++++++++++++++++++++++
         # +++++++++++++++FIX THIS++++++++++++++++++++Add day to query too? (to account for rollover of process ids)++++++++++++++++++++++++
 
+        # get the cached instance id
+        key: tuple = (site_id, process_id, str(instance_name))
+
+        existing_instance_id = self.instance_cache.get(key)
+
         # get the instance id if it exists
-        inst = self.exec_sql('apsviz', sql_stmt)
+        if existing_instance_id is None:
+            inst = self.exec_prepared('apsviz', 'get_existing_instance_id', key)
 
-        # any int > 0 is a valid instance id
-        if inst > 0:
-            # save the existing instance ID
-            existing_instance_id = inst
-        else:
-            self.logger.warning('Warning - Could not find Instance ID. Site id: %s, Process id: %s, Instance name: %s', site_id, process_id,
-                                instance_name)
+            # any int > 0 is a valid instance id
+            if inst > 0:
+                # save the existing instance ID
+                existing_instance_id = inst
+
+                self.instance_cache.put(key, existing_instance_id)
+            else:
+                self.logger.warning('Warning - Could not find Instance ID. Site id: %s, Process id: %s, Instance name: %s', site_id, process_id,
+                                    instance_name)
 
-            # set the error code
-            existing_instance_id = -1
+                # set the error code
+                existing_instance_id = -1
 
-        self.logger.debug("existing_instance_id: %s", existing_instance_id)
+        self.logger.debug("existing_instance_id: %s, %s", existing_instance_id, self.instance_cache.get_stats())
 
         return existing_instance_id
 
@@ -255,137 +358,158 @@ class PGImplementation(PGUtilsMultiConnect):
 
         return id
 
-    def update_event_group(self, state_id, event_group_id, msg_obj):
+    def update_event_group(self, state_id, event_group_id, msg: RunTimeStatusMsg):
         """
         update the event group
 
         :param state_id:
         :param event_group_id:
-        :param msg_obj:
+        :param msg:
         :return:
         """
-        # get the storm name
-        storm_name = msg_obj.get("storm", "N/A") if (msg_obj.get("storm", "N/A") != "") else "N/A"
-
-        # get the advisory id
-        advisory_id = msg_obj.get("advisory_number", "N/A") if (msg_obj.get("advisory_number", "N/A") != "") else "N/A"
-
-        # build up the sql statement to update the event group
-        sql_stmt = f"UPDATE \"event_group\" SET state_type_id ={state_id}, storm_name='{storm_name}', advisory_id='{advisory_id}' " \
-                   f"WHERE id={event_group_id} RETURNING 1"
+        # update the event group
+        self.exec_prepared('apsviz', 'update_event_group', (state_id, str(msg.storm_name), str(msg.advisory_id), event_group_id))
 
-        self.exec_sql('apsviz', sql_stmt)
-
-    def update_instance(self, state_id, site_id, instance_id, msg_obj):
+    def update_instance(self, state_id, site_id, instance_id, msg: RunTimeStatusMsg):
         """
         update instance with the latest state_type_id
 
         :param state_id:
         :param site_id:
         :param instance_id:
-        :param msg_obj:
+        :param msg:
         :return:
         """
-        # get a default time stamp, use it if necessary
-        now = datetime.datetime.now()
-        time_stamp = now.strftime("%Y-%m-%d %H:%M")
-
-        end_ts = msg_obj.get("date-time", time_stamp) if (msg_obj.get("date-time", time_stamp) != "") else time_stamp
-
-        # get the run params
-        run_params = msg_obj.get("run_params", "N/A") if (msg_obj.get("run_params", "N/A") != "") else "N/A"
+        # update the instance
+        self.exec_prepared('apsviz', 'update_instance', (state_id, str(msg.date_time), str(msg.run_params), site_id, instance_id))
 
-        # build up the sql statement to update the instance
-        sql_stmt = f"UPDATE \"instance\" SET inst_state_type_id = {state_id}, end_ts = '{end_ts}', run_params = '{run_params}' " \
-                   f"WHERE site_id = {site_id} AND id={instance_id} RETURNING 1"
+        # an instance that is now defunct is no longer the one for the run
+        if state_id == self.DEFUNCT_STATE_ID:
+            self.instance_cache.remove((site_id, msg.process_id, str(msg.instance_name)))
 
-        self.exec_sql('apsviz', sql_stmt)
-
-    def insert_event(self, site_id, event_group_id, event_type_id, msg_obj, context: str = 'unknown'):
+    def insert_event(self, site_id, event_group_id, event_type_id, msg: RunTimeStatusMsg, context: str = 'unknown'):
         """
         process the message data and insert an event
 
         :param site_id:
         :param event_group_id:
         :param event_type_id:
-        :param msg_obj:
+        :param msg:
         :param context:
         :return:
         """
-        # get a default time stamp, use it if necessary
-        now = datetime.datetime.now()
-        time_stamp = now.strftime("%Y-%m-%d %H:%M")
-        event_ts = msg_obj.get("date-time", time_stamp) if (msg_obj.get("date-time", time_stamp) != "") else time_stamp
+        # get the event column values
+        values: tuple = self.get_event_values(site_id, event_group_id, event_type_id, msg, context)
 
-        # get the event advisory data
-        advisory_id = msg_obj.get("advisory_number", "N/A") if (msg_obj.get("advisory_number", "N/A") != "") else "N/A"
+        # insert the event, the raw data column gets its default when there is no message
+        if values[-1] is not None:
+            self.exec_prepared('apsviz', 'insert_event', values)
+        else:
+            self.exec_prepared('apsviz', 'insert_event_no_msg', values[:-1])
 
-        # get the process data
-        process = msg_obj.get("process", "N/A") if (msg_obj.get("process", "N/A") != "") else "N/A"
+    def insert_events(self, values_list: list):
+        """
+        inserts a number of events in a single statement
+
+        :param values_list: a list of event column values from get_event_values()
+        :return:
+        """
+        # is there anything to insert
+        if values_list:
+            # create a row of placeholders for each event, the raw data column gets its default when there is no message
+            rows: list = [f"({'%s, ' * 8}{'%s' if values[-1] is not None else 'DEFAULT'})" for values in values_list]
 
+            # create a multi-row insert statement
+            sql_stmt = 'INSERT INTO "event" (site_id, event_group_id, event_type_id, event_ts, advisory_id, pct_complete, sub_pct_complete, ' \
+                       f"process, raw_data) VALUES {','.join(rows)} RETURNING 1"
+
+            # bind the values
+            params: list = [value for values in values_list for value in (values if values[-1] is not None else values[:-1])]
+
+            self.exec_sql('apsviz', sql_stmt, params)
+
+    def get_event_values(self, site_id, event_group_id, event_type_id, msg: RunTimeStatusMsg, context: str = 'unknown') -> tuple:
+        """
+        process the message data into the column values of an event record
+
+        :param site_id:
+        :param event_group_id:
+        :param event_type_id:
+        :param msg:
+        :param context:
+        :return:
+        """
         # get the percent complete from a LU lookup
         pct_complete = self.get_lu_id(str(event_type_id), "pct_complete", context)
 
-        # get the sub percent complete from the message object
-        sub_pct_complete = msg_obj.get("subpctcomplete", pct_complete)
+        # get the sub percent complete from the message, default to the percent complete
+        sub_pct_complete = msg.sub_pct_complete if msg.sub_pct_complete is not None else pct_complete
 
-        # if there was a message included parse and add it
-        if msg_obj.get("message") is not None and len(msg_obj["message"]) > 0:
-            # get rid of any special chars that might mess up postgres
-            # backslashes, quote, and double quotes for now
-            msg_line = msg_obj["message"].replace('\\', '').replace("'", '').replace('"', '')
+        # the message is stored as is, None uses the column default
+        raw_data = str(msg.message) if msg.message is not None else None
 
-            raw_data_col = ", raw_data"
-            msg_line = f", '{msg_line}'"
-        else:
-            raw_data_col = ''
-            msg_line = ''
+        # return the column values
+        return site_id, event_group_id, event_type_id, str(msg.date_time), str(msg.advisory_id), pct_complete, sub_pct_complete, str(msg.process), \
+            raw_data
 
-        # create the fields
-        sql_stmt = 'INSERT INTO "event" (site_id, event_group_id, event_type_id, event_ts, advisory_id, pct_complete, sub_pct_complete, ' \
-                   f"process{raw_data_col}) VALUES ({site_id}, {event_group_id}, {event_type_id}, '{event_ts}', '{advisory_id}', {pct_complete}, " \
-                   f"{sub_pct_complete}, '{process}'{msg_line}) RETURNING 1"
+    def apply_run_time_status(self, site_id, event_type_id, state_id, msg: RunTimeStatusMsg, context: str = 'unknown') -> tuple:
+        """
+        creates/updates the instance and event group and inserts the event in a single call to the server-side function.
+        the function runs in one transaction and locks the run so concurrent messages cannot create duplicate instances.
 
-        self.exec_sql('apsviz', sql_stmt)
+        :param site_id:
+        :param event_type_id:
+        :param state_id:
+        :param msg:
+        :param context:
+        :return: the instance id and event group id, negative on failure
+        """
+        # get the event column values, the event group id is not known yet
+        values: tuple = self.get_event_values(site_id, None, event_type_id, msg, context)
+
+        # apply the message
+        ids = self.exec_prepared('apsviz', 'apply_run_time_status', (site_id, event_type_id, state_id, str(msg.event_type), str(msg.state),
+                                                                     msg.process_id, str(msg.instance_name), values[3], values[4],
+                                                                     str(msg.storm_name), str(msg.storm_number), values[7], str(msg.run_params),
+                                                                     values[5], values[6], values[8]))
+
+        self.logger.debug("ids: %s, context: %s", ids, context)
+
+        # the function returns an array of the ids
+        ids = (ids[0], ids[1]) if isinstance(ids, list) and len(ids) == 2 else (-1, -1)
+
+        # the function may have created a new instance or made it defunct
+        self.instance_cache.put((site_id, msg.process_id, str(msg.instance_name)), ids[0] if state_id != self.DEFUNCT_STATE_ID else None)
 
-    def insert_event_group(self, state_id, instance_id, msg_obj, context: str = 'unknown'):
+        # and may have created a new event group
+        if ids[0] > 0:
+            self.event_group_cache.put((ids[0], str(msg.advisory_id)), ids[1])
+
+        return ids
+
+    def insert_event_group(self, state_id, instance_id, msg: RunTimeStatusMsg, context: str = 'unknown'):
         """
         inserts an event group
 
         :param state_id:
         :param instance_id:
-        :param msg_obj:
+        :param msg:
         :param context:
         :return:
         """
-        # get a default time stamp, use it if necessary
-        now = datetime.datetime.now()
-        time_stamp = now.strftime("%Y-%m-%d %H:%M")
-        event_group_ts = msg_obj.get("date-time", time_stamp) if (msg_obj.get("date-time", time_stamp) != "") else time_stamp
-
-        # get the storm name
-        storm_name = msg_obj.get("storm", "N/A") if (msg_obj.get("storm", "N/A") != "") else "N/A"
-
-        # get the storm number
-        storm_number = msg_obj.get("storm_number", "N/A") if (msg_obj.get("storm_number", "N/A") != "") else "N/A"
-
-        # get the event advisory data
-        advisory_id = msg_obj.get("advisory_number", "N/A") if (msg_obj.get("advisory_number", "N/A") != "") else "N/A"
-
-        # build up the sql statement to insert the event
-        sql_stmt = 'INSERT INTO "event_group" (state_type_id, instance_id, event_group_ts, storm_name, storm_number, advisory_id, ' \
-                   f"final_product) VALUES ({state_id}, {instance_id}, '{event_group_ts}', '{storm_name}', '{storm_number}', '{advisory_id}'" \
-                   f", 'product') RETURNING id"
+        # insert the event group and get its id
+        group = self.exec_prepared('apsviz', 'insert_event_group', (state_id, instance_id, str(msg.date_time), str(msg.storm_name),
+                                                                    str(msg.storm_number), str(msg.advisory_id)))
 
-        # get the new event group id
-        group = self.exec_sql('apsviz', sql_stmt)
+        # the new event group replaces any earlier one for the advisory
+        self.event_group_cache.put((instance_id, str(msg.advisory_id)), group)
 
         self.logger.debug("group: %s, context: %s", group, context)
 
         # return the new event group id
         return group
 
-    def insert_instance(self, state_id, site_id, msg_obj, context: str = 'unknown'):
+    def insert_instance(self, state_id, site_id, msg, context: str = 'unknown'):
         """
         inserts an instance
 
@@ -393,46 +517,36 @@ class PGImplementation(PGUtilsMultiConnect):
 
         :param state_id:
         :param site_id:
-        :param msg_obj:
+        :param msg: a RunTimeStatusMsg or RunPropsMsg
         :param context:
         :return:
         """
-        # get a default time stamp, use it if necessary
-        now = datetime.datetime.now()
-        time_stamp = now.strftime("%Y-%m-%d %H:%M")
-        start_ts = end_ts = msg_obj.get("date-time", time_stamp) if (msg_obj.get("date-time", time_stamp) != "") else time_stamp
-
-        # get the run params
-        run_params = msg_obj.get("run_params", "N/A") if (msg_obj.get("run_params", "N/A") != "") else "N/A"
-
-        # get the instance name
-        instance_name = msg_obj.get("instance_name", "N/A") if (msg_obj.get("instance_name", "N/A") != "") else "N/A"
-
-        # get the process id
-        process_id = int(msg_obj.get("uid", "0")) if (msg_obj.get("uid", "0") != "") else 0
+        # the run starts and ends at the time of the message for now
+        start_ts = end_ts = msg.date_time
 
         # check to make sure this instance doesn't already exist before adding a new one
         # instance_id = get_instance_id(start_ts, site_id, process_id, instance_name)
         # if (instance_id < 0):
 
-        # build up the sql statement to insert the run instance
-        sql_stmt = f"INSERT INTO \"instance\" (site_id, process_id, start_ts, end_ts, run_params, instance_name, inst_state_type_id) " \
-                   f"VALUES ({site_id}, {process_id}, '{start_ts}', '{end_ts}', '{run_params}', '{instance_name}', {state_id}) RETURNING id"
-
         # insert the record and the new instance id
-        instance_id = self.exec_sql('apsviz', sql_stmt)
+        instance_id = self.exec_prepared('apsviz', 'insert_instance', (site_id, msg.process_id, str(start_ts), str(end_ts), str(msg.run_params),
+                                                                       str(msg.instance_name), state_id))
 
         self.logger.debug("instance_id: %s, context: %s", instance_id, context)
 
+        # the new instance replaces any earlier one for the run, a defunct one is not used
+        self.instance_cache.put((site_id, msg.process_id, str(msg.instance_name)), instance_id if state_id != self.DEFUNCT_STATE_ID else None)
+
         return instance_id
 
-    def insert_config_items(self, instance_id: int, params: dict, suffix: str = ''):
+    def insert_config_items(self, instance_id: int, params: dict, suffix: str = '', transformed: bool = False):
         """
         Inserts the configuration parameters into the database
 
         :param suffix:
         :param instance_id:
         :param params:
+        :param transformed: the params have already been reformatted (see QueueUtils.map_msg_params())
         :return:
         """
 
@@ -440,7 +554,8 @@ class PGImplementation(PGUtilsMultiConnect):
         ret_msg = None
 
         # apply data formatting to the run props
-        params = self.queue_utils.transform_msg_params(params)
+        if not transformed:
+            params = self.queue_utils.transform_msg_params(params)
 
         self.logger.debug("param_list: %s", params)
 
@@ -462,27 +577,14 @@ class PGImplementation(PGUtilsMultiConnect):
 
                 self.logger.debug("uid: %s", uid)
 
-                # build up the sql to remove old entries
-                sql_stmt = f"DELETE FROM public.\"config_item\" WHERE instance_id = {instance_id} AND uid = '{uid}' RETURNING 1"
-
-                self.logger.debug("sql_stmt: %s", sql_stmt)
+                # get the values as they are stored
+                items: dict = {k: str(v) for (k, v) in params.items()}
 
-                # remove all duplicate records that may already exist
-                self.exec_sql('apsviz', sql_stmt)
-
-                # get the list of values
-                values_list = [f"({instance_id}, '{uid}', '{k}', '{v}')" for (k, v) in params.items()]
-
-                # create a massive insert statement
-                sql_stmt = f"INSERT INTO public.\"config_item\" (instance_id, uid, key, value) VALUES {','.join(values_list)}"
-
-                # insure this call returns a value
-                sql_stmt += " RETURNING 1"
-
-                self.logger.debug("sql_stmt: %s", sql_stmt)
-
-                # execute the sql
-                self.exec_sql('apsviz', sql_stmt)
+                # write only what changed or replace the old entries
+                if self.config_item_diff:
+                    self.upsert_config_items(instance_id, uid, items)
+                else:
+                    self.replace_config_items(instance_id, uid, items)
 
         except Exception:
             ret_msg = "Exception inserting config items"
@@ -491,3 +593,92 @@ class PGImplementation(PGUtilsMultiConnect):
 
         # return to the caller
         return ret_msg
+
+    def replace_config_items(self, instance_id: int, uid: str, items: dict):
+        """
+        replaces all the config items of a run in a single transaction
+
+        :param instance_id:
+        :param uid:
+        :param items: the config item key: value
+        :return:
+        """
+        with self.transaction('apsviz'):
+            # remove all duplicate records that may already exist
+            self.exec_sql('apsviz', 'DELETE FROM public."config_item" WHERE instance_id = %s AND uid = %s RETURNING 1', (instance_id, uid))
+
+            # stream all the params in with one COPY. the values are stored as text like they always have been
+            count: int = self.copy_rows('apsviz', 'public."config_item"', ['instance_id', 'uid', 'key', 'value'],
+                                        [(instance_id, uid, key, value) for (key, value) in items.items()])
+
+        self.logger.debug("%s config items inserted for uid: %s", count, uid)
+
+    def upsert_config_items(self, instance_id: int, uid: str, items: dict):
+        """
+        writes only the config items of a run that were added, changed or removed since they were stored.
+        a message that is the same as the last one written for the run is skipped without going to the DB.
+
+        the volatile items (VOLATILE_CONFIG_ITEMS) are only written along with other changes. the supervisor items
+        (SUPERVISOR_CONFIG_ITEMS) are only written if they are not stored yet so the supervisor's changes are kept.
+
+        :param instance_id:
+        :param uid:
+        :param items: the config item key: value
+        :return:
+        """
+        # get the content hash of the items, leaving out the ones that change with every message
+        content_hash: str = self.get_config_items_hash(items)
+
+        # skip the message if nothing changed since the last one
+        with self.config_item_lock:
+            if self.config_item_hashes.get((instance_id, uid)) == content_hash:
+                self.logger.debug("Config items unchanged for uid: %s, skipping.", uid)
+                return
+
+        with self.transaction('apsviz'):
+            # get the stored items, there are none if nothing comes back
+            result = self.exec_sql('apsviz', 'SELECT json_object_agg(key, value) FROM public."config_item" WHERE instance_id = %s AND uid = %s',
+                                   (instance_id, uid))
+
+            stored: dict = result if isinstance(result, dict) else {}
+
+            # get the keys that changed. the volatile items are only written with other changes and the supervisor items are left alone
+            changed: list = [key for key, value in items.items() if key in stored and stored[key] != value and key not in self.VOLATILE_CONFIG_ITEMS
+                             and key not in self.SUPERVISOR_CONFIG_ITEMS]
+            added: list = [key for key in items if key not in stored]
+            removed: list = [key for key in stored if key not in items and key not in self.SUPERVISOR_CONFIG_ITEMS]
+
+            if changed or added or removed:
+                changed += [key for key in self.VOLATILE_CONFIG_ITEMS if key in items and key in stored and stored[key] != items[key]]
+
+                # remove the items that changed or are gone
+                if changed or removed:
+                    self.exec_sql('apsviz', 'DELETE FROM public."config_item" WHERE instance_id = %s AND uid = %s AND key = ANY(%s) RETURNING 1',
+                                  (instance_id, uid, changed + removed))
+
+                # add the new and changed items
+                if changed or added:
+                    self.copy_rows('apsviz', 'public."config_item"', ['instance_id', 'uid', 'key', 'value'],
+                                   [(instance_id, uid, key, items[key]) for key in changed + added])
+
+        self.logger.debug("Config items for uid: %s, added: %s, changed: %s, removed: %s", uid, len(added), len(changed), len(removed))
+
+        # remember what was written
+        with self.config_item_lock:
+            self.config_item_hashes[(instance_id, uid)] = content_hash
+            self.config_item_hashes.move_to_end((instance_id, uid))
+
+            # remove the oldest hashes if the cache is full
+            while len(self.config_item_hashes) > self.config_item_cache_size:
+                self.config_item_hashes.popitem(last=False)
+
+    def get_config_items_hash(self, items: dict) -> str:
+        """
+        gets the content hash of the config items, leaving out the volatile and supervisor ones
+
+        :param items:
+        :return:
+        """
+        return hashlib.blake2b(''.join(f'{key}\0{value}\0' for key, value in sorted(items.items())
+                                       if key not in self.VOLATILE_CONFIG_ITEMS and key not in self.SUPERVISOR_CONFIG_ITEMS).encode(),
+                               digest_size=16).hexdigest()
@@ -12,13 +12,18 @@
     Author: Phil Owen, RENCI.org
 """
 
+import io
 import os
 import time
-from collections import namedtuple
+import weakref
+import threading
+import functools
+from contextlib import contextmanager
 
 import psycopg2
 
 from src.common.logger import LoggingUtil
+from src.common.pg_conn_pool import PGConnectionPool
 
 
 class PGUtilsMultiConnect:
@@ -31,13 +36,17 @@ class PGUtilsMultiConnect:
         final environment parameter should be all uppercase.
 
         Please see the get_conn_config() method below for more details.
+
+        Each DB has a pool of connections (see PGConnectionPool) so statements from
+        different threads can run at the same time.
     """
 
-    def __init__(self, app_name, db_names: tuple, _logger=None, _auto_commit=True):
+    def __init__(self, app_name, db_names: tuple, _logger=None, _auto_commit=True, _connect=True):
         """
         Entry point for the db connection creation and operations
 
         :param db_names:
+        :param _connect: connect to the DBs now. if False the first connection is opened when it is needed
         """
         # if a reference to a logger passed in use it
         if _logger is not None:
@@ -50,28 +59,35 @@ class PGUtilsMultiConnect:
             # create a logger
             self.logger = LoggingUtil.init_logging(f"{app_name}.PGUtilsMultiConnect", level=log_level, line_format='medium', log_file_path=log_path)
 
-        # create a dict for the DB connection details
+        # create a dict for the DB connection pools
         self.dbs: dict = {}
 
         # set the autocommit
         self.auto_commit = _auto_commit
 
-        # create the named tuple definition for DB info
-        self.db_info_tpl: namedtuple = namedtuple('DB_Info', ['name', 'conn_str', 'conn'])
-
         # save the DB names for connection/cursor closing on class tear-down
         self.db_names: tuple = db_names
 
-        # get the details loaded into a tuple for all the DBs
+        # the connections of the transactions in progress on each thread
+        self.tx_conns: threading.local = threading.local()
+
+        # the registered statements (name: PREPARE statement) and the names prepared on each connection
+        self.statements: dict = {}
+        self.prepared: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self.prepared_lock: threading.Lock = threading.Lock()
+
+        # create a connection pool for all the DBs
         for db_name in self.db_names:
             # get the connection string
             conn_config = self.get_conn_config(db_name)
 
-            # create a temporary tuple to get the discovery process started
-            temp_tuple: namedtuple = self.db_info_tpl(db_name, conn_config, None)
+            # create the pool
+            self.dbs[db_name] = PGConnectionPool(db_name, functools.partial(self.get_db_connection, db_name, conn_config), _logger=self.logger)
 
-            # get the connection
-            self.get_db_connection(temp_tuple)
+            # get the first connection to get the discovery process started. this waits until the DB can be reached
+            if _connect:
+                with self.dbs[db_name].connection():
+                    pass
 
     def __del__(self):
         """
@@ -86,21 +102,14 @@ class PGUtilsMultiConnect:
 
     def close_conn(self, db_name):
         """
-        Closes a DB connection
+        Closes the idle DB connections in a pool
 
         :param db_name:
         :return:
         """
-        try:
-            # if there is a connection, close it
-            if self.dbs[db_name].conn is not None:
-                # get the item out of the tuple
-                conn = self.dbs[db_name].conn
-
-                # close it
-                conn.close()
-        except Exception:
-            self.logger.warning('Error detected closing the %s DB connection.', db_name)
+        # close the connections
+        if db_name in self.dbs:
+            self.dbs[db_name].close_all()
 
     @staticmethod
     def get_conn_config(db_name: str) -> str:
@@ -120,189 +129,328 @@ class PGUtilsMultiConnect:
         host: str = os.environ.get(f'{db_name}_DB_HOST')
         port: int = int(os.environ.get(f'{db_name}_DB_PORT'))
 
+        # get the TCP keepalive settings. these let the OS find dead connections without a probe query
+        keepalives_idle: int = int(os.environ.get('PG_KEEPALIVES_IDLE', '30'))
+        keepalives_interval: int = int(os.environ.get('PG_KEEPALIVES_INTERVAL', '10'))
+        keepalives_count: int = int(os.environ.get('PG_KEEPALIVES_COUNT', '3'))
+
         # create a connection string
-        connection_str: str = f"host={host} port={port} dbname={dbname} user={user} password={password}"
+        connection_str: str = f"host={host} port={port} dbname={dbname} user={user} password={password} keepalives=1 " \
+                              f"keepalives_idle={keepalives_idle} keepalives_interval={keepalives_interval} keepalives_count={keepalives_count}"
 
         # return to the caller
         return connection_str
 
-    def get_db_connection(self, db_info: namedtuple) -> bool:
+    def get_db_connection(self, db_name: str, conn_str: str):
         """
-        Gets a connection to the DB. performs a check to continue trying until
-        a connection is made.
+        Gets a new connection to the DB. continues trying until a connection is made.
 
-        :return:
+        :param db_name:
+        :param conn_str:
+        :return: the connection
         """
-        # init the connection status indicator
-        good_conn: bool = False
-
         # until forever
-        while not good_conn:
+        while True:
             try:
-                # check the DB connection
-                good_conn = self.check_db_connection(db_info)
-
-                # try to get a connection if the check failed
-                if not good_conn:
-                    # try to connect to the DB
-                    conn = psycopg2.connect(db_info.conn_str)
-
-                    # set the autocommit on the connection
-                    conn.autocommit = self.auto_commit
+                # try to connect to the DB
+                conn = psycopg2.connect(conn_str)
 
-                    # create a new db info tuple
-                    verified_tuple: namedtuple = self.db_info_tpl(db_info.name, db_info.conn_str, conn)
+                # set the autocommit on the connection
+                conn.autocommit = self.auto_commit
 
-                    # check the new DB connection
-                    good_conn = self.check_db_connection(verified_tuple)
+                self.logger.debug('DB Connection established (auto commit %s) to %s.', self.auto_commit, db_name)
 
-                    # is the connection ok now?
-                    if not good_conn:
-                        self.logger.warning('DB Connection not established (auto commit %s) to %s.', self.auto_commit, db_info.name)
-                    else:
-                        self.logger.debug('DB Connection established (auto commit %s) to %s.', self.auto_commit, db_info.name)
+                # return the new connection
+                return conn
+            except Exception:
+                self.logger.exception('Error getting connection %s.', db_name)
 
-                        # add the verified connection to the dict
-                        self.dbs.update({db_info.name: verified_tuple})
+            # we are still looking for a connection
+            self.logger.error('DB Connection failed to %s. Retrying...', db_name)
+            time.sleep(5)
 
-                        # no need to continue
-                        break
+    def get_tx_conn(self, db_name: str):
+        """
+        gets the connection of the transaction this thread has in progress on the DB
 
-            except Exception:
-                self.logger.exception('Error getting connection %s.', db_info.name)
-                good_conn = False
+        :param db_name:
+        :return: the connection, None if there is no transaction
+        """
+        return getattr(self.tx_conns, 'conns', {}).get(db_name)
 
-            # are we still looking for a connection
-            if good_conn is False:
-                self.logger.error('DB Connection failed to %s. Retrying...', db_info.name)
-                time.sleep(5)
+    def register_statement(self, stmt_name: str, sql_stmt: str):
+        """
+        Registers a statement that is prepared on each connection the first time it is used. see exec_prepared().
 
-        # return pass/fail flag
-        return good_conn
+        :param stmt_name: the name of the prepared statement
+        :param sql_stmt: the sql with $1, $2, etc. for the parameters
+        :return:
+        """
+        self.statements[stmt_name] = f"PREPARE {stmt_name} AS {sql_stmt}"
 
-    def check_db_connection(self, db_info: namedtuple) -> bool:
+    def exec_sql(self, db_name: str, sql_stmt: str, params=None, stmt_name: str = None):
         """
-        Checks to see if there is a good connection to the DB.
+        Executes a sql statement.
 
-        :param db_info:
-        :return: boolean
+        :param db_name:
+        :param sql_stmt:
+        :param params: the values bound to the %s placeholders in the statement, if any
+        :param stmt_name: the name of a registered statement to execute instead of the sql
+        :return:
         """
-        # init the return value
-        ret_val = None
+        # inside a transaction the statement must run on the transaction connection as is
+        tx_conn = self.get_tx_conn(db_name)
 
-        # init the cursor storage
-        cursor = None
+        if tx_conn is not None:
+            return self.exec_tx_sql(tx_conn, sql_stmt, params, stmt_name)
 
-        try:
-            # is there an existing connection
-            if not db_info.conn:
-                self.logger.debug('Existing DB connection not found for %s', db_info.name)
+        # execute the statement
+        return self.exec_autocommit_sql(db_name, sql_stmt, params, stmt_name)
 
-                # force getting a new connection
-                ret_val = False
-            else:
-                # get the cursor
-                cursor = db_info.conn.cursor()
+    def exec_prepared(self, db_name: str, stmt_name: str, params: tuple):
+        """
+        Executes a registered statement with bound parameters. the server plans it once per connection.
 
-                # get the DB version
-                cursor.execute("SELECT version()")
+        :param db_name:
+        :param stmt_name:
+        :param params:
+        :return:
+        """
+        return self.exec_sql(db_name, None, params, stmt_name)
 
-                # get the value
-                db_version = cursor.fetchone()
+    def exec_autocommit_sql(self, db_name: str, sql_stmt: str, params=None, stmt_name: str = None):
+        """
+        Executes a sql statement outside a transaction on a connection borrowed from the pool.
+        errors are logged and return -1.
 
-                # set the success (or not) flag
-                ret_val = bool(db_version)
+        the connection is not checked before the statement runs. if the statement fails because the
+        connection was lost, the idle connections are dropped and the statement is run once more on a
+        new connection.
 
-        except psycopg2.DatabaseError:
-            self.logger.debug('Error database error checking DB connection.')
+        :param db_name:
+        :param sql_stmt:
+        :param params:
+        :param stmt_name:
+        :return:
+        """
+        # init the return
+        ret_val = None
 
-            # connection failed
-            ret_val = False
+        try:
+            try:
+                # run the statement on a pooled connection
+                ret_val = self.fetch_one(db_name, sql_stmt, params, stmt_name)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                self.logger.warning('Lost the %s DB connection. Reconnecting and retrying the SQL.', db_name)
+
+                # the other idle connections were probably lost too
+                self.dbs[db_name].close_all()
 
-        except psycopg2.InterfaceError:
-            self.logger.debug('Error database interface error checking DB connection.')
+                # try again on a new connection
+                ret_val = self.fetch_one(db_name, sql_stmt, params, stmt_name)
 
-            # connection failed
-            ret_val = False
+            # trap the return
+            if ret_val is None or ret_val[0] is None:
+                # specify a return code on an empty result
+                ret_val = -1
+            else:
+                # get the one and only record of json
+                ret_val = ret_val[0]
 
         except Exception:
-            self.logger.debug('General DB connection issue. Probably connection time out.')
+            self.logger.exception("Error detected executing SQL: %s.", sql_stmt if stmt_name is None else stmt_name)
 
-            # connection failed
-            ret_val = False
+            # set the error code
+            ret_val = -1
 
         # return to the caller
         return ret_val
 
-    def exec_sql(self, db_name: str, sql_stmt: str):
+    def fetch_one(self, db_name: str, sql_stmt: str, params=None, stmt_name: str = None):
         """
-        Executes a sql statement.
+        Executes a sql statement on a pooled connection and gets the first row. errors are raised to the caller.
 
         :param db_name:
         :param sql_stmt:
+        :param params:
+        :param stmt_name:
         :return:
         """
-        # init the return
-        ret_val = None
-
-        # get the appropriate db info object
-        db_info = self.dbs[db_name]
+        # borrow a connection, a lost one is dropped when it is returned
+        with self.dbs[db_name].connection() as conn:
+            return self.run_sql(conn, sql_stmt, params, stmt_name)
 
-        # insure we have a valid DB connection
-        success = self.get_db_connection(db_info)
+    def run_sql(self, conn, sql_stmt: str, params=None, stmt_name: str = None):
+        """
+        Executes a sql statement or a registered statement on a connection and gets the first row.
 
-        # did we get a connection
-        if success:
-            # init the cursor
-            cursor = None
+        :param conn:
+        :param sql_stmt:
+        :param params:
+        :param stmt_name:
+        :return:
+        """
+        # get a cursor
+        with conn.cursor() as cursor:
+            # is this a registered statement
+            if stmt_name is not None:
+                # prepare it if this connection has not seen it yet
+                with self.prepared_lock:
+                    prepared: set = self.prepared.setdefault(conn, set())
 
-            try:
-                # make sure the latest db_info is used
-                db_info = self.dbs[db_name]
+                if stmt_name not in prepared:
+                    cursor.execute(self.statements[stmt_name])
 
-                # get a cursor
-                cursor = db_info.conn.cursor()
+                    prepared.add(stmt_name)
 
+                # execute the prepared statement with the parameters
+                cursor.execute(f"EXECUTE {stmt_name} ({', '.join(['%s'] * len(params))})", params)
+            else:
                 # execute the sql
-                cursor.execute(sql_stmt)
+                cursor.execute(sql_stmt, params)
+
+            # get the returned value
+            return cursor.fetchone()
+
+    def exec_tx_sql(self, conn, sql_stmt: str, params=None, stmt_name: str = None):
+        """
+        Executes a sql statement inside a transaction. any error is raised to the caller so the transaction can be rolled back.
+
+        :param conn: the transaction connection
+        :param sql_stmt:
+        :param params:
+        :param stmt_name:
+        :return:
+        """
+        # execute the sql
+        ret_val = self.run_sql(conn, sql_stmt, params, stmt_name)
+
+        # trap the return. specify a return code on an empty result, otherwise get the one and only record
+        return -1 if ret_val is None or ret_val[0] is None else ret_val[0]
+
+    def copy_rows(self, db_name: str, table_name: str, columns: list, rows: list) -> int:
+        """
+        Streams rows into a table with a single COPY FROM STDIN. inside a transaction the rows are
+        loaded on the transaction connection. any error is raised to the caller.
+
+        :param db_name:
+        :param table_name:
+        :param columns: the names of the columns in each row
+        :param rows: the rows of column values
+        :return: the number of rows loaded
+        """
+        # create the COPY text data
+        data = io.StringIO(''.join('\t'.join(self.get_copy_value(value) for value in row) + '\n' for row in rows))
+
+        # create the COPY statement
+        sql_stmt: str = f"COPY {table_name} ({', '.join(columns)}) FROM STDIN"
+
+        # use the transaction connection if this thread has one
+        tx_conn = self.get_tx_conn(db_name)
+
+        if tx_conn is not None:
+            with tx_conn.cursor() as cursor:
+                cursor.copy_expert(sql_stmt, data)
+
+                return cursor.rowcount
+
+        # borrow a connection
+        with self.dbs[db_name].connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.copy_expert(sql_stmt, data)
+
+                return cursor.rowcount
+
+    @staticmethod
+    def get_copy_value(value) -> str:
+        """
+        formats a value for the COPY text format
+
+        :param value:
+        :return:
+        """
+        # a null value
+        if value is None:
+            return '\\N'
+
+        # escape the characters that have a meaning in the COPY text format
+        return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+    @contextmanager
+    def transaction(self, db_name: str):
+        """
+        Runs the exec_sql() calls made by this thread inside a with block in a single transaction on a
+        connection borrowed from the pool. the transaction is committed when the block exits normally
+        and rolled back if an exception is raised.
+
+        other threads keep using the other connections in the pool.
+
+        :param db_name:
+        :return:
+        """
+        # borrow a connection for the transaction
+        with self.dbs[db_name].connection() as conn:
+            # turn off the auto commit for the duration of the transaction
+            conn.autocommit = False
 
-                # get the returned value
-                ret_val = cursor.fetchone()
+            # route this thread's exec_sql() calls to the transaction
+            if not hasattr(self.tx_conns, 'conns'):
+                self.tx_conns.conns = {}
 
-                # trap the return
-                if ret_val is None or ret_val[0] is None:
-                    # specify a return code on an empty result
-                    ret_val = -1
-                else:
-                    # get the one and only record of json
-                    ret_val = ret_val[0]
+            self.tx_conns.conns[db_name] = conn
+
+            try:
+                # run the statements
+                yield conn
 
+                # everything worked, save the changes
+                conn.commit()
             except Exception:
-                self.logger.exception("Error detected executing SQL: %s.", sql_stmt)
+                # undo the changes
+                conn.rollback()
 
-                # set the error code
-                ret_val = -1
+                # start the prepared statements over so they are in a known state
+                self.deallocate(conn)
+
+                # let the caller handle the error
+                raise
             finally:
-                # in there is a cursor, close it
-                if cursor is not None:
-                    # close it
-                    cursor.close()
+                # restore the connection state
+                del self.tx_conns.conns[db_name]
 
-        else:
-            # set the error code
-            ret_val = -1
+                # a broken connection is dropped when it is returned
+                if not conn.closed:
+                    conn.autocommit = self.auto_commit
 
-        # return to the caller
-        return ret_val
+    def deallocate(self, conn):
+        """
+        removes the prepared statements from a connection
+
+        :param conn:
+        :return:
+        """
+        try:
+            # forget what was prepared
+            with self.prepared_lock:
+                self.prepared.pop(conn, None)
+
+            # remove them from the session
+            with conn.cursor() as cursor:
+                cursor.execute("DEALLOCATE ALL")
+
+            # end the transaction this started
+            if not conn.autocommit:
+                conn.commit()
+        except Exception:
+            # a lost connection is dropped when it is returned
+            self.logger.debug('Error deallocating the prepared statements.')
 
     def commit(self, db_name: str):
         """
-        issues a transaction commit
+        issues a transaction commit on the pooled connections that do not auto commit
 
         :param db_name:
         :return:
         """
-        # if this connection is set to not auto commit
-        if not self.dbs[db_name].conn.autocommit:
-            # issue the commit
-            self.dbs[db_name].conn.commit()
+        # issue the commit
+        self.dbs[db_name].commit_all()
@@ -11,12 +11,14 @@
 
     Authors: Lisa Stillwell, Phil Owen @RENCI.org
 """
-import json
+import threading
 
+from src.common import json_codec
 from src.common.logger import LoggingUtil
 from src.common.pg_impl import PGImplementation
 from src.common.general_utils import GeneralUtils
 from src.common.queue_utils import QueueUtils
+from src.common.msg_schemas import RunTimeStatusMsg, RunPropsMsg
 
 
 class QueueCallbacks:
@@ -24,12 +26,13 @@ class QueueCallbacks:
     callback methods to handle posts to the RabbitMQ
     """
 
-    def __init__(self, _queue_name, _logger=None):
+    def __init__(self, _queue_name, _logger=None, _db_info=None):
         """
         init the queue message handler object for queue messages
 
         :param: _queue_name
         :param _logger:
+        :param _db_info: an existing DB object to share. one will be created if not passed.
         """
 
         # if a reference to a logger passed in use it
@@ -49,8 +52,12 @@ class QueueCallbacks:
         # note the extra comma makes this single item a singleton tuple
         self.db_names: tuple = ('apsviz',)
 
-        # define and init the object that will handle DB operations
-        self.db_info: PGImplementation = PGImplementation(self.db_names, _logger=self.logger)
+        # if a reference to a DB object was passed in use it. this shares the DB connection and lookup data across queues
+        if _db_info is not None:
+            self.db_info: PGImplementation = _db_info
+        else:
+            # define and init the object that will handle DB operations
+            self.db_info: PGImplementation = PGImplementation(self.db_names, _logger=self.logger)
 
         # define and init the object used to handle constant conversions
         self.queue_utils = QueueUtils(_queue_name=_queue_name, _logger=self.logger)
@@ -58,8 +65,57 @@ class QueueCallbacks:
         # create the general queue utilities class
         self.general_utils = GeneralUtils(_logger=self.logger)
 
+        # the alerts held while a batch is applied on each thread (see send_alert())
+        self.batch_alerts: threading.local = threading.local()
+
         self.logger.info("QueueCallback initialization for queue %s complete.", _queue_name)
 
+    @staticmethod
+    def get_run_time_shard_key(body) -> str:
+        """
+        gets the key that identifies the run an ecflow run time status message belongs to.
+        messages with the same key must be processed in the order they were received.
+
+        :param body:
+        :return:
+        """
+        try:
+            # load the message
+            msg_obj = json_codec.loads(body)
+
+            # the run is identified by its location, process id and instance name
+            ret_val: str = f"{msg_obj.get('physical_location', '')}|{msg_obj.get('uid', '')}|{msg_obj.get('instance_name', '')}"
+        except Exception:
+            # the callback will report the bad message, just keep these in one place
+            ret_val: str = ''
+
+        # return the key
+        return ret_val
+
+    @staticmethod
+    def get_run_props_shard_key(body) -> str:
+        """
+        gets the key that identifies the run an ecflow or hec/ras run properties message belongs to.
+        messages with the same key must be processed in the order they were received.
+
+        :param body:
+        :return:
+        """
+        try:
+            # load the message
+            msg_obj = json_codec.loads(body)
+
+            # the run is identified by its location, process id and instance name. they are under the suite params before the
+            # message is mapped to the legacy params
+            ret_val: str = '|'.join(str(msg_obj.get(f'suite.{name}', msg_obj.get(name, '')))
+                                    for name in ('physical_location', 'uid', 'instance_name'))
+        except Exception:
+            # the callback will report the bad message, just keep these in one place
+            ret_val: str = ''
+
+        # return the key
+        return ret_val
+
     def ecflow_run_time_status_callback(self, channel, method, properties, body) -> bool:
         """
         The callback function for the ecflow run time status message queue.
@@ -68,7 +124,8 @@ class QueueCallbacks:
         :param method:
         :param properties:
         :param body:
-        :return:
+        :return: False if the status was not saved and the message should be retried, None if the message cannot be loaded and
+        is ignored. a failed relay does not fail the message.
         """
         self.logger.debug("Received ECFlow_rt status msg. Body is %s bytes, channel: %s, method: %s, properties: %s", len(body), channel, method,
                           properties)
@@ -82,115 +139,277 @@ class QueueCallbacks:
 
         # load the message
         try:
-            # load the message
-            msg_obj = json.loads(body)
+            # load and validate the message
+            msg = RunTimeStatusMsg.decode(body)
 
-            # get the site id from the name in the message
-            site_id = self.db_info.get_lu_id_from_msg(msg_obj, "physical_location", "site", context=context)
+            # save the status to the DB
+            instance_id = self.apply_run_time_status(msg, context)
+
+            # did the status get saved
+            if instance_id < 0:
+                # set the return to indicate failure
+                ret_val = False
+            else:
+                # relay the msg if enabled. the status has been saved so a failed relay is alerted but does not fail the message,
+                # retrying it would save the status again
+                self.relay_run_time_status(body, instance_id, context)
+        except ValueError:
+            err_msg = f"{context}: Error loading the ECFLOW status message. Ignoring message."
 
-            # get the 3vent type if from the event name in the message
-            event_type_id, event_name = self.db_info.get_lu_id_from_msg(msg_obj, "event_type", "event_type", context=context)
+            self.logger.exception(err_msg)
+
+            # send a message to slack
+            self.general_utils.send_slack_msg(err_msg, 'slack_issues_channel')
+
+            # the message can never be loaded, set the return so that it is not retried
+            ret_val = None
+        except Exception:
+            err_msg = f"{context}: Error saving the ECFLOW status message."
+
+            self.logger.exception(err_msg)
+
+            # send a message to slack
+            self.general_utils.send_slack_msg(err_msg, 'slack_issues_channel')
+
+            # set the return to indicate failure
+            ret_val = False
+
+        # return the success flag
+        return ret_val
+
+    def ecflow_run_time_status_batch_callback(self, bodies: list) -> list:
+        """
+        The batch callback function for the ecflow run time status message queue.
+
+        The DB work for all the messages is applied in a single transaction with one multi-row event insert. If the
+        transaction fails it is rolled back and the messages are processed one at a time.
+
+        :param bodies: the message bodies in the order they were received
+        :return: a success flag for each message, False if its status was not saved and None if it cannot be loaded
+        """
+        self.logger.debug("Received a batch of %s ECFlow_rt status msgs.", len(bodies))
+
+        context = 'ecflow_run_time_status_batch_callback()'
+
+        # init the instance ids for each message. a failed message has a negative id, a message that cannot be loaded has none
+        instance_ids: list = [-1] * len(bodies)
+
+        # hold the alerts until the batch is committed
+        self.batch_alerts.msgs = []
+
+        try:
+            # start the transaction
+            with self.db_info.transaction('apsviz'):
+                # init the event column values storage
+                event_values: list = []
+
+                # for each message in the batch
+                for index, body in enumerate(bodies):
+                    try:
+                        # load and validate the message
+                        msg = RunTimeStatusMsg.decode(body)
+                    except Exception:
+                        err_msg = f"{context}: Error loading the ECFLOW status message. Ignoring message."
+
+                        self.logger.exception(err_msg)
+
+                        # send a message to slack once the batch is committed
+                        self.send_alert(err_msg)
+
+                        # the message can never be loaded, it is not retried
+                        instance_ids[index] = None
+
+                        # on to the next message
+                        continue
+
+                    # save the status to the DB, the event insert is deferred
+                    instance_ids[index] = self.apply_run_time_status(msg, context, event_values)
+
+                # insert all the events at once
+                self.db_info.insert_events(event_values)
+        except Exception:
+            self.logger.exception("%s: Error - Batch transaction failed, processing %s message(s) one at a time.", context, len(bodies))
+
+            # drop the alerts of the batch, the messages raise them again when they are processed one at a time
+            self.batch_alerts.msgs = None
+
+            # the instance and event group ids cached during the batch were rolled back
+            self.db_info.instance_cache.clear()
+            self.db_info.event_group_cache.clear()
+
+            # process the messages one at a time
+            return [self.ecflow_run_time_status_callback(None, None, None, body) for body in bodies]
+
+        # the batch has been committed, send the alerts it held
+        alerts, self.batch_alerts.msgs = self.batch_alerts.msgs, None
+
+        for err_msg in alerts:
+            self.general_utils.send_slack_msg(err_msg, 'slack_issues_channel')
 
-            # get the event type if from the event name in the message
-            state_id, state_name = self.db_info.get_lu_id_from_msg(msg_obj, "state", "state_type", context=context)
+        # relay the messages that succeeded. a failed relay is alerted but does not fail the message
+        for body, instance_id in zip(bodies, instance_ids):
+            if instance_id is not None and instance_id >= 0:
+                self.relay_run_time_status(body, instance_id, context)
 
-            # get the event advisory data
-            advisory_id = msg_obj.get("advisory_number", "N/A") if (msg_obj.get("advisory_number", "N/A") != "") else "N/A"
+        # only the messages that were not saved failed
+        return [None if instance_id is None else instance_id >= 0 for instance_id in instance_ids]
 
-            # did we get everything needed
-            if site_id[0] >= 0 and event_type_id >= 0 and state_id >= 0 and advisory_id != 'N/A':
+    def apply_run_time_status(self, msg: RunTimeStatusMsg, context: str, event_values: list = None) -> int:
+        """
+        Saves an ecflow run time status message to the DB. this creates/updates the instance and
+        event group and inserts the event.
+
+        :param msg: the decoded message
+        :param context:
+        :param event_values: if passed, the event column values are added to it instead of being inserted. not used when the
+        server-side function is turned on, the function inserts the event.
+        :return: the instance id, negative on failure
+        """
+        # get the site id from the name in the message
+        site_id = self.db_info.get_lu_id(msg.physical_location, "site", context)
+
+        # get the event type id from the event name in the message
+        event_type_id, event_name = self.db_info.get_lu_id(msg.event_type, "event_type", context), msg.event_type
+
+        # get the state type id from the state name in the message
+        state_id, state_name = self.db_info.get_lu_id(msg.state, "state_type", context), msg.state
+
+        # get the event advisory data
+        advisory_id = msg.advisory_id
+
+        # did we get everything needed
+        if site_id >= 0 and event_type_id >= 0 and state_id >= 0 and advisory_id != 'N/A':
+            # apply the whole message in one call to the server-side function if it is turned on
+            if self.db_info.run_time_status_function:
+                instance_id = self.db_info.apply_run_time_status(site_id, event_type_id, state_id, msg, context)[0]
+            else:
                 # check to see if there are any instances for this site_id yet
                 # this might happen if we start up this process in the middle of a model run
-                instance_id = self.db_info.get_existing_instance_id(site_id[0], msg_obj)
+                instance_id = self.db_info.get_existing_instance_id(site_id, msg)
 
                 # if this is a STRT event, create a new instance
                 if instance_id < 0 or (event_name == "STRT" and state_name == "RUNN"):
                     self.logger.debug("create_new_inst is True - creating new instance id, context: %s", context)
 
                     # insert the record
-                    instance_id = self.db_info.insert_instance(state_id, site_id[0], msg_obj, context)
+                    instance_id = self.db_info.insert_instance(state_id, site_id, msg, context)
 
                 else:  # just update instance
                     self.logger.debug("create_new_inst is False - updating instance id, context: %s", context)
 
                     # update the instance
-                    self.db_info.update_instance(state_id, site_id[0], instance_id, msg_obj)
+                    self.db_info.update_instance(state_id, site_id, instance_id, msg)
 
-                # if we don't have an instance id at this point we cant continue
-                if instance_id < 0:
-                    err_msg = f"{context}: Error - Cannot obtain a valid instance ID."
+            # if we don't have an instance id at this point we cant continue
+            if instance_id < 0:
+                err_msg = f"{context}: Error - Cannot obtain a valid instance ID."
 
-                    self.logger.error(err_msg)
+                self.logger.error(err_msg)
 
-                    # send a message to slack
-                    self.general_utils.send_slack_msg(err_msg, 'slack_issues_channel')
+                # send a message to slack
+                self.send_alert(err_msg)
+            elif not self.db_info.run_time_status_function:
+                # create/update the event group and insert the event
+                self.apply_run_time_event(msg, (site_id, event_type_id, state_id), instance_id, context, event_values)
+        else:
+            err_msg = f"{context}: Error - Cannot retrieve advisory number, site, event type or state type ids."
 
-                    # set the return to indicate failure
-                    ret_val = False
-                else:
-                    # check to see if there are any event groups for this site_id and inst yet
-                    # this might happen if we start up this process in the middle of a model run
-                    event_group_id = self.db_info.get_existing_event_group_id(instance_id, advisory_id, context)
+            self.logger.error(err_msg)
 
-                    # if this is the start of a group of Events, create a new event_group record
-                    # qualifying group initiation: event type = RSTR
-                    # STRT & HIND do not belong to any event group??
-                    # For now, it is required that every event belong to an event group, so I will add those as well.
-                    # create a new event group if none exist for this site & instance yet or if starting a new cycle
+            # send a message to slack
+            self.send_alert(err_msg)
 
-                    # +++++++++++++++++++++++++ Figure out how to stop creating a second event group
-                    #   after creating first one, when very first RSTR comes for this instance+++++++++++++++++++
+            # set the return to indicate failure
+            instance_id = -1
 
-                    if event_group_id < 0 or (event_name == "RSTR"):
-                        event_group_id = self.db_info.insert_event_group(state_id, instance_id, msg_obj, context)
-                    else:
-                        # don't need a new event group
-                        self.logger.debug("Reusing event_group_id: %s, context: %s", event_group_id, context)
+        # return the instance id
+        return instance_id
 
-                        # update event group with this latest state
-                        # added 3/6/19 - will set status to EXIT if this is a FEND or REND event_type
-                        # will hardcode this state id for now, until I get my messaging refactor delivered
-                        if event_name in ['FEND', 'REND']:
-                            state_id = 9
-                            self.logger.debug("Got FEND event type: setting state_id to %s, context: %s", str(state_id), context)
+    def apply_run_time_event(self, msg: RunTimeStatusMsg, lu_ids: tuple, instance_id: int, context: str, event_values: list = None):
+        """
+        Creates/updates the event group of an ecflow run time status message and inserts the event.
 
-                            self.db_info.update_event_group(state_id, event_group_id, msg_obj)
+        :param msg: the decoded message
+        :param lu_ids: the site, event type and state type ids
+        :param instance_id:
+        :param context:
+        :param event_values: if passed, the event column values are added to it instead of being inserted
+        :return:
+        """
+        # get the lookup ids
+        site_id, event_type_id, state_id = lu_ids
 
-                    # now insert message into the event table
-                    self.db_info.insert_event(site_id[0], event_group_id, event_type_id, msg_obj, context)
+        # check to see if there are any event groups for this site_id and inst yet
+        # this might happen if we start up this process in the middle of a model run
+        event_group_id = self.db_info.get_existing_event_group_id(instance_id, msg.advisory_id, context)
 
-                    # relay the msg if enabled
-                    ret_val = self.queue_utils.relay_msg(body)
+        # if this is the start of a group of Events, create a new event_group record
+        # qualifying group initiation: event type = RSTR
+        # STRT & HIND do not belong to any event group??
+        # For now, it is required that every event belong to an event group, so I will add those as well.
+        # create a new event group if none exist for this site & instance yet or if starting a new cycle
 
-                    # alert on failure
-                    if not ret_val:
-                        # create an error message
-                        err_msg = f"{context}: Error - Failure to relay message for instance id: {instance_id}."
+        # +++++++++++++++++++++++++ Figure out how to stop creating a second event group
+        #   after creating first one, when very first RSTR comes for this instance+++++++++++++++++++
 
-                        self.logger.error(err_msg)
+        if event_group_id < 0 or (msg.event_type == "RSTR"):
+            event_group_id = self.db_info.insert_event_group(state_id, instance_id, msg, context)
+        else:
+            # don't need a new event group
+            self.logger.debug("Reusing event_group_id: %s, context: %s", event_group_id, context)
 
-                        # send a message to slack
-                        self.general_utils.send_slack_msg(err_msg, 'slack_issues_channel')
-            else:
-                err_msg = f"{context}: Error - Cannot retrieve advisory number, site, event type or state type ids."
+            # update event group with this latest state
+            # added 3/6/19 - will set status to EXIT if this is a FEND or REND event_type
+            # will hardcode this state id for now, until I get my messaging refactor delivered
+            if msg.event_type in ['FEND', 'REND']:
+                state_id = 9
+                self.logger.debug("Got FEND event type: setting state_id to %s, context: %s", str(state_id), context)
 
-                self.logger.error(err_msg)
+                self.db_info.update_event_group(state_id, event_group_id, msg)
 
-                # send a message to slack
-                self.general_utils.send_slack_msg(err_msg, 'slack_issues_channel')
+        # now insert message into the event table, or save it for a multi-row insert
+        if event_values is not None:
+            event_values.append(self.db_info.get_event_values(site_id, event_group_id, event_type_id, msg, context))
+        else:
+            self.db_info.insert_event(site_id, event_group_id, event_type_id, msg, context)
 
-                # set the return to indicate failure
-                ret_val = False
-        except Exception:
-            err_msg = f"{context}: Error loading the ECFLOW status message."
+    def send_alert(self, err_msg: str):
+        """
+        sends an alert to the Slack issues channel. while a batch is applied on this thread the alert is held until the
+        batch is committed, if the batch fails its messages are processed again one at a time and raise their own alerts.
 
-            self.logger.exception(err_msg)
+        :param err_msg:
+        :return:
+        """
+        # get the alerts held for the batch on this thread, if there is one
+        alerts = getattr(self.batch_alerts, 'msgs', None)
 
-            # send a message to slack
+        if alerts is not None:
+            alerts.append(err_msg)
+        else:
             self.general_utils.send_slack_msg(err_msg, 'slack_issues_channel')
 
-            # set the return to indicate failure
-            ret_val = False
+    def relay_run_time_status(self, body, instance_id: int, context: str) -> bool:
+        """
+        Relays an ecflow run time status message and alerts on failure
+
+        :param body:
+        :param instance_id:
+        :param context:
+        :return:
+        """
+        # relay the msg if enabled
+        ret_val = self.queue_utils.relay_msg(body)
+
+        # alert on failure
+        if not ret_val:
+            # create an error message
+            err_msg = f"{context}: Error - Failure to relay message for instance id: {instance_id}."
+
+            self.logger.error(err_msg)
+
+            # send a message to slack
+            self.general_utils.send_slack_msg(err_msg, 'slack_issues_channel')
 
         # return the success flag
         return ret_val
@@ -211,7 +430,7 @@ class QueueCallbacks:
         :param method:
         :param properties:
         :param body:
-        :return:
+        :return: False if the message was not saved and should be retried, None if it is ignored and will never be saved
         """
         self.logger.debug("Received ECFlow_rp run props msg. Body is %s bytes, channel: %s, method: %s, properties: %s", len(body), channel, method,
                           properties)
@@ -227,10 +446,13 @@ class QueueCallbacks:
         # load the message
         try:
             # load the json
-            msg_obj: json = json.loads(body)
+            msg_obj: dict = json_codec.loads(body)
+
+            # map the ECFLOW params to create legacy params and reformat them
+            msg_obj = self.queue_utils.map_msg_params(msg_obj)
 
-            # map the ECFLOW params to create legacy params
-            msg_obj = self.queue_utils.extend_msg_to_legacy_equivalent(msg_obj)
+            # validate the message
+            msg = RunPropsMsg(msg_obj)
 
             # get the site id from the name in the message
             site_id = self.db_info.get_lu_id_from_msg(msg_obj, "physical_location", "site", context=context)
@@ -246,8 +468,8 @@ class QueueCallbacks:
                 # send a message to slack
                 self.general_utils.send_slack_msg(err_msg, 'slack_issues_channel')
 
-                # set the failure flag
-                ret_val = False
+                # the location will not become known, set the flag so the message is not retried
+                ret_val = None
             else:
                 self.logger.debug("site_id: %s, context: %s", str(site_id), context)
 
@@ -260,7 +482,7 @@ class QueueCallbacks:
                 # check the site id
                 if site_id[0] in site_ids:
                     # get the instance id
-                    instance_id = self.db_info.get_existing_instance_id(site_id[0], msg_obj)
+                    instance_id = self.db_info.get_existing_instance_id(site_id[0], msg)
 
                     self.logger.debug("instance_id: %s", str(instance_id))
 
@@ -271,7 +493,7 @@ class QueueCallbacks:
                             {'workflow_type': 'ECFLOW', 'supervisor_job_status': 'new', 'insertion_date': self.queue_utils.get_formatted_date()})
 
                         # insert the records
-                        err_msg: str = self.db_info.insert_config_items(instance_id, msg_obj)
+                        err_msg: str = self.db_info.insert_config_items(instance_id, msg_obj, transformed=True)
 
                         if err_msg is not None:
                             err_msg: str = f'{context}: Error - DB insert for run properties message failed: {err_msg}, ignoring message.'
@@ -282,19 +504,15 @@ class QueueCallbacks:
 
                             # set the failure flag
                             ret_val = False
-                        else:
-                            # relay the msg if enabled
-                            ret_val = self.queue_utils.relay_msg(body)
-
-                            # alert on failure
-                            if not ret_val:
-                                # create an error message
-                                err_msg = f"{context}: Error - Failure to relay message for instance id: {instance_id}."
+                        # relay the msg if enabled. the records have been saved so a failed relay is alerted but does not fail the message
+                        elif not self.queue_utils.relay_msg(body):
+                            # create an error message
+                            err_msg = f"{context}: Error - Failure to relay message for instance id: {instance_id}."
 
-                                self.logger.error(err_msg)
+                            self.logger.error(err_msg)
 
-                                # send a message to slack
-                                self.general_utils.send_slack_msg(err_msg, 'slack_issues_channel')
+                            # send a message to slack
+                            self.general_utils.send_slack_msg(err_msg, 'slack_issues_channel')
                     else:
                         err_msg: str = f"{context}: Error invalid instance ID. Ignoring message for ECFLOW {msg_obj.get('physical_location', 'N/A')}."
                         self.logger.error(err_msg)
@@ -311,10 +529,19 @@ class QueueCallbacks:
                     # send a message to slack
                     self.general_utils.send_slack_msg(err_msg, 'slack_issues_channel')
 
-                    # set the failure flag
-                    ret_val = False
+                    # the site is filtered out on purpose, set the flag so the message is not retried
+                    ret_val = None
+        except ValueError:
+            err_msg: str = f"{context}: Error loading the run properties message. Ignoring message."
+            self.logger.exception(err_msg)
+
+            # send a message to slack
+            self.general_utils.send_slack_msg(err_msg, 'slack_issues_channel')
+
+            # the message can never be loaded, set the flag so the message is not retried
+            ret_val = None
         except Exception:
-            err_msg: str = f"{context}: Error loading the run properties message."
+            err_msg: str = f"{context}: Error saving the run properties message."
             self.logger.exception(err_msg)
 
             # send a message to slack
@@ -342,7 +569,7 @@ class QueueCallbacks:
         :param method:
         :param properties:
         :param body:
-        :return:
+        :return: False if the message was not saved and should be retried, None if it is ignored and will never be saved
         """
         self.logger.debug("Received HEC/RAS msg. Body is %s bytes, channel: %s, method: %s, properties: %s", len(body), channel, method, properties)
 
@@ -357,10 +584,13 @@ class QueueCallbacks:
         # load the message
         try:
             # load the json
-            msg_obj: json = json.loads(body)
+            msg_obj: dict = json_codec.loads(body)
 
-            # map the ECFLOW params to create legacy params
-            msg_obj = self.queue_utils.extend_msg_to_legacy_equivalent(msg_obj)
+            # map the ECFLOW params to create legacy params and reformat them
+            msg_obj = self.queue_utils.map_msg_params(msg_obj)
+
+            # validate the message
+            msg = RunPropsMsg(msg_obj)
 
             # get the site id from the name in the message
             site_id = self.db_info.get_lu_id_from_msg(msg_obj, "physical_location", "site", context=context)
@@ -376,8 +606,8 @@ class QueueCallbacks:
                 # send a message to slack
                 self.general_utils.send_slack_msg(err_msg, 'slack_issues_channel')
 
-                # set the failure flag
-                ret_val = False
+                # the location will not become known, set the flag so the message is not retried
+                ret_val = None
             else:
                 self.logger.debug("site_id: %s, context: %s", str(site_id), context)
 
@@ -390,7 +620,7 @@ class QueueCallbacks:
                 # check the site id
                 if site_id[0] in site_ids:
                     # get the instance id
-                    instance_id = self.db_info.get_existing_instance_id(site_id[0], msg_obj)
+                    instance_id = self.db_info.get_existing_instance_id(site_id[0], msg)
 
                     self.logger.debug("instance_id: %s, context: %s", str(instance_id), context)
 
@@ -401,7 +631,7 @@ class QueueCallbacks:
                             {'workflow_type': 'HECRAS', 'supervisor_job_status': 'new', 'insertion_date': self.queue_utils.get_formatted_date()})
 
                         # insert the records
-                        err_msg: str = self.db_info.insert_config_items(instance_id, msg_obj, '_HECRAS')
+                        err_msg: str = self.db_info.insert_config_items(instance_id, msg_obj, '_HECRAS', transformed=True)
 
                         # was there a problem
                         if err_msg is not None:
@@ -413,19 +643,15 @@ class QueueCallbacks:
 
                             # set the failure flag
                             ret_val = False
-                        else:
-                            # relay the msg if enabled
-                            ret_val = self.queue_utils.relay_msg(body)
+                        # relay the msg if enabled. the records have been saved so a failed relay is alerted but does not fail the message
+                        elif not self.queue_utils.relay_msg(body):
+                            # create an error message
+                            err_msg = f"{context}: Error - Failure to relay message for instance id: {instance_id}."
 
-                            # alert on failure
-                            if not ret_val:
-                                # create an error message
-                                err_msg = f"{context}: Error - Failure to relay message for instance id: {instance_id}."
-
-                                self.logger.error(err_msg)
+                            self.logger.error(err_msg)
 
-                                # send a message to slack
-                                self.general_utils.send_slack_msg(err_msg, 'slack_issues_channel')
+                            # send a message to slack
+                            self.general_utils.send_slack_msg(err_msg, 'slack_issues_channel')
                     else:
                         err_msg: str = f"{context}: Error invalid instance ID. Ignoring message for HEC/RAS " \
                                        f"{msg_obj.get('physical_location', 'N/A')}."
@@ -444,10 +670,19 @@ class QueueCallbacks:
                     # send a message to slack
                     self.general_utils.send_slack_msg(err_msg, 'slack_issues_channel')
 
-                    # set the failure flag
-                    ret_val = False
+                    # the site is filtered out on purpose, set the flag so the message is not retried
+                    ret_val = None
+        except ValueError:
+            err_msg: str = f"{context}: Error loading the run properties message. Ignoring message."
+            self.logger.exception(err_msg)
+
+            # send a message to slack
+            self.general_utils.send_slack_msg(err_msg, 'slack_issues_channel')
+
+            # the message can never be loaded, set the flag so the message is not retried
+            ret_val = None
         except Exception:
-            err_msg: str = f"{context}: Error loading the run properties message."
+            err_msg: str = f"{context}: Error saving the run properties message."
             self.logger.exception(err_msg)
 
             # send a message to slack
@@ -12,26 +12,24 @@
     Authors: Lisa Stillwell, Phil Owen @RENCI.org
 """
 import os
-import json
 import datetime
-from enum import Enum
+import threading
 
 import pika
+from src.common import json_codec
 from src.common.logger import LoggingUtil
-
-
-class ReformatType(int, Enum):
-    """
-    Enum class that defines the system that needs to be synchronized
-    with a copy/move/remove operation
-    """
-    SENTENCE_CASE = 1
-    UPPERCASE = 2
-    LOWERCASE = 3
-    INTEGER = 4
-    FLOAT = 5
-    STRING = 6
-    MAKE_INT = 7
+from src.common.general_utils import GeneralUtils
+from src.common.ack_batcher import AckBatcher
+from src.common.async_queue_consumer import AsyncQueueConsumer
+from src.common.ordered_worker_pool import OrderedWorkerPool
+from src.common.msg_batcher import MsgBatcher
+from src.common.relay_publisher import RelayPublisher
+from src.common.confirm_relay_publisher import ConfirmRelayPublisher
+from src.common.relay_outbox import RelayOutbox
+from src.common.consumer_supervisor import ConsumerSupervisor
+from src.common.retry_handler import RetryHandler
+from src.common.dedup_cache import DedupCache
+from src.common.msg_transformer import MsgTransformer, ReformatType
 
 
 class QueueUtils:
@@ -64,7 +62,7 @@ class QueueUtils:
             self.logger.info('Queue: %s handler relay enabled: %s', _queue_name, str(self.is_relay_enabled()))
 
         # declare the ECFlow and HEC/RAS target params to legacy keys mapping dict
-        self.msg_extend_params = {'suite.physical_location': ['physical_location', 'monitoring.rmqmessaging.locationname'],
+        self._msg_extend_params = {'suite.physical_location': ['physical_location', 'monitoring.rmqmessaging.locationname'],
                                   'suite.instance_name': ['instance_name', 'instancename'], 'suite.project_code': [], 'suite.uid': ['uid'],
                                   'suite.adcirc.gridname': ['ADCIRCgrid', 'adcirc.gridname'], 'time.currentdate': ['currentdate'],
                                   'time.currentcycle': ['currentcycle'], 'forcing.advisory': ['advisory'],
@@ -74,77 +72,355 @@ class QueueUtils:
                                   'forcing.vortexmodel': ['forcing.tropicalcyclone.vortexmodel']}
 
         # declare param transformation selections
-        self.msg_transform_params = {'storm': ReformatType.INTEGER, 'stormnumber': ReformatType.MAKE_INT, 'forcing.stormname': ReformatType.UPPERCASE,
-                                     'stormname': ReformatType.UPPERCASE, 'forcing.tropicalcyclone.stormname': ReformatType.UPPERCASE}
+        self._msg_transform_params = {'storm': ReformatType.INTEGER, 'stormnumber': ReformatType.MAKE_INT,
+                                      'forcing.stormname': ReformatType.UPPERCASE, 'stormname': ReformatType.UPPERCASE,
+                                      'forcing.tropicalcyclone.stormname': ReformatType.UPPERCASE}
+
+        # compile the mapping and transformation tables
+        self.msg_transformer: MsgTransformer = MsgTransformer(self._msg_extend_params, self._msg_transform_params, _logger=self.logger)
+
         # save the queue name
         self.queue_name = _queue_name
 
-    def start_consuming(self, callback):
+        # get the manual ack settings. when enabled, messages are acknowledged only after they have been processed
+        self.manual_ack: bool = os.environ.get('MANUAL_ACK_ENABLED', 'False').lower() in ('true', '1', 't')
+
+        # the max number of unacknowledged messages the broker will push to this consumer
+        self.prefetch_count: int = int(os.environ.get('PREFETCH_COUNT', '50'))
+
+        # acks are grouped into a single multi-ack every N messages or T milliseconds
+        self.ack_batch_size: int = int(os.environ.get('ACK_BATCH_SIZE', '10'))
+        self.ack_batch_ms: int = int(os.environ.get('ACK_BATCH_MS', '250'))
+
+        # get the consumer engine that will be used to handle the queue (blocking or asyncio)
+        self.consumer_engine: str = os.environ.get('CONSUMER_ENGINE', 'blocking').lower()
+
+        # get the number of ordered worker threads for queues that have a shard key. 0 processes messages on the I/O thread
+        self.worker_pool_size: int = int(os.environ.get('WORKER_POOL_SIZE', '0'))
+
+        # get the micro-batch limits for queues that have a batch callback. a batch size of 0 processes messages one at a time
+        self.msg_batch_size: int = int(os.environ.get('MSG_BATCH_SIZE', '0'))
+        self.msg_batch_ms: int = int(os.environ.get('MSG_BATCH_MS', '100'))
+
+        # get the flag that turns on relaying with pipelined publisher confirms
+        self.relay_confirms: bool = os.environ.get('RELAY_CONFIRMS_ENABLED', 'False').lower() in ('true', '1', 't')
+
+        # get the flag that turns on spooling relay messages to disk when the relay host is down. this also turns on the confirms
+        self.relay_outbox: bool = os.environ.get('RELAY_OUTBOX_ENABLED', 'False').lower() in ('true', '1', 't')
+
+        # the supervisor and retry handler of the consumers. they are only created when queues are consumed (see consume_queues())
+        self.supervisor = None
+        self.retry_handler = None
+
+    def start_consuming(self, callback, shard_key=None, batch_callback=None):
         """
-        Creates and starts consuming queue messages
+        Creates and starts consuming queue messages with the configured consumer engine
 
         :param callback:
+        :param shard_key: optional function that gets the ordering key from a message body. see consume_queues().
+        :param batch_callback: optional callback that handles a list of message bodies. see consume_queues().
         :return:
         """
+        # consume this queue only
+        self.consume_queues({self.queue_name: callback}, {self.queue_name: shard_key} if shard_key else None,
+                            {self.queue_name: batch_callback} if batch_callback else None)
+
+    def consume_queues(self, queue_callbacks: dict, shard_keys: dict = None, batch_callbacks: dict = None):
+        """
+        Creates and starts consuming messages from a set of queues with the configured consumer engine.
+        all queues share a single connection to the queue host with one channel per queue.
+
+        when WORKER_POOL_SIZE is set, the messages of queues that have a shard key function are processed
+        on a pool of worker threads. messages with the same key are always processed in order.
+
+        when MSG_BATCH_SIZE is set, the messages of queues that have a batch callback are collected into
+        micro-batches (blocking consumer engine only). this takes precedence over the worker pool.
+
+        when the connection to the queue host is lost the channels and consumers are rebuilt on a new
+        connection after a jittered exponential backoff (see ConsumerSupervisor).
+
+        when RETRY_ENABLED is set, messages whose callback returns False are retried later through delay
+        queues and end up in a dead-letter queue if they keep failing (see RetryHandler).
+
+        when DEDUP_ENABLED is set, messages that were already handled successfully are skipped (see DedupCache).
+
+        :param queue_callbacks: a dict of queue name: callback
+        :param shard_keys: a dict of queue name: shard key function
+        :param batch_callbacks: a dict of queue name: batch callback
+        :return:
+        """
+        # init the shard key functions and batch callbacks
+        shard_keys = shard_keys or {}
+        batch_callbacks = batch_callbacks or {}
+
+        # create the supervisor that reconnects the consumers when the queue host connection is lost
+        self.supervisor = ConsumerSupervisor(_logger=self.logger)
+
+        # create the handler that retries failed messages through delay queues (if enabled with RETRY_ENABLED)
+        self.retry_handler = RetryHandler(_logger=self.logger)
+
+        # create the cache of handled messages
+        dedup_cache = DedupCache(_logger=self.logger)
+
+        # if enabled, messages that have already been handled are acknowledged and skipped
+        if dedup_cache.enabled:
+            queue_callbacks = {queue_name: dedup_cache.wrap(queue_name, callback) for queue_name, callback in queue_callbacks.items()}
+            batch_callbacks = {queue_name: dedup_cache.wrap_batch(queue_name, callback) for queue_name, callback in batch_callbacks.items()}
+
+        # is the asyncio consumer engine selected
+        if self.consumer_engine == 'asyncio':
+            self.logger.info('%s using the asyncio consumer engine.', list(queue_callbacks))
+
+            # micro-batches would hold up the event loop, they are not used with this engine
+            if batch_callbacks and self.msg_batch_size > 0:
+                self.logger.warning('Message batching is not supported by the asyncio consumer engine, messages are processed one at a time.')
+
+            # consume the messages on the asyncio event loop, a new consumer is created for each connection
+            def consume():
+                AsyncQueueConsumer(self, _logger=self.logger).start_consuming(queue_callbacks, shard_keys)
+        else:
+            # consume the messages on the blocking connection
+            def consume():
+                self.start_blocking_consuming(queue_callbacks, shard_keys, batch_callbacks)
+
         try:
-            # create a new queue message handler
-            channel: pika.adapters.blocking_connection.BlockingChannel = self.create_msg_listener()
+            # start consuming the messages, reconnecting each time the connection is lost
+            self.supervisor.run(consume, str(list(queue_callbacks)))
+        finally:
+            # finish relaying any messages in flight. the messages in the outbox are kept for the next run
+            RelayOutbox.stop_outboxes()
+            RelayPublisher.stop_publishers()
+
+    def get_worker_pool(self, queue_name: str, shard_keys: dict):
+        """
+        creates an ordered worker pool for the queue if one is configured
 
-            # check to see if we got a channel to the queue
-            if not channel:
-                self.logger.error("Error: Did not get a channel to queue %s.", self.queue_name)
+        :param queue_name:
+        :param shard_keys: a dict of queue name: shard key function
+        :return:
+        """
+        # init the return
+        worker_pool = None
+
+        # does this queue use a worker pool
+        if self.worker_pool_size > 0 and shard_keys.get(queue_name) is not None:
+            # create the pool
+            worker_pool = OrderedWorkerPool(self.worker_pool_size, shard_keys[queue_name], name=queue_name, _logger=self.logger)
+
+            self.logger.info('%s ordered worker pool enabled. worker count: %s.', queue_name, self.worker_pool_size)
+
+            # without manual acks there is nothing limiting the number of queued messages
+            if not self.manual_ack:
+                self.logger.warning('%s ordered worker pool is running without manual acks, the message backlog is not bounded.', queue_name)
+
+        # return the pool
+        return worker_pool
+
+    def start_blocking_consuming(self, queue_callbacks: dict, shard_keys: dict, batch_callbacks: dict):
+        """
+        Creates and starts consuming queue messages on a blocking connection
+
+        :param queue_callbacks: a dict of queue name: callback
+        :param shard_keys: a dict of queue name: shard key function
+        :param batch_callbacks: a dict of queue name: batch callback
+        :return:
+        """
+        # init the ack batchers, one per channel
+        ack_batchers: list = []
+
+        # init the message handlers (worker pools and msg batchers)
+        handlers: list = []
+
+        try:
+            # get a connection to the queue host
+            connection: pika.BlockingConnection = self.create_connection()
+
+            # check to see if we got a connection
+            if not connection:
+                self.logger.error("Error: Did not get a connection for queue(s) %s.", list(queue_callbacks))
             else:
-                # specify the queue callback handler
-                channel.basic_consume(self.queue_name, callback, auto_ack=True)
+                # for each queue requested
+                for queue_name, callback in queue_callbacks.items():
+                    # create a new queue message handler
+                    channel: pika.adapters.blocking_connection.BlockingChannel = self.create_msg_listener(connection, queue_name)
+
+                    # check to see if we got a channel to the queue
+                    if not channel:
+                        self.logger.error("Error: Did not get a channel to queue %s.", queue_name)
+
+                        # release the connection, no need to continue
+                        connection.close()
+                        return
+
+                    # set up the consumer on the channel
+                    ack_batcher, handler = self.start_channel_consumer(channel, queue_name, callback, shard_keys, batch_callbacks)
+
+                    # save the ack batcher and message handler for clean up
+                    if ack_batcher is not None:
+                        ack_batchers.append(ack_batcher)
 
-                # start the queue listener/handler
-                channel.start_consuming()
+                    if handler is not None:
+                        handlers.append(handler)
 
-                self.logger.info('%s listener configured and waiting for messages.', self.queue_name)
+                    self.logger.info('%s listener configured and waiting for messages.', queue_name)
+
+                # let the supervisor know the consumers are back up
+                self.supervisor.on_connected()
+
+                # start the queue listener/handler. this services every channel on the connection
+                while connection.is_open:
+                    connection.process_data_events(time_limit=None)
         except Exception:
-            self.logger.exception("Error: Exception consuming queue %s.", self.queue_name)
+            self.logger.exception("Error: Exception consuming queue(s) %s.", list(queue_callbacks))
+        finally:
+            # finish the messages the handlers have
+            for handler in handlers:
+                handler.stop()
+
+            # send any acks that are still waiting
+            for ack_batcher in ack_batchers:
+                if ack_batcher.channel is not None and ack_batcher.channel.is_open:
+                    ack_batcher.flush()
+
+    def start_channel_consumer(self, channel, queue_name: str, callback, shard_keys: dict, batch_callbacks: dict) -> tuple:
+        """
+        Starts a consumer for the queue on a blocking channel
+
+        :param channel:
+        :param queue_name:
+        :param callback:
+        :param shard_keys: a dict of queue name: shard key function
+        :param batch_callbacks: a dict of queue name: batch callback
+        :return: the ack batcher and the msg batcher or worker pool used by the consumer (or None)
+        """
+        # init the ack batcher for this channel
+        ack_batcher = None
+
+        # are we acknowledging messages after they have been processed
+        if self.manual_ack:
+            # limit the number of unacknowledged messages pushed to this consumer
+            channel.basic_qos(prefetch_count=self.prefetch_count)
+
+            # create the object that groups the acks
+            ack_batcher = AckBatcher(self.ack_batch_size, self.ack_batch_ms, _logger=self.logger)
+
+            self.logger.info('%s manual ack enabled. prefetch count: %s, ack batch size: %s, ack batch ms: %s.', queue_name, self.prefetch_count,
+                             self.ack_batch_size, self.ack_batch_ms)
+
+        # failed messages are sent to the delay queues to be retried later
+        if self.retry_handler.enabled:
+            callback = self.retry_handler.wrap(queue_name, callback)
+
+        # get the msg batcher or worker pool for this queue if there is one
+        handler = self.get_msg_batcher(queue_name, batch_callbacks) or self.get_worker_pool(queue_name, shard_keys)
+
+        # the msg batcher handles the messages in batches and acks them after each batch
+        if isinstance(handler, MsgBatcher):
+            on_message = handler.wrap(batch_callbacks[queue_name], ack_batcher)
+        # the worker pool handles the messages and the acks
+        elif isinstance(handler, OrderedWorkerPool):
+            on_message = handler.wrap(callback, ack_batcher)
+        # the ack batcher acks the messages after the callback
+        elif ack_batcher is not None:
+            on_message = ack_batcher.wrap(callback)
+        else:
+            on_message = callback
+
+        # specify the queue callback handler
+        channel.basic_consume(queue_name, on_message, auto_ack=ack_batcher is None)
+
+        # return the consumer objects
+        return ack_batcher, handler
+
+    def get_msg_batcher(self, queue_name: str, batch_callbacks: dict):
+        """
+        creates a msg batcher for the queue if one is configured
+
+        :param queue_name:
+        :param batch_callbacks: a dict of queue name: batch callback
+        :return:
+        """
+        # init the return
+        msg_batcher = None
+
+        # does this queue use micro-batches
+        if self.msg_batch_size > 0 and batch_callbacks.get(queue_name) is not None:
+            # create the batcher
+            msg_batcher = MsgBatcher(self.msg_batch_size, self.msg_batch_ms, self.retry_handler.get_failure_callback(queue_name), _logger=self.logger)
+
+            self.logger.info('%s message batching enabled. batch size: %s, batch ms: %s.', queue_name, self.msg_batch_size, self.msg_batch_ms)
+
+        # return the batcher
+        return msg_batcher
 
-    def create_msg_listener(self):
+    def create_connection(self):
         """
-        Creates a new queue message listener
+        Creates a new connection to the queue host
 
         :return:
         """
         # init the return
         # noinspection PyTypeChecker
-        channel: pika.adapters.blocking_connection.BlockingChannel = None
+        connection: pika.BlockingConnection = None
 
         try:
-            # set up AMQP credentials and connect to a queue
-            credentials: pika.PlainCredentials = pika.PlainCredentials(os.environ.get("RABBITMQ_USER"), os.environ.get("RABBITMQ_PW"))
+            # get a connection to the queue host
+            connection = pika.BlockingConnection(self.get_connect_params())
+        except Exception:
+            self.logger.exception("Error: Exception on the creation of a connection to %s:5672.", os.environ.get("RABBITMQ_HOST"))
 
-            # set up the connection parameters
-            connect_params: pika.ConnectionParameters = pika.ConnectionParameters(os.environ.get("RABBITMQ_HOST"), 5672, '/', credentials,
-                                                                                  socket_timeout=2)
+        # return the connection
+        return connection
 
-            # get a connection to the queue
-            connection: pika.BlockingConnection = pika.BlockingConnection(connect_params)
+    def create_msg_listener(self, connection: pika.BlockingConnection, queue_name: str):
+        """
+        Creates a new queue message listener on the connection passed
+
+        :param connection:
+        :param queue_name:
+        :return:
+        """
+        # init the return
+        # noinspection PyTypeChecker
+        channel: pika.adapters.blocking_connection.BlockingChannel = None
 
+        try:
             # create a new queue channel
             channel: pika.adapters.blocking_connection.BlockingChannel = connection.channel()
 
             # specify the queue that will be listened to
-            channel.queue_declare(queue=self.queue_name)
+            channel.queue_declare(queue=queue_name)
 
-            self.logger.info('%s channel configured on %s:5672.', self.queue_name, os.environ.get("RABBITMQ_HOST"))
+            self.logger.info('%s channel configured on %s:5672.', queue_name, os.environ.get("RABBITMQ_HOST"))
         except Exception:
-            self.logger.exception("Error: Exception on the creation of channel to %s.", self.queue_name)
+            self.logger.exception("Error: Exception on the creation of channel to %s.", queue_name)
 
         # return the queue channel
         return channel
 
+    @staticmethod
+    def get_connect_params() -> pika.ConnectionParameters:
+        """
+        Creates the connection parameters for the queue host
+
+        :return:
+        """
+        # set up AMQP credentials and connect to a queue
+        credentials: pika.PlainCredentials = pika.PlainCredentials(os.environ.get("RABBITMQ_USER"), os.environ.get("RABBITMQ_PW"))
+
+        # return the connection parameters
+        return pika.ConnectionParameters(os.environ.get("RABBITMQ_HOST"), 5672, '/', credentials, socket_timeout=2)
+
     def relay_msg(self, body: bytes, force: bool = False) -> bool:
         """
         relays a received message to another queue. It expects the value directly from the queue.
 
+        with publisher confirms (or the outbox) the message is left in flight and this does not wait for the confirm. a relay
+        that fails later is logged and alerted, or spooled to the outbox.
+
         :param: body
         :param: force
-        :return:
+        :return: False if the message could not be relayed or queued for relaying
         """
         # init the return value
         ret_val: bool = True
@@ -167,52 +443,86 @@ class QueueUtils:
 
                 # if relay is enabled or being forced
                 if relay_enabled:
-                    # init the connection
-                    connection = None
-
                     # add context to this relay
-                    # first convert the incoming byte array into a json object
-                    msg_obj = json.loads(body)
-
-                    # add the relay context
-                    msg_obj |= {'relay_context': os.environ.get('SYSTEM', 'Unknown')}
+                    new_body: bytes = self.add_relay_context(body, os.environ.get('SYSTEM', 'Unknown'))
 
-                    # convert it back to a byte array
-                    new_body = json.dumps(msg_obj).encode()
+                    # get the type of publisher to relay with. the outbox needs the confirms to know when a spooled message can be removed
+                    publisher_class = ConfirmRelayPublisher if self.relay_confirms or self.relay_outbox else RelayPublisher
 
                     try:
-                        # create credentials
-                        credentials: pika.PlainCredentials = pika.PlainCredentials(relay_user, relay_password)
-
-                        # create connection parameters
-                        parameters: pika.ConnectionParameters = pika.ConnectionParameters(relay_host, 5672, '/', credentials,
-                                                                                          socket_timeout=2)
-
-                        # get a connection to the queue
-                        connection = pika.BlockingConnection(parameters)
-
-                        # get a channel to the consumer
-                        channel: pika.adapters.blocking_connection.BlockingChannel = connection.channel()
+                        # get the shared connection to the relay host
+                        publisher = publisher_class.get_publisher(relay_host, relay_user, relay_password, _logger=self.logger)
 
-                        # create the queue (is this needed?)
-                        channel.queue_declare(queue=self.queue_name)
+                        # if enabled, relay through the outbox so the message is spooled if the relay host is down
+                        outbox = RelayOutbox.get_outbox(publisher, _logger=self.logger) if self.relay_outbox else None
 
-                        # push the message to the queue
-                        channel.basic_publish(exchange='', routing_key=self.queue_name, body=new_body)
+                        # push the message to the queue. with confirms the result is handled once the message is confirmed
+                        if outbox is not None:
+                            outbox.submit(self.queue_name, new_body)
+                        elif publisher_class is ConfirmRelayPublisher:
+                            publisher.submit(self.queue_name, new_body).add_done_callback(self.on_relay_done)
+                        else:
+                            publisher.publish(self.queue_name, new_body)
 
                     except Exception:
                         self.logger.exception("Error: Exception relaying message to queue: %s.", self.queue_name)
 
                         # set the return status to fail
                         ret_val = False
-                    finally:
-                        # close the connection if it was created
-                        if connection is not None:
-                            connection.close()
 
         # return pass/fail
         return ret_val
 
+    def on_relay_done(self, future):
+        """
+        logs and alerts a relay that failed after the message was queued. this is called on the relay publisher's thread,
+        the alert is sent on another thread so it does not hold up the relaying.
+
+        :param future: the result of the relay
+        :return:
+        """
+        if future.exception() is not None:
+            err_msg: str = f'Error: Failure to relay a message to queue: {self.queue_name}. {future.exception()}'
+
+            self.logger.error(err_msg)
+
+            # send a message to slack
+            threading.Thread(target=GeneralUtils(_logger=self.logger).send_slack_msg, args=(err_msg, 'slack_issues_channel'), daemon=True).start()
+
+    @staticmethod
+    def add_relay_context(body, context: str) -> bytes:
+        """
+        adds the relay context to a message body. the context is spliced into the raw bytes of the
+        JSON object so the message does not have to be decoded and encoded again.
+
+        :param body:
+        :param context:
+        :return:
+        """
+        # make sure we have a byte array
+        if isinstance(body, str):
+            body = body.encode()
+
+        # get the body up to the closing brace of the JSON object
+        head: bytes = body.rstrip()
+
+        # if this is a JSON object that does not have a relay context yet, splice it in before the closing brace
+        if head.endswith(b'}') and b'"relay_context"' not in head:
+            # get the body without the closing brace
+            head = head[:-1].rstrip()
+
+            # add the relay context, separating it from any existing items
+            return head + (b'' if head.endswith(b'{') else b', ') + b'"relay_context": ' + json_codec.dumps(context) + b'}'
+
+        # otherwise convert the incoming byte array into a json object
+        msg_obj = json_codec.loads(body)
+
+        # add the relay context
+        msg_obj |= {'relay_context': context}
+
+        # convert it back to a byte array
+        return json_codec.dumps(msg_obj)
+
     @staticmethod
     def is_relay_enabled(force: bool = False) -> bool:
         """
@@ -225,26 +535,53 @@ class QueueUtils:
         # return the evaluation
         return os.environ.get('RELAY_ENABLED', 'False').lower() in ('true', '1', 't') or force
 
-    def extend_msg_to_legacy_equivalent(self, run_params: dict) -> dict:
+    @property
+    def msg_extend_params(self) -> dict:
         """
-        Maps the ECFLOW params to create legacy params
+        gets the ECFlow and HEC/RAS target params to legacy keys mapping dict
+
+        :return:
+        """
+        return self._msg_extend_params
 
+    @msg_extend_params.setter
+    def msg_extend_params(self, msg_extend_params: dict):
+        """
+        sets the mapping dict and recompiles the transformer
+
+        :param msg_extend_params:
         :return:
         """
-        # save the entire incoming dict into the return
-        ret_val: dict = run_params.copy()
+        self._msg_extend_params = msg_extend_params
+        self.msg_transformer = MsgTransformer(self._msg_extend_params, self._msg_transform_params, _logger=self.logger)
 
-        # go through the params, search for a target, transform it into the legacy equivalent
-        for key, values in self.msg_extend_params.items():
-            # find this in the run params
-            if key in run_params:
-                # grab the new keys from the transform legacy keys list
-                for new_key in values:
-                    # add the transform key with the run props data value to the dict
-                    ret_val.update({new_key: run_params[key]})
+    @property
+    def msg_transform_params(self) -> dict:
+        """
+        gets the param transformation selections
 
-        # return the new set of transformed params
-        return ret_val
+        :return:
+        """
+        return self._msg_transform_params
+
+    @msg_transform_params.setter
+    def msg_transform_params(self, msg_transform_params: dict):
+        """
+        sets the param transformation selections and recompiles the transformer
+
+        :param msg_transform_params:
+        :return:
+        """
+        self._msg_transform_params = msg_transform_params
+        self.msg_transformer = MsgTransformer(self._msg_extend_params, self._msg_transform_params, _logger=self.logger)
+
+    def extend_msg_to_legacy_equivalent(self, run_params: dict) -> dict:
+        """
+        Maps the ECFLOW params to create legacy params
+
+        :return:
+        """
+        return self.msg_transformer.run(run_params, self.msg_transformer.extend_plan)
 
     def transform_msg_params(self, run_params: dict) -> dict:
         """
@@ -253,64 +590,17 @@ class QueueUtils:
         :param run_params:
         :return:
         """
-        # save the entire incoming dict into the return
-        ret_val: dict = run_params.copy()
-
-        # init the param value
-        param: str = ''
-
-        # go through the params, search for a target, transform it into the legacy equivalent
-        for key, value in self.msg_transform_params.items():
-            # find this in the run params
-            if key in run_params:
-                try:
-                    # grab the parameter value
-                    param: str = run_params[key]
-
-                    # make sure there is something to reformat. if not just skip it...
-                    if param is not None and len(param) > 0:
-                        # for any reformatting type
-                        match value:
-                            case ReformatType.INTEGER:
-                                # try to make the conversion
-                                if param.isdigit():
-                                    # make the conversion
-                                    ret_val.update({key: str(int(param))})
-                            case ReformatType.FLOAT:
-                                # try to make the conversion
-                                if param.replace('.', '1').replace('e', '1').isdigit():
-                                    # make the conversion
-                                    ret_val.update({key: str(float(param))})
-                            case ReformatType.UPPERCASE:
-                                # make the conversion
-                                ret_val.update({key: param.upper()})
-                            case ReformatType.LOWERCASE:
-                                # make the conversion
-                                ret_val.update({key: param.lower()})
-                            case ReformatType.SENTENCE_CASE:
-                                # make the conversion
-                                ret_val.update({key: param[:1].upper() + param[1:].lower()})
-                            case ReformatType.STRING:
-                                # make the conversion
-                                ret_val.update({key: str(param)})
-                            case ReformatType.MAKE_INT:
-                                # strip off all non-numeric characters
-                                val = "".join(n for n in param if n.isnumeric())
-
-                                # check to see if a number is left. if so, pad it
-                                if val.isnumeric():
-                                    ret_val.update({key: val.rjust(2, '0')})
-                                # else this is not a number
-                                else:
-                                    ret_val.update({key: 'NaN'})
-                            case _:
-                                self.logger.error("Invalid conversion type found.")
-                except Exception:
-                    # log the exception
-                    self.logger.error('Error: Could not convert %s value %s into %s.', key, param, value)
-
-        # return the new set of transformed params
-        return ret_val
+        return self.msg_transformer.run(run_params, self.msg_transformer.transform_plan)
+
+    def map_msg_params(self, run_params: dict) -> dict:
+        """
+        Maps the ECFLOW params to create legacy params and reformats them in a single pass. this is the same
+        as transform_msg_params(extend_msg_to_legacy_equivalent(run_params)).
+
+        :param run_params:
+        :return:
+        """
+        return self.msg_transformer.run(run_params)
 
     @staticmethod
     def get_formatted_date() -> str:
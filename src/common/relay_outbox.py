@@ -0,0 +1,465 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Relay Outbox - a durable on-disk spool for relay messages that could not be delivered.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import os
+import sys
+import fcntl
+import struct
+import threading
+from collections import deque
+
+from src.common.logger import LoggingUtil
+from src.common.general_utils import GeneralUtils
+
+# the header of each record in a segment file: the queue name length and the body length
+RECORD_HEADER: struct.Struct = struct.Struct('>HI')
+
+
+class RelayOutbox:
+    """
+    Spools relay messages to append-only segment files when the relay host cannot be reached.
+
+    Once anything is spooled, new relay messages go straight to the outbox so they stay in order and do not
+    wait on connection timeouts. A background thread replays the outbox through the publisher in order,
+    backing off while the relay host is down. the publisher must confirm the messages (see ConfirmRelayPublisher),
+    the progress through a segment is only saved and a segment is only removed once its messages are confirmed.
+
+    Each process has its own outbox directory ("<RELAY_OUTBOX_PATH>/<relay host>/<RELAY_OUTBOX_NAME>", the name
+    defaults to the name of the program) so the handlers do not compete for one. the depth of the outbox is written
+    to the "depth" file in the directory and an alert is sent when it reaches RELAY_OUTBOX_ALERT_DEPTH.
+    """
+
+    # the outboxes for each relay host, shared across the process
+    outboxes: dict = {}
+
+    # protects the creation of outboxes
+    outboxes_lock: threading.Lock = threading.Lock()
+
+    def __init__(self, publisher, path: str, _logger=None):
+        """
+        init the relay outbox object and start the drainer
+
+        :param publisher: the relay publisher the spooled messages are replayed through
+        :param path: the directory of the segment files
+        :param _logger:
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.Msg-Handler.RelayOutbox", level=log_level, line_format='medium', log_file_path=log_path)
+
+        # save the publisher and the outbox directory
+        self.publisher = publisher
+        self.path: str = path
+
+        # get the segment size, the longest time to wait between drain attempts and the most messages in flight while draining
+        self.segment_bytes: int = int(os.environ.get('RELAY_OUTBOX_SEGMENT_BYTES', '1000000'))
+        self.max_backoff: int = int(os.environ.get('RELAY_OUTBOX_MAX_BACKOFF', '300'))
+        self.max_inflight: int = max(int(os.environ.get('RELAY_OUTBOX_MAX_INFLIGHT', '100')), 1)
+
+        # get the depth that raises an alert
+        self.alert_depth: int = int(os.environ.get('RELAY_OUTBOX_ALERT_DEPTH', '100'))
+
+        # the depth last written to the depth file, the file is written the first time
+        self.reported_depth: int = -1
+
+        # create the general utilities class for the alerts
+        self.general_utils: GeneralUtils = GeneralUtils(_logger=self.logger)
+
+        # make sure the outbox directory exists
+        os.makedirs(path, exist_ok=True)
+
+        # take ownership of the outbox directory. this fails if another process is using it
+        self.lock_fd: int = os.open(os.path.join(path, 'outbox.lock'), os.O_RDWR | os.O_CREAT)
+
+        try:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(self.lock_fd)
+            raise
+
+        # protects the segment files and depth
+        self.lock: threading.Lock = threading.Lock()
+
+        # the name and file descriptor of the segment being appended to
+        self.segment_name = None
+        self.segment_fd = None
+
+        # get the number of messages left in the outbox from a previous run
+        self.depth: int = sum(len(list(self.read_records(segment, self.read_offset(segment)))) for segment in self.get_segments())
+
+        if self.depth:
+            self.logger.warning('Relay outbox %s has %s message(s) waiting from a previous run.', path, self.depth)
+
+        # start the drainer
+        self.stopped: threading.Event = threading.Event()
+        self.thread: threading.Thread = threading.Thread(target=self.drain, name='relay-outbox', daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def get_outbox(cls, publisher, _logger=None):
+        """
+        gets the shared outbox for the publisher's relay host, creating it if needed. returns None if the outbox cannot be used.
+
+        :param publisher:
+        :param _logger:
+        :return:
+        """
+        with cls.outboxes_lock:
+            # create the outbox if this is the first use of the host
+            if publisher.host not in cls.outboxes:
+                # get the outbox directory for the host and this process
+                path: str = os.path.join(os.environ.get('RELAY_OUTBOX_PATH', os.path.join(os.getenv('LOG_PATH', os.path.dirname(__file__)),
+                                                                                           'relay_outbox')), publisher.host,
+                                         os.environ.get('RELAY_OUTBOX_NAME', os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'default'))
+
+                try:
+                    cls.outboxes[publisher.host] = cls(publisher, path, _logger=_logger)
+
+                    # let the publisher know its failed messages will be spooled
+                    publisher.outbox = cls.outboxes[publisher.host]
+                except OSError:
+                    # relaying still works, just without the outbox
+                    err_msg: str = f'Error: Relay outbox {path} could not be opened, it may be in use by another process. ' \
+                                   'Relay messages will NOT be spooled. Set RELAY_OUTBOX_NAME to give each process its own outbox.'
+
+                    publisher.logger.exception(err_msg)
+
+                    # make sure someone hears about it
+                    GeneralUtils(_logger=publisher.logger).send_slack_msg(err_msg, 'slack_issues_channel')
+
+                    cls.outboxes[publisher.host] = None
+
+            # return the outbox
+            return cls.outboxes[publisher.host]
+
+    @classmethod
+    def stop_outboxes(cls):
+        """
+        stops all the shared outboxes. the spooled messages are kept for the next run.
+
+        :return:
+        """
+        with cls.outboxes_lock:
+            # stop each outbox
+            for outbox in cls.outboxes.values():
+                if outbox is not None:
+                    outbox.stop()
+
+            # they will be recreated if needed
+            cls.outboxes.clear()
+
+    def get_depth(self) -> int:
+        """
+        gets the number of messages waiting in the outbox
+
+        :return:
+        """
+        return self.depth
+
+    def submit(self, queue_name: str, body: bytes):
+        """
+        relays a message without waiting for the confirm. the message is spooled if the relay host cannot be reached, the
+        outbox is still draining or the relay fails later.
+
+        :param queue_name:
+        :param body:
+        :return:
+        """
+        with self.lock:
+            # while anything is waiting the new messages go after it
+            if self.depth:
+                self.append_record(queue_name, body)
+                return
+
+        try:
+            # push the message to the queue, the result is handled once it is confirmed
+            self.publisher.submit(queue_name, body).add_done_callback(lambda future: self.on_relay_done(future, queue_name, body))
+        except Exception:
+            self.logger.warning('Error: Relay to %s failed, spooling the message to the outbox.', self.publisher.host)
+
+            # spool the message
+            self.append(queue_name, body)
+
+    def on_relay_done(self, future, queue_name: str, body: bytes):
+        """
+        spools a message whose relay failed
+
+        :param future: the result of the relay
+        :param queue_name:
+        :param body:
+        :return:
+        """
+        if future.exception() is not None:
+            self.logger.warning('Error: Relay to %s failed: %s, spooling the message to the outbox.', self.publisher.host, future.exception())
+
+            # spool the message
+            self.append(queue_name, body)
+
+    def append(self, queue_name: str, body: bytes):
+        """
+        spools a message to the outbox
+
+        :param queue_name:
+        :param body:
+        :return:
+        """
+        with self.lock:
+            self.append_record(queue_name, body)
+
+    def append_record(self, queue_name: str, body: bytes):
+        """
+        writes a message to the end of the current segment file. the lock must be held.
+
+        :param queue_name:
+        :param body:
+        :return:
+        """
+        # start a new segment if there is none or the current one is full
+        if self.segment_fd is None or os.fstat(self.segment_fd).st_size >= self.segment_bytes:
+            # close the full segment
+            self.close_segment()
+
+            # the segments are numbered in the order they are created
+            segments: list = self.get_segments()
+            number: int = int(segments[-1].split('.')[0]) + 1 if segments else 1
+
+            # open the new segment
+            self.segment_name = f'{number:012d}.seg'
+            self.segment_fd = os.open(os.path.join(self.path, self.segment_name), os.O_WRONLY | os.O_CREAT | os.O_APPEND)
+
+        # write the message and make sure it is on disk
+        name: bytes = queue_name.encode()
+        os.write(self.segment_fd, RECORD_HEADER.pack(len(name), len(body)) + name + body)
+        os.fsync(self.segment_fd)
+
+        # one more message waiting
+        self.depth += 1
+
+    def drain(self):
+        """
+        replays the spooled messages in order, backing off while the relay host is down
+
+        :return:
+        """
+        # init the time to wait between attempts
+        backoff: float = 1
+
+        # until the outbox is stopped
+        while not self.stopped.wait(backoff):
+            # let the monitoring know how many messages are waiting
+            self.report_depth()
+
+            # is there anything to replay
+            if not self.depth:
+                backoff = 1
+                continue
+
+            try:
+                # replay the spooled messages
+                self.drain_segments()
+
+                self.logger.info('Relay outbox drained, %s message(s) waiting.', self.depth)
+
+                # start over with the wait time
+                backoff = 1
+            except Exception as e:
+                # wait longer each time
+                backoff = min(backoff * 2, self.max_backoff)
+
+                self.logger.warning('Error: Relay outbox drain failed: %s. %s message(s) waiting, retrying in %s seconds.', e, self.depth, backoff)
+
+    def report_depth(self):
+        """
+        writes the depth of the outbox to the depth file and alerts when it reaches the alert depth or empties again
+
+        :return:
+        """
+        # get the depth
+        depth: int = self.depth
+
+        # has it changed
+        if depth == self.reported_depth:
+            return
+
+        try:
+            # write the depth next to the old file and swap them so a partly written file is never read
+            with open(os.path.join(self.path, 'depth.tmp'), 'w', encoding='utf-8') as depth_file:
+                depth_file.write(str(depth))
+
+            os.replace(os.path.join(self.path, 'depth.tmp'), os.path.join(self.path, 'depth'))
+        except OSError:
+            self.logger.exception('Error: Could not write the depth of relay outbox %s.', self.path)
+
+        # alert when the outbox backs up and again when it has been drained
+        if self.reported_depth < self.alert_depth <= depth:
+            self.general_utils.send_slack_msg(f'Error: Relay outbox {self.path} has {depth} message(s) waiting.', 'slack_issues_channel')
+        elif depth == 0 and self.reported_depth >= self.alert_depth:
+            self.general_utils.send_slack_msg(f'Relay outbox {self.path} has been drained.', 'slack_status_channel')
+
+        self.reported_depth = depth
+
+    def drain_segments(self):
+        """
+        replays the segment files in order, removing each one once all its messages have been confirmed
+
+        :return:
+        """
+        while not self.stopped.is_set():
+            with self.lock:
+                # get the oldest segment
+                segments: list = self.get_segments()
+
+                # are we done
+                if not segments:
+                    return
+
+                # new messages go to a new segment while this one is replayed
+                if self.segment_name == segments[0]:
+                    self.close_segment()
+
+            # get where the last replay of this segment left off
+            offset: int = self.read_offset(segments[0])
+
+            # the messages in flight. each item is (the offset after the message, the future of the relay)
+            inflight: deque = deque()
+
+            try:
+                # replay the messages in the segment, waiting for the oldest confirm when too many are in flight
+                for next_offset, queue_name, body in self.read_records(segments[0], offset):
+                    inflight.append((next_offset, self.publisher.submit(queue_name, body)))
+
+                    if len(inflight) >= self.max_inflight:
+                        offset = self.wait_confirm(inflight)
+
+                # wait for the rest of the confirms
+                while inflight:
+                    offset = self.wait_confirm(inflight)
+            finally:
+                # save the progress through the segment
+                with open(os.path.join(self.path, segments[0] + '.pos'), 'w', encoding='utf-8') as pos_file:
+                    pos_file.write(str(offset))
+
+            # the segment is done
+            os.remove(os.path.join(self.path, segments[0]))
+            os.remove(os.path.join(self.path, segments[0] + '.pos'))
+
+    def wait_confirm(self, inflight: deque) -> int:
+        """
+        waits for the oldest message in flight to be confirmed. raises an exception if it failed.
+
+        :param inflight:
+        :return: the offset after the confirmed message
+        """
+        # get the oldest message
+        next_offset, future = inflight.popleft()
+
+        # wait for its confirm
+        future.result()
+
+        # the message has been relayed
+        with self.lock:
+            self.depth -= 1
+
+        # return where the segment is now confirmed up to
+        return next_offset
+
+    def get_segments(self) -> list:
+        """
+        gets the segment file names in order
+
+        :return:
+        """
+        return sorted(file_name for file_name in os.listdir(self.path) if file_name.endswith('.seg'))
+
+    def read_offset(self, segment: str) -> int:
+        """
+        gets where the last replay of a segment left off
+
+        :param segment:
+        :return:
+        """
+        # get the progress file name
+        pos_file_name: str = os.path.join(self.path, segment + '.pos')
+
+        # if there is no progress file the segment has not been started
+        if not os.path.exists(pos_file_name):
+            return 0
+
+        with open(pos_file_name, 'r', encoding='utf-8') as pos_file:
+            return int(pos_file.read() or 0)
+
+    def read_records(self, segment: str, offset: int):
+        """
+        reads the messages in a segment file starting at an offset. a partly written message at the end is ignored.
+
+        :param segment:
+        :param offset:
+        :return: the offset after the message, the queue name and the body of each message
+        """
+        with open(os.path.join(self.path, segment), 'rb') as segment_file:
+            # get the messages from the offset on
+            segment_file.seek(offset)
+            data: bytes = segment_file.read()
+
+        # the position in the data
+        pos: int = 0
+
+        # while there is a complete message header
+        while pos + RECORD_HEADER.size <= len(data):
+            # get the message details
+            name_len, body_len = RECORD_HEADER.unpack_from(data, pos)
+            end: int = pos + RECORD_HEADER.size + name_len + body_len
+
+            # stop at a partly written message
+            if end > len(data):
+                break
+
+            yield offset + end, data[pos + RECORD_HEADER.size:pos + RECORD_HEADER.size + name_len].decode(), data[end - body_len:end]
+
+            pos = end
+
+    def stop(self):
+        """
+        stops the drainer and closes the segment file
+
+        :return:
+        """
+        # stop the drainer
+        self.stopped.set()
+        self.thread.join(5)
+
+        with self.lock:
+            # close the segment file
+            self.close_segment()
+
+            # give up ownership of the outbox directory
+            os.close(self.lock_fd)
+
+    def close_segment(self):
+        """
+        closes the segment being appended to. the lock must be held.
+
+        :return:
+        """
+        if self.segment_fd is not None:
+            os.close(self.segment_fd)
+
+        self.segment_name = None
+        self.segment_fd = None
@@ -0,0 +1,194 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Relay Publisher - a long-lived publisher used to relay messages to another queue host.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import threading
+
+import pika
+from src.common.logger import LoggingUtil
+
+
+class RelayPublisher:
+    """
+    Keeps a connection and channel to a relay queue host open across messages.
+
+    The connection is (re)created lazily on the first publish after a failure and the queue declarations are cached
+    per connection. Use get_publisher() to get the one publisher per relay host that is shared by everything in the process.
+    """
+
+    # the publishers for each relay host, shared across the process
+    publishers: dict = {}
+
+    # protects the creation of publishers
+    publishers_lock: threading.Lock = threading.Lock()
+
+    def __init__(self, host: str, user: str, password: str, _logger=None):
+        """
+        init the relay publisher object. no connection is made until the first publish.
+
+        :param host:
+        :param user:
+        :param password:
+        :param _logger:
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.Msg-Handler.RelayPublisher", level=log_level, line_format='medium',
+                                                   log_file_path=log_path)
+
+        # create the connection parameters
+        self.host: str = host
+        self.parameters: pika.ConnectionParameters = pika.ConnectionParameters(host, 5672, '/', pika.PlainCredentials(user, password),
+                                                                               socket_timeout=2)
+
+        # the connection, channel and the queues declared on them
+        self.connection = None
+        self.channel = None
+        self.declared_queues: set = set()
+
+        # a blocking connection can only be used by one thread at a time
+        self.lock: threading.Lock = threading.Lock()
+
+        # the outbox that spools the messages this publisher cannot relay, if there is one
+        self.outbox = None
+
+    @classmethod
+    def get_publisher(cls, host: str, user: str, password: str, _logger=None):
+        """
+        gets the shared publisher for the relay host, creating it if needed
+
+        :param host:
+        :param user:
+        :param password:
+        :param _logger:
+        :return:
+        """
+        with cls.publishers_lock:
+            # create the publisher if this is the first use of the host/user
+            if (cls, host, user) not in cls.publishers:
+                cls.publishers[(cls, host, user)] = cls(host, user, password, _logger=_logger)
+
+            # return the publisher
+            return cls.publishers[(cls, host, user)]
+
+    @classmethod
+    def stop_publishers(cls):
+        """
+        stops all the shared publishers
+
+        :return:
+        """
+        with cls.publishers_lock:
+            # stop each publisher
+            for publisher in cls.publishers.values():
+                publisher.stop()
+
+            # they will be recreated if needed
+            cls.publishers.clear()
+
+    def publish(self, queue_name: str, body: bytes, properties: pika.BasicProperties = None, arguments: dict = None):
+        """
+        publishes a message to the queue on the relay host. raises an exception on failure.
+
+        :param queue_name:
+        :param body:
+        :param properties: optional message properties
+        :param arguments: optional arguments used when the queue is declared
+        :return:
+        """
+        with self.lock:
+            # was there already a connection before this call
+            reused: bool = self.connection is not None and self.connection.is_open
+
+            try:
+                # publish the message
+                self.send(queue_name, body, properties, arguments)
+            except Exception:
+                # the connection is no good anymore
+                self.reset()
+
+                # a failed reused connection has probably just gone stale, try once more on a new one
+                if not reused:
+                    raise
+
+                self.logger.warning('Relay connection to %s went stale, reconnecting.', self.host)
+
+                # publish the message on a new connection
+                self.send(queue_name, body, properties, arguments)
+
+    def send(self, queue_name: str, body: bytes, properties: pika.BasicProperties, arguments: dict):
+        """
+        publishes the message on the current connection, creating it if needed
+
+        :param queue_name:
+        :param body:
+        :param properties:
+        :param arguments:
+        :return:
+        """
+        # create the connection and channel if needed
+        if self.connection is None or not self.connection.is_open:
+            # get a connection to the relay host
+            self.connection = pika.BlockingConnection(self.parameters)
+
+            # get a channel to the consumer
+            self.channel = self.connection.channel()
+
+            # queue declarations do not survive a new connection
+            self.declared_queues = set()
+
+            self.logger.info('Relay connection established to %s:5672.', self.host)
+        else:
+            # service the heartbeats and any other I/O that arrived since the last publish
+            self.connection.process_data_events(time_limit=0)
+
+        # create the queue if it has not been declared on this connection
+        if queue_name not in self.declared_queues:
+            self.channel.queue_declare(queue=queue_name, arguments=arguments)
+            self.declared_queues.add(queue_name)
+
+        # push the message to the queue
+        self.channel.basic_publish(exchange='', routing_key=queue_name, body=body, properties=properties)
+
+    def stop(self):
+        """
+        closes the connection to the relay host
+
+        :return:
+        """
+        with self.lock:
+            self.reset()
+
+    def reset(self):
+        """
+        closes the connection so that the next publish reconnects
+
+        :return:
+        """
+        try:
+            # close the connection if it is still open
+            if self.connection is not None and self.connection.is_open:
+                self.connection.close()
+        except Exception:
+            self.logger.debug('Error closing the relay connection to %s.', self.host)
+
+        # clear the connection details
+        self.connection = None
+        self.channel = None
+        self.declared_queues = set()
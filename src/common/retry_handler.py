@@ -0,0 +1,237 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Retry Handler - delayed retries and dead-lettering of queue messages that fail to be handled.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import os
+import functools
+
+import pika
+from src.common.logger import LoggingUtil
+from src.common.relay_publisher import RelayPublisher
+
+# the message header that has the number of times a message has been retried
+ATTEMPTS_HEADER: str = 'x-retry-attempts'
+
+
+class RetryHandler:
+    """
+    Sends messages whose callback failed to a delay queue so they are handled again later.
+
+    Each retry delay has its own delay queue ("<queue>.retry.<delay ms>") with a message TTL of that delay. The delay
+    doubles with each attempt. When the TTL expires the broker dead-letters the message back to the original queue.
+    The delay is part of the queue name so a queue is always declared with the same arguments, changing
+    RETRY_BASE_DELAY_MS or RETRY_MAX_ATTEMPTS just uses other delay queues. The number of attempts is carried in the
+    x-retry-attempts header and after RETRY_MAX_ATTEMPTS attempts the message is sent to the dead-letter queue
+    ("<queue>.dead") where it can be inspected and replayed.
+    """
+
+    def __init__(self, _logger=None):
+        """
+        init the retry handler object
+
+        :param _logger:
+        """
+        # if a reference to a logger passed in use it
+        if _logger is not None:
+            # get a handle to a logger
+            self.logger = _logger
+        else:
+            # get the log level and directory from the environment.
+            log_level, log_path = LoggingUtil.prep_for_logging()
+
+            # create a logger
+            self.logger = LoggingUtil.init_logging("APSVIZ.Msg-Handler.RetryHandler", level=log_level, line_format='medium', log_file_path=log_path)
+
+        # get the flag that turns on retries
+        self.enabled: bool = os.environ.get('RETRY_ENABLED', 'False').lower() in ('true', '1', 't')
+
+        # get the number of retries before a message is dead-lettered and the delay of the first retry
+        self.max_attempts: int = int(os.environ.get('RETRY_MAX_ATTEMPTS', '5'))
+        self.base_delay_ms: int = int(os.environ.get('RETRY_BASE_DELAY_MS', '10000'))
+
+    @staticmethod
+    def get_retry_queue_name(queue_name: str, delay_ms: int) -> str:
+        """
+        gets the name of the delay queue for a retry delay
+
+        :param queue_name:
+        :param delay_ms:
+        :return:
+        """
+        return f'{queue_name}.retry.{delay_ms}'
+
+    @staticmethod
+    def get_dead_letter_queue_name(queue_name: str) -> str:
+        """
+        gets the name of the dead-letter queue
+
+        :param queue_name:
+        :return:
+        """
+        return f'{queue_name}.dead'
+
+    @staticmethod
+    def get_publisher() -> RelayPublisher:
+        """
+        gets the shared publisher to the queue host
+
+        :return:
+        """
+        return RelayPublisher.get_publisher(os.environ.get("RABBITMQ_HOST"), os.environ.get("RABBITMQ_USER"), os.environ.get("RABBITMQ_PW"))
+
+    def wrap(self, queue_name: str, callback):
+        """
+        creates a queue callback that retries the message when the callback fails
+
+        :param queue_name:
+        :param callback:
+        :return:
+        """
+        def on_message(channel, method, properties, body):
+            # run the callback, a False return is a failure. the callbacks only fail a message when its DB work was not
+            # committed, a failed relay is left to the relay outbox so the DB work is never done twice. a message that can
+            # never be handled (it cannot be loaded or its site is not supported) returns None, it is alerted once and acked
+            if callback(channel, method, properties, body) is False:
+                self.retry(queue_name, properties, body)
+
+        # return the queue callback
+        return on_message
+
+    def get_failure_callback(self, queue_name: str):
+        """
+        gets a function that retries a failed message of the queue, if retries are enabled
+
+        :param queue_name:
+        :return:
+        """
+        return functools.partial(self.retry, queue_name) if self.enabled else None
+
+    def retry(self, queue_name: str, properties, body: bytes):
+        """
+        sends a failed message to the next delay queue or to the dead-letter queue if it is out of attempts
+
+        :param queue_name:
+        :param properties:
+        :param body:
+        :return:
+        """
+        # get the message headers
+        headers: dict = dict(properties.headers or {}) if properties is not None else {}
+
+        # this is one more attempt
+        attempt: int = int(headers.get(ATTEMPTS_HEADER, 0)) + 1
+        headers[ATTEMPTS_HEADER] = attempt
+
+        # create the new message properties
+        new_properties = pika.BasicProperties(content_type=properties.content_type if properties is not None else None, headers=headers)
+
+        try:
+            # are there attempts left
+            if attempt <= self.max_attempts:
+                # get the delay of this attempt
+                delay_ms: int = self.base_delay_ms * 2 ** (attempt - 1)
+
+                # messages expire from the delay queue back into the original queue
+                arguments: dict = {'x-message-ttl': delay_ms, 'x-dead-letter-exchange': '', 'x-dead-letter-routing-key': queue_name}
+
+                # send the message to the delay queue
+                self.get_publisher().publish(self.get_retry_queue_name(queue_name, delay_ms), body, new_properties, arguments)
+
+                self.logger.warning('%s message failed, retry %s of %s in %s ms.', queue_name, attempt, self.max_attempts, delay_ms)
+            else:
+                # send the message to the dead-letter queue
+                self.get_publisher().publish(self.get_dead_letter_queue_name(queue_name), body, new_properties)
+
+                self.logger.error('Error: %s message failed after %s retries, sent to the dead-letter queue.', queue_name, self.max_attempts)
+        except Exception:
+            self.logger.exception('Error: Exception retrying a %s message. The message is lost.', queue_name)
+
+    def inspect_dead_letters(self, connect_params: pika.ConnectionParameters, queue_name: str, count: int) -> list:
+        """
+        gets the first messages in the dead-letter queue without removing them
+
+        :param connect_params: the queue host connection parameters
+        :param queue_name:
+        :param count:
+        :return: the headers and body of each message
+        """
+        # init the return
+        msgs: list = []
+
+        # get a connection to the queue host
+        with pika.BlockingConnection(connect_params) as connection:
+            # get a channel to the dead-letter queue
+            channel = connection.channel()
+
+            # get the messages without acknowledging them. they are put back when the connection closes
+            for _ in range(count):
+                method, properties, body = channel.basic_get(self.get_dead_letter_queue_name(queue_name), auto_ack=False)
+
+                # is the queue empty
+                if method is None:
+                    break
+
+                msgs.append((properties.headers, body))
+
+        # return the messages
+        return msgs
+
+    def replay_dead_letters(self, connect_params: pika.ConnectionParameters, queue_name: str, count: int) -> int:
+        """
+        moves messages from the dead-letter queue back to the original queue with their attempts reset. a message is
+        only removed from the dead-letter queue after the queue host confirms it is on the original queue.
+
+        :param connect_params: the queue host connection parameters
+        :param queue_name:
+        :param count:
+        :return: the number of messages replayed
+        """
+        # init the count of replayed messages
+        replayed: int = 0
+
+        # get a connection to the queue host
+        with pika.BlockingConnection(connect_params) as connection:
+            # get a channel to the dead-letter queue
+            channel = connection.channel()
+
+            # have the queue host confirm each message published
+            channel.confirm_delivery()
+
+            # for each message to replay
+            while replayed < count:
+                method, properties, body = channel.basic_get(self.get_dead_letter_queue_name(queue_name), auto_ack=False)
+
+                # is the queue empty
+                if method is None:
+                    break
+
+                # start the attempts over
+                headers: dict = {key: value for key, value in (properties.headers or {}).items() if key != ATTEMPTS_HEADER}
+
+                try:
+                    # send the message back to the original queue. this waits for the confirm
+                    channel.basic_publish(exchange='', routing_key=queue_name, body=body,
+                                          properties=pika.BasicProperties(content_type=properties.content_type, headers=headers), mandatory=True)
+                except (pika.exceptions.NackError, pika.exceptions.UnroutableError):
+                    # the message stays in the dead-letter queue, it is put back when the connection closes
+                    self.logger.error('Error: %s message was not accepted by the queue host. Stopping the replay.', queue_name)
+                    break
+
+                # the message is on the original queue, remove it from the dead-letter queue
+                channel.basic_ack(method.delivery_tag)
+
+                replayed += 1
+
+        self.logger.info('%s message(s) replayed from %s.', replayed, self.get_dead_letter_queue_name(queue_name))
+
+        # return the number replayed
+        return replayed
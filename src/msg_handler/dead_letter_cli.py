@@ -0,0 +1,68 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Command line tool to inspect and replay the messages in a queue's dead-letter queue.
+
+    usage:
+        python src/msg_handler/dead_letter_cli.py -q <queue name> inspect [-c <count>]
+        python src/msg_handler/dead_letter_cli.py -q <queue name> replay [-c <count>]
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import sys
+import argparse
+
+from src.common.queue_utils import QueueUtils
+from src.common.retry_handler import RetryHandler
+
+
+def run(args) -> int:
+    """
+    inspects or replays the dead letters of a queue
+
+    :param args:
+    :return: the exit code
+    """
+    # get a reference to the retry handler
+    retry_handler = RetryHandler()
+
+    # are we looking at the messages
+    if args.command == 'inspect':
+        # get the messages
+        msgs: list = retry_handler.inspect_dead_letters(QueueUtils.get_connect_params(), args.queue, args.count)
+
+        # something for the user
+        for headers, body in msgs:
+            print(f'headers: {headers}')
+            print(body.decode(errors='replace'))
+
+        print(f'{len(msgs)} message(s) shown from {RetryHandler.get_dead_letter_queue_name(args.queue)}.')
+    else:
+        # put the messages back on the original queue
+        replayed: int = retry_handler.replay_dead_letters(QueueUtils.get_connect_params(), args.queue, args.count)
+
+        # something for the user
+        print(f'{replayed} message(s) replayed to {args.queue}.')
+
+    # return pass
+    return 0
+
+
+if __name__ == '__main__':
+    # create a command line parser
+    parser = argparse.ArgumentParser(description='Inspect or replay dead-lettered queue messages.',
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    # assign the expected input args
+    parser.add_argument('-q', '--queue', required=True, help='the name of the queue whose dead letters are handled.')
+    parser.add_argument('-c', '--count', type=int, default=100, help='the maximum number of messages to inspect or replay.')
+    parser.add_argument('command', choices=['inspect', 'replay'], help='inspect: show the dead letters, replay: send them back to the queue.')
+
+    # exit with pass/fail
+    sys.exit(run(parser.parse_args()))
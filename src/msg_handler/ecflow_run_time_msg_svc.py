@@ -48,8 +48,10 @@ def run():
             # get a reference to the common queue utilities
             queue_utils = QueueUtils(_queue_name=queue_name, _logger=logger)
 
-            # start consuming the messages
-            queue_utils.start_consuming(queue_callback.ecflow_run_time_status_callback)
+            # start consuming the messages. the shard key keeps the messages of each run in order when a worker pool is used
+            # and the batch callback is used when message batching is enabled
+            queue_utils.start_consuming(queue_callback.ecflow_run_time_status_callback, QueueCallbacks.get_run_time_shard_key,
+                                        queue_callback.ecflow_run_time_status_batch_callback)
         else:
             logger.error('FAILURE - ECFLOW runtime status queue name not specified. Queue handling not started.')
 
@@ -49,7 +49,7 @@ def run():
             queue_utils = QueueUtils(_queue_name=queue_name, _logger=logger)
 
             # start consuming the messages
-            queue_utils.start_consuming(queue_callback.hecras_run_props_callback)
+            queue_utils.start_consuming(queue_callback.hecras_run_props_callback, QueueCallbacks.get_run_props_shard_key)
         else:
             logger.error('FAILURE - HECRAS run property queue name not specified. Queue handling not started.')
 
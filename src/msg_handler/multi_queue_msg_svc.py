@@ -0,0 +1,105 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Entrypoint for the multi-queue msg svc listener/handler.
+
+    This handles the ecflow run properties, ecflow run time and HEC/RAS queues in a single process
+    over one queue host connection (one channel per queue) and one shared DB/lookup data object.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import os
+
+from src.common.logger import LoggingUtil
+from src.common.pg_impl import PGImplementation
+from src.common.queue_callbacks import QueueCallbacks
+from src.common.queue_utils import QueueUtils
+
+# the queue name environment parameters and the names of the callbacks that handle them
+queue_handlers: dict = {'ECFLOW_RP_QUEUE_NAME': 'ecflow_run_props_callback', 'ECFLOW_RT_QUEUE_NAME': 'ecflow_run_time_status_callback',
+                        'HECRAS_RP_QUEUE_NAME': 'hecras_run_props_callback'}
+
+# the queue name environment parameters of the queues that must be processed in order per run and the functions that get the run key
+queue_shard_keys: dict = {'ECFLOW_RT_QUEUE_NAME': QueueCallbacks.get_run_time_shard_key,
+                          'ECFLOW_RP_QUEUE_NAME': QueueCallbacks.get_run_props_shard_key,
+                          'HECRAS_RP_QUEUE_NAME': QueueCallbacks.get_run_props_shard_key}
+
+# the queue name environment parameters of the queues that support message batching and the names of the batch callbacks
+queue_batch_handlers: dict = {'ECFLOW_RT_QUEUE_NAME': 'ecflow_run_time_status_batch_callback'}
+
+
+def run():
+    """
+    Fires up the multi-queue message listener/handler
+
+    :return:
+    """
+    # get the log level and directory from the environment.
+    log_level, log_path = LoggingUtil.prep_for_logging()
+
+    # create a logger
+    logger = LoggingUtil.init_logging("APSVIZ.Msg-Handler.multi_queue_msg_svc", level=log_level, line_format='medium', log_file_path=log_path)
+
+    # set the app version
+    app_version = os.getenv('APP_VERSION', 'Version number not set')
+
+    logger.info("Initializing multi_queue_msg_svc handler, version: %s.", app_version)
+
+    try:
+        # init the queue name: callback, queue name: shard key and queue name: batch callback storage
+        queue_callbacks: dict = {}
+        shard_keys: dict = {}
+        batch_callbacks: dict = {}
+
+        # init the shared DB object
+        db_info = None
+
+        # for each queue this handler supports
+        for env_name, callback_name in queue_handlers.items():
+            # get the queue name
+            queue_name: str = os.getenv(env_name, None)
+
+            # did we get a queue name
+            if queue_name is not None:
+                # create the DB object on the first queue. it is shared by all the queue callbacks
+                if db_info is None:
+                    db_info = PGImplementation(('apsviz',), _logger=logger)
+
+                # get a reference to the common callback handler
+                queue_callback = QueueCallbacks(_queue_name=queue_name, _logger=logger, _db_info=db_info)
+
+                # save the callback for this queue
+                queue_callbacks[queue_name] = getattr(queue_callback, callback_name)
+
+                # save the shard key function if this queue has one
+                if env_name in queue_shard_keys:
+                    shard_keys[queue_name] = queue_shard_keys[env_name]
+
+                # save the batch callback if this queue has one
+                if env_name in queue_batch_handlers:
+                    batch_callbacks[queue_name] = getattr(queue_callback, queue_batch_handlers[env_name])
+            else:
+                logger.warning('%s not specified. Queue will not be handled.', env_name)
+
+        # did we get any queues
+        if queue_callbacks:
+            # get a reference to the common queue utilities
+            queue_utils = QueueUtils(_queue_name='', _logger=logger)
+
+            # start consuming the messages
+            queue_utils.consume_queues(queue_callbacks, shard_keys, batch_callbacks)
+        else:
+            logger.error('FAILURE - No queue names specified. Queue handling not started.')
+
+    except Exception:
+        logger.exception("FAILURE - Problems initiating multi_queue_msg_svc.")
+
+
+if __name__ == "__main__":
+    run()
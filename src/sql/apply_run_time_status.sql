@@ -0,0 +1,73 @@
+-- SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+-- SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+-- SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+--
+-- SPDX-License-Identifier: GPL-3.0-or-later
+-- SPDX-License-Identifier: LicenseRef-RENCI
+-- SPDX-License-Identifier: MIT
+
+-- Applies an ECFlow run time status message in a single call. this creates/updates the instance and
+-- event group and inserts the event, the same as QueueCallbacks.apply_run_time_status() does one
+-- statement at a time.
+--
+-- the lookup IDs, percent complete and defaults are resolved by the message handler. the run is locked
+-- for the duration of the transaction so concurrent handlers cannot create duplicate instances.
+--
+-- returns an array of the instance id and the event group id.
+--
+-- install with: psql -d apsviz -f src/sql/apply_run_time_status.sql
+-- enable with: RUN_TIME_STATUS_FUNCTION_ENABLED=True
+
+CREATE OR REPLACE FUNCTION public.apply_run_time_status(_site_id integer, _event_type_id integer, _state_id integer, _event_name text,
+    _state_name text, _process_id integer, _instance_name text, _date_time timestamp, _advisory_id text, _storm_name text,
+    _storm_number text, _process text, _run_params text, _pct_complete integer, _sub_pct_complete integer, _raw_data text)
+    RETURNS integer[]
+    LANGUAGE plpgsql
+AS $$
+DECLARE
+    _instance_id integer;
+    _event_group_id integer;
+BEGIN
+    -- only one handler at a time can apply a status for this run
+    PERFORM pg_advisory_xact_lock(hashtextextended(_site_id || '|' || _process_id || '|' || _instance_name, 0));
+
+    -- check to see if there are any instances for this run yet
+    SELECT id INTO _instance_id FROM "instance"
+        WHERE site_id = _site_id AND process_id = _process_id AND instance_name = _instance_name AND inst_state_type_id != 9
+        ORDER BY id DESC LIMIT 1;
+
+    -- if this is a STRT event, create a new instance
+    IF _instance_id IS NULL OR (_event_name = 'STRT' AND _state_name = 'RUNN') THEN
+        INSERT INTO "instance" (site_id, process_id, start_ts, end_ts, run_params, instance_name, inst_state_type_id)
+            VALUES (_site_id, _process_id, _date_time, _date_time, _run_params, _instance_name, _state_id) RETURNING id INTO _instance_id;
+    ELSE
+        -- just update the instance
+        UPDATE "instance" SET inst_state_type_id = _state_id, end_ts = _date_time, run_params = _run_params
+            WHERE site_id = _site_id AND id = _instance_id;
+    END IF;
+
+    -- check to see if there are any event groups for this instance and advisory yet
+    SELECT id INTO _event_group_id FROM "event_group" WHERE instance_id = _instance_id AND advisory_id = _advisory_id ORDER BY id DESC LIMIT 1;
+
+    -- if this is the start of a group of events, create a new event group
+    IF _event_group_id IS NULL OR _event_name = 'RSTR' THEN
+        INSERT INTO "event_group" (state_type_id, instance_id, event_group_ts, storm_name, storm_number, advisory_id, final_product)
+            VALUES (_state_id, _instance_id, _date_time, _storm_name, _storm_number, _advisory_id, 'product') RETURNING id INTO _event_group_id;
+    ELSIF _event_name IN ('FEND', 'REND') THEN
+        -- the event group is done, set the status to EXIT
+        UPDATE "event_group" SET state_type_id = 9, storm_name = _storm_name, advisory_id = _advisory_id WHERE id = _event_group_id;
+    END IF;
+
+    -- insert the event. the raw data column gets its default when there is no message
+    IF _raw_data IS NULL THEN
+        INSERT INTO "event" (site_id, event_group_id, event_type_id, event_ts, advisory_id, pct_complete, sub_pct_complete, process)
+            VALUES (_site_id, _event_group_id, _event_type_id, _date_time, _advisory_id, _pct_complete, _sub_pct_complete, _process);
+    ELSE
+        INSERT INTO "event" (site_id, event_group_id, event_type_id, event_ts, advisory_id, pct_complete, sub_pct_complete, process, raw_data)
+            VALUES (_site_id, _event_group_id, _event_type_id, _date_time, _advisory_id, _pct_complete, _sub_pct_complete, _process, _raw_data);
+    END IF;
+
+    -- return the ids
+    RETURN ARRAY[_instance_id, _event_group_id];
+END;
+$$;
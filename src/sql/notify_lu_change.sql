@@ -0,0 +1,38 @@
+-- SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+-- SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+-- SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+--
+-- SPDX-License-Identifier: GPL-3.0-or-later
+-- SPDX-License-Identifier: LicenseRef-RENCI
+-- SPDX-License-Identifier: MIT
+
+-- Notifies the message handlers when a lookup table changes so they can reload their copy of the lookup
+-- data (see src/common/lu_refresher.py). the channel name must match LU_NOTIFY_CHANNEL.
+--
+-- install with: psql -d apsviz -f src/sql/notify_lu_change.sql
+-- enable with: LU_REFRESH_ENABLED=True
+
+CREATE OR REPLACE FUNCTION public.notify_lu_change()
+    RETURNS trigger
+    LANGUAGE plpgsql
+AS $$
+BEGIN
+    -- the payload is the name of the table that changed
+    PERFORM pg_notify('apsviz_lu_change', TG_TABLE_NAME);
+
+    RETURN NULL;
+END;
+$$;
+
+-- fire once per statement that changes each lookup table
+CREATE OR REPLACE TRIGGER site_lu_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.site_lu
+    FOR EACH STATEMENT EXECUTE FUNCTION public.notify_lu_change();
+
+CREATE OR REPLACE TRIGGER event_type_lu_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.event_type_lu
+    FOR EACH STATEMENT EXECUTE FUNCTION public.notify_lu_change();
+
+CREATE OR REPLACE TRIGGER state_type_lu_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.state_type_lu
+    FOR EACH STATEMENT EXECUTE FUNCTION public.notify_lu_change();
+
+CREATE OR REPLACE TRIGGER instance_state_type_lu_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.instance_state_type_lu
+    FOR EACH STATEMENT EXECUTE FUNCTION public.notify_lu_change();
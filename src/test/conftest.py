@@ -0,0 +1,170 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test fixtures - fake DB connections for the tests that do not need a real DB.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import logging
+
+import pytest
+import psycopg2
+
+from src.common.pg_utils_multi import PGUtilsMultiConnect
+from src.common.pg_impl import PGImplementation
+
+
+class FakeCursor:
+    """
+    A DB cursor that returns a canned result or the number of statements run on its connection
+    """
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount: int = -1
+        self.sql_stmt: str = ''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql_stmt: str, params=None):
+        """
+        runs a statement
+        """
+        self.conn.executed.append((sql_stmt, params))
+
+        # the connection was lost
+        if self.conn.closed or sql_stmt == 'lose':
+            self.conn.closed = 2
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+
+        self.sql_stmt = sql_stmt
+        self.conn.statements += 1
+
+    def fetchone(self):
+        """
+        gets the canned result of the statement, the statement count if there is none
+        """
+        for prefix, result in self.conn.server.results.items():
+            if self.sql_stmt.startswith(prefix):
+                return (result,)
+
+        return (self.conn.statements,)
+
+    def copy_expert(self, sql_stmt: str, data):
+        """
+        loads rows
+        """
+        self.conn.executed.append((sql_stmt, data.read()))
+        self.rowcount = self.conn.executed[-1][1].count('\n')
+
+
+class FakeConnection:
+    """
+    A DB connection that records the statements run on it and if it was closed
+    """
+    def __init__(self, server):
+        self.server = server
+        self.closed: int = 0
+        self.autocommit: bool = True
+        self.executed: list = []
+        self.statements: int = 0
+
+    def close(self):
+        """
+        closes the connection
+        """
+        self.closed = 1
+
+    def cursor(self):
+        """
+        gets a cursor that fails if the connection was lost
+        """
+        return FakeCursor(self)
+
+    def commit(self):
+        """
+        commits the transaction
+        """
+        self.executed.append(('COMMIT', None))
+
+    def rollback(self):
+        """
+        rolls back the transaction
+        """
+        self.executed.append(('ROLLBACK', None))
+
+
+class FakeServer:
+    """
+    Opens fake DB connections and keeps the results the statements return
+    """
+    # the lookup data the DB returns
+    LU_DATA: dict = {'site': {'RENCI': 1, 'TACC': 2}, 'event_type': {'RSTR': 3, 'STRT': 7, 'FEND': 11}, 'state_type': {'RUNN': 2, 'EXIT': 9},
+                     'instance_state_type': {'RUNN': 2, 'EXIT': 9}}
+
+    def __init__(self):
+        # the connections that were opened
+        self.opened: list = []
+
+        # statement prefix: the value returned
+        self.results: dict = {'SELECT json_build_object': dict(self.LU_DATA)}
+
+        # set to an exception to make the connections fail
+        self.error = None
+
+    def connect(self) -> FakeConnection:
+        """
+        opens a connection
+
+        :return:
+        """
+        if self.error is not None:
+            raise self.error
+
+        self.opened.append(FakeConnection(self))
+
+        return self.opened[-1]
+
+
+@pytest.fixture(name='fake_server')
+def fixture_fake_server(monkeypatch) -> FakeServer:
+    """
+    makes the DB objects created in a test use fake connections
+
+    :param monkeypatch:
+    :return:
+    """
+    server = FakeServer()
+
+    # the connection settings are read but never used
+    for db_name in ('APSVIZ', 'TEST'):
+        for setting, value in {'USERNAME': 'user', 'PASSWORD': 'pass', 'DATABASE': 'db', 'HOST': 'localhost', 'PORT': '1'}.items():
+            monkeypatch.setenv(f'{db_name}_DB_{setting}', value)
+
+    # open the fake connections instead
+    monkeypatch.setattr(PGUtilsMultiConnect, 'get_db_connection', lambda _self, _db_name, _conn_str: server.connect())
+
+    return server
+
+
+@pytest.fixture(name='db_info')
+def fixture_db_info(fake_server) -> PGImplementation:
+    """
+    creates a DB object with the real constructor on fake connections
+
+    :param fake_server:
+    :return:
+    """
+    # the connections are opened on the fake server
+    assert not fake_server.opened
+
+    return PGImplementation(('apsviz',), _logger=logging.getLogger())
@@ -0,0 +1,49 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    micro-benchmark of the JSON codec against the standard library on the sample messages.
+
+    run from the src/test/data directory: python ../json_codec_benchmark.py [-n <iterations>]
+
+    Author: Phil Owen, RENCI.org
+"""
+import os
+import json
+import glob
+import timeit
+import argparse
+
+from src.common import json_codec
+
+
+if __name__ == '__main__':
+    # create a command line parser
+    parser = argparse.ArgumentParser(description='help', formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    # assign the expected input args
+    parser.add_argument('-n', '--number', type=int, default=20000, help='the number of times each message is decoded/encoded.')
+
+    # parse the command line
+    args = parser.parse_args()
+
+    print(f'codec: {json_codec.CODEC_NAME}, iterations: {args.number}')
+    print(f'{"message":40} {"size":>6} {"json decode":>12} {"codec decode":>13} {"json relay":>11} {"codec relay":>12}')
+
+    # for each sample message
+    for file_name in sorted(glob.glob('*.json')):
+        # get the raw message
+        with open(file_name, 'rb') as fh:
+            body: bytes = fh.read()
+
+        # get the per message time in microseconds of a decode and of a relay (decode, add context, encode)
+        times: list = [timeit.timeit(stmt, number=args.number, globals={'json': json, 'json_codec': json_codec, 'body': body}) / args.number * 1000000
+                       for stmt in ['json.loads(body)', 'json_codec.loads(body)', "json.dumps(json.loads(body) | {'relay_context': 'test'}).encode()",
+                                    "json_codec.dumps(json_codec.loads(body) | {'relay_context': 'test'})"]]
+
+        print(f'{os.path.basename(file_name):40} {len(body):6} {times[0]:10.2f}us {times[1]:11.2f}us {times[2]:9.2f}us {times[3]:10.2f}us')
@@ -0,0 +1,186 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test Ack Batcher - Tests the grouping of queue message acknowledgements.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import threading
+from collections import namedtuple
+
+from src.common.ack_batcher import AckBatcher
+from src.common.msg_batcher import MsgBatcher
+
+# serializes the thread safe callbacks
+THREAD_LOCK = threading.Lock()
+
+
+class FakeTimer:
+    """
+    stands in for an event loop timer handle
+    """
+    def __init__(self, timers: dict, timer_id: int):
+        self.timers = timers
+        self.timer_id = timer_id
+
+    def cancel(self):
+        """
+        removes the timer callback
+
+        """
+        self.timers.pop(self.timer_id, None)
+
+
+class FakeLoop:
+    """
+    stands in for an event loop's timer handling
+    """
+    def __init__(self):
+        self.timers: dict = {}
+
+    def call_later(self, delay, callback):
+        """
+        saves the timer callback
+
+        """
+        timer_id = len(self.timers) + 1
+
+        self.timers.update({timer_id: (delay, callback)})
+
+        return FakeTimer(self.timers, timer_id)
+
+    @staticmethod
+    def call_soon_threadsafe(callback):
+        """
+        runs the callback. the ack batcher serializes the callbacks on the I/O thread, this does it with a lock
+
+        """
+        with THREAD_LOCK:
+            callback()
+
+
+class FakeConnection:
+    """
+    stands in for an asyncio pika connection
+    """
+    def __init__(self):
+        self.ioloop = FakeLoop()
+
+
+class FakeChannel:
+    """
+    stands in for a pika channel and records the acks
+    """
+    def __init__(self):
+        self.connection = FakeConnection()
+        self.acks: list = []
+        self.is_open = True
+
+    def basic_ack(self, delivery_tag, multiple):
+        """
+        records the ack
+
+        """
+        self.acks.append((delivery_tag, multiple))
+
+
+def test_ack_batch_size():
+    """
+    tests that acks are grouped into a multi-ack once the batch size is reached
+
+    :return:
+    """
+    channel = FakeChannel()
+
+    # create the batcher
+    ack_batcher = AckBatcher(3, 1000)
+
+    # track and complete some messages in order
+    for tag in range(1, 8):
+        ack_batcher.track(channel, tag)
+        ack_batcher.complete(tag)
+
+    # two full batches should have been acked
+    assert channel.acks == [(3, True), (6, True)]
+
+    # the last message is waiting on the timer
+    assert len(channel.connection.ioloop.timers) == 1
+
+    # fire the timer
+    _, callback = list(channel.connection.ioloop.timers.values())[0]
+    callback()
+
+    # the remaining message is now acked
+    assert channel.acks[-1] == (7, True)
+
+
+def test_ack_watermark():
+    """
+    tests that out of order completions are only acked up to the contiguous watermark
+
+    :return:
+    """
+    channel = FakeChannel()
+
+    # create the batcher
+    ack_batcher = AckBatcher(2, 1000)
+
+    # receive some messages
+    for tag in range(1, 5):
+        ack_batcher.track(channel, tag)
+
+    # complete the later messages first
+    ack_batcher.complete(3)
+    ack_batcher.complete(2)
+    ack_batcher.complete(4)
+
+    # nothing can be acked while the first message is outstanding
+    assert not channel.acks
+
+    # complete the first message
+    ack_batcher.complete(1)
+
+    # everything is now acked in one call
+    assert channel.acks == [(4, True)]
+
+
+def test_msg_batcher():
+    """
+    tests that messages are handed over in batches and acked after the batch is handled
+
+    :return:
+    """
+    channel = FakeChannel()
+    method_tpl = namedtuple('Method', ['delivery_tag'])
+
+    # storage for the batches handled
+    batches: list = []
+
+    # create the batchers
+    ack_batcher = AckBatcher(100, 1000)
+    msg_batcher = MsgBatcher(4, 1000)
+    on_message = msg_batcher.wrap(batches.append, ack_batcher)
+
+    # send some messages
+    for tag in range(1, 7):
+        on_message(channel, method_tpl(tag), None, str(tag).encode())
+
+    # one full batch was handled, the rest are waiting on the timer
+    assert batches == [[b'1', b'2', b'3', b'4']]
+    assert len(msg_batcher.msgs) == 2
+
+    # fire the batch timer
+    msg_batcher.on_timer()
+
+    assert batches[-1] == [b'5', b'6']
+
+    # everything gets acked together
+    ack_batcher.flush()
+
+    assert channel.acks == [(6, True)]
@@ -0,0 +1,255 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test Async Queue Consumer - Tests the asyncio consumer engine on a fake connection.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import time
+import logging
+import threading
+from collections import namedtuple
+
+from src.common import async_queue_consumer as consumer_module
+from src.common.queue_utils import QueueUtils
+from src.common.retry_handler import RetryHandler
+from src.common.consumer_supervisor import ConsumerSupervisor
+from src.common.async_queue_consumer import AsyncQueueConsumer
+
+
+class FakeAsyncChannel:
+    """
+    stands in for a pika asyncio channel and records the acks
+    """
+    def __init__(self, connection):
+        self.connection = connection
+        self.acks: list = []
+        self.on_message = None
+
+    @property
+    def is_open(self) -> bool:
+        """
+        the channel is open as long as its connection is
+        """
+        return not self.connection.is_closed
+
+    def add_on_close_callback(self, callback):
+        """
+        the channel is never closed on its own
+        """
+
+    def queue_declare(self, queue, callback):
+        """
+        declares the queue
+        """
+        self.connection.ioloop.call_soon(callback, queue)
+
+    def basic_qos(self, prefetch_count, callback):
+        """
+        sets the prefetch count
+        """
+        self.connection.ioloop.call_soon(callback, prefetch_count)
+
+    def basic_consume(self, _queue_name, on_message, auto_ack):
+        """
+        saves the message handler
+        """
+        assert not auto_ack
+
+        self.on_message = on_message
+
+    def basic_ack(self, delivery_tag, multiple):
+        """
+        records the ack
+        """
+        self.acks.append((delivery_tag, multiple))
+
+
+class FakeAsyncConnection:
+    """
+    stands in for a pika asyncio connection to the queue host
+    """
+    # the last connection created
+    last = None
+
+    def __init__(self, _params, on_open_callback, on_open_error_callback, on_close_callback, custom_ioloop):
+        self.ioloop = custom_ioloop
+        self.on_open_error_callback = on_open_error_callback
+        self.on_close_callback = on_close_callback
+        self.is_closing: bool = False
+        self.is_closed: bool = False
+        self.channels: list = []
+
+        FakeAsyncConnection.last = self
+
+        # open right away
+        self.ioloop.call_soon(on_open_callback, self)
+
+    def channel(self, on_open_callback):
+        """
+        opens a channel
+        """
+        self.channels.append(FakeAsyncChannel(self))
+        self.ioloop.call_soon(on_open_callback, self.channels[-1])
+
+    def close(self):
+        """
+        closes the connection
+        """
+        self.is_closed = True
+        self.ioloop.call_soon(self.on_close_callback, self, 'closed')
+
+    def close_threadsafe(self, delay: float = 0):
+        """
+        closes the connection from another thread after a delay
+        """
+        self.ioloop.call_soon_threadsafe(self.ioloop.call_later, delay, self.close)
+
+
+def run_consumer(monkeypatch, msgs: list, callback, shard_keys: dict = None) -> tuple:
+    """
+    consumes some messages on a fake connection until the callback closes it
+
+    :param monkeypatch:
+    :param msgs: the message bodies delivered once the consumer is up
+    :param callback: the queue callback
+    :param shard_keys:
+    :return: the channel and the consumer
+    """
+    # acknowledge the messages after they are processed, acks are sent right away
+    monkeypatch.setenv('MANUAL_ACK_ENABLED', 'True')
+    monkeypatch.setenv('ACK_BATCH_SIZE', '1')
+
+    # connect to the fake queue host
+    monkeypatch.setenv('RABBITMQ_HOST', 'localhost')
+    monkeypatch.setattr(consumer_module, 'AsyncioConnection', FakeAsyncConnection)
+
+    queue_utils = QueueUtils(_queue_name='test', _logger=logging.getLogger())
+
+    # the supervisor and retry handler are created by consume_queues(), the consumer is started directly here
+    queue_utils.supervisor = ConsumerSupervisor(_logger=logging.getLogger())
+    queue_utils.retry_handler = RetryHandler(_logger=logging.getLogger())
+
+    consumer = AsyncQueueConsumer(queue_utils, _logger=logging.getLogger())
+
+    method_tpl = namedtuple('Method', ['delivery_tag'])
+
+    # deliver the messages once the consumer is up
+    def deliver():
+        channel = FakeAsyncConnection.last.channels[0]
+
+        for delivery_tag, body in enumerate(msgs, 1):
+            channel.on_message(channel, method_tpl(delivery_tag), None, body)
+
+    monkeypatch.setattr(queue_utils.supervisor, 'on_connected', deliver)
+
+    # consume until the connection is closed
+    consumer.start_consuming({'test': callback}, shard_keys or {})
+
+    # return the channel and consumer
+    return FakeAsyncConnection.last.channels[0], consumer
+
+
+def test_async_ack_order(monkeypatch):
+    """
+    tests that the messages of a queue without a shard key are handled one at a time in order and acked in order
+
+    :param monkeypatch:
+    :return:
+    """
+    # more in flight is asked for but the queue has no shard key
+    monkeypatch.setenv('ASYNC_MAX_INFLIGHT', '4')
+
+    handled: list = []
+    running: list = []
+
+    def callback(_channel, method, _properties, body):
+        running.append(body)
+
+        # give the other messages a chance to start
+        time.sleep(.01)
+
+        handled.append((body, len(running)))
+        running.remove(body)
+
+        # close the connection once the last message is acked
+        if method.delivery_tag == 5:
+            FakeAsyncConnection.last.close_threadsafe(.1)
+
+    channel, _ = run_consumer(monkeypatch, [str(msg_num).encode() for msg_num in range(5)], callback)
+
+    # the messages were handled in order one at a time and acked in order
+    assert handled == [(str(msg_num).encode(), 1) for msg_num in range(5)]
+    assert channel.acks == [(delivery_tag, True) for delivery_tag in range(1, 6)]
+
+
+def test_async_inflight_limit(monkeypatch):
+    """
+    tests that the messages of a queue with a shard key are handled on up to ASYNC_MAX_INFLIGHT workers in order per key
+
+    :param monkeypatch:
+    :return:
+    """
+    monkeypatch.setenv('ASYNC_MAX_INFLIGHT', '2')
+    monkeypatch.setenv('WORKER_POOL_SIZE', '0')
+
+    handled: list = []
+    running: list = []
+    lock: threading.Lock = threading.Lock()
+
+    def callback(_channel, _method, _properties, body):
+        with lock:
+            running.append(body)
+            handled.append((body, len(running)))
+
+        # give the other messages a chance to start
+        time.sleep(.05)
+
+        with lock:
+            running.remove(body)
+
+            # close the connection once the last message is acked
+            if len(handled) == 8:
+                FakeAsyncConnection.last.close_threadsafe(.2)
+
+    # the messages of 4 runs, the key is the first character
+    msgs: list = [f'{run}{msg_num}'.encode() for msg_num in range(2) for run in 'abcd']
+
+    _, consumer = run_consumer(monkeypatch, msgs, callback, {'test': lambda body: body.decode()[0]})
+
+    # the queue used a worker pool with one worker per message in flight
+    assert len(consumer.worker_pools) == 1 and len(consumer.worker_pools[0].workers) == 2
+
+    # no more than 2 messages were handled at the same time and each run was handled in order
+    assert max(count for _, count in handled) <= 2
+    assert all([body for body, _ in handled if body.decode()[0] == run] == [f'{run}0'.encode(), f'{run}1'.encode()] for run in 'abcd')
+
+
+def test_async_shutdown(monkeypatch):
+    """
+    tests that the consumer finishes the messages in progress when the connection closes
+
+    :param monkeypatch:
+    :return:
+    """
+    handled: list = []
+
+    def callback(_channel, method, _properties, body):
+        # the connection goes away while the first message is being handled
+        if method.delivery_tag == 1:
+            FakeAsyncConnection.last.close_threadsafe()
+
+            time.sleep(.1)
+
+        handled.append(body)
+
+    channel, consumer = run_consumer(monkeypatch, [b'1', b'2'], callback)
+
+    # both messages were finished before the consumer returned, they were not acked on the closed channel
+    assert handled == [b'1', b'2'] and not channel.acks and not consumer.tasks
@@ -0,0 +1,144 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test Config Items - Tests writing only the config items that changed.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import contextlib
+
+from src.common.pg_impl import PGImplementation
+
+
+def get_db_info(db_info: PGImplementation, monkeypatch) -> PGImplementation:
+    """
+    makes a DB object keep the config items in memory
+
+    :param db_info:
+    :param monkeypatch:
+    :return:
+    """
+    # only write the changes and remember one run
+    db_info.config_item_diff = True
+    db_info.config_item_cache_size = 1
+
+    # the stored config items and the statements run
+    db_info.stored = {}
+    db_info.executed = []
+
+    def exec_sql(_db_name: str, sql_stmt: str, params=None):
+        db_info.executed.append(sql_stmt.split()[0])
+
+        # get the stored items
+        if sql_stmt.startswith('SELECT'):
+            return dict(db_info.stored) if db_info.stored else -1
+
+        # remove the items
+        for key in params[2]:
+            del db_info.stored[key]
+
+        return 1
+
+    def copy_rows(_db_name: str, _table_name: str, _columns: list, rows: list) -> int:
+        db_info.executed.append('COPY')
+
+        # add the items
+        for row in rows:
+            assert row[2] not in db_info.stored
+            db_info.stored[row[2]] = row[3]
+
+        return len(rows)
+
+    # use the in-memory functions
+    monkeypatch.setattr(db_info, 'transaction', lambda _db_name: contextlib.nullcontext())
+    monkeypatch.setattr(db_info, 'exec_sql', exec_sql)
+    monkeypatch.setattr(db_info, 'copy_rows', copy_rows)
+
+    return db_info
+
+
+def test_upsert_config_items(db_info, monkeypatch):
+    """
+    tests writing only the config items that were added, changed or removed
+
+    :param db_info:
+    :param monkeypatch:
+    :return:
+    """
+    db_info = get_db_info(db_info, monkeypatch)
+
+    params: dict = {'advisory': '10', 'enstorm': 'nowcast', 'storm': 5, 'insertion_date': 'one'}
+
+    # the first message loads everything
+    assert db_info.insert_config_items(1, params, transformed=True) is None
+    assert db_info.stored == {'advisory': '10', 'enstorm': 'nowcast', 'storm': '5', 'insertion_date': 'one'}
+    assert db_info.executed == ['SELECT', 'COPY']
+
+    # the same message, even with a new insertion date, is skipped without going to the DB
+    db_info.executed.clear()
+
+    assert db_info.insert_config_items(1, params | {'insertion_date': 'two'}, transformed=True) is None
+    assert not db_info.executed
+
+    # only the changed, added and removed items are written
+    assert db_info.insert_config_items(1, {'advisory': '10', 'enstorm': 'nowcast', 'storm': 6, 'new': 'x', 'insertion_date': 'three'},
+                                       transformed=True) is None
+    assert db_info.stored == {'advisory': '10', 'enstorm': 'nowcast', 'storm': '6', 'new': 'x', 'insertion_date': 'three'}
+    assert db_info.executed == ['SELECT', 'DELETE', 'COPY']
+
+    # a run that is no longer in the cache is compared with what is stored
+    db_info.executed.clear()
+    db_info.config_item_hashes.clear()
+
+    del params['storm']
+
+    assert db_info.insert_config_items(1, params, transformed=True) is None
+    assert db_info.stored == {'advisory': '10', 'enstorm': 'nowcast', 'insertion_date': 'one'}
+    assert db_info.executed == ['SELECT', 'DELETE', 'COPY']
+
+
+def test_supervisor_config_items(db_info, monkeypatch):
+    """
+    tests that the config items the supervisor changes are added once and then left alone on a cache hit or miss
+
+    :param db_info:
+    :param monkeypatch:
+    :return:
+    """
+    db_info = get_db_info(db_info, monkeypatch)
+
+    params: dict = {'advisory': '10', 'enstorm': 'nowcast', 'storm': 5, 'supervisor_job_status': 'new'}
+
+    # the first message adds the status
+    assert db_info.insert_config_items(1, params, transformed=True) is None
+    assert db_info.stored['supervisor_job_status'] == 'new'
+
+    # the supervisor starts the run
+    db_info.stored['supervisor_job_status'] = 'running'
+
+    # the same message is a cache hit, nothing is written
+    db_info.executed.clear()
+
+    assert db_info.insert_config_items(1, params, transformed=True) is None
+    assert not db_info.executed
+
+    # on a cache miss the changed items are written but the status is kept
+    db_info.config_item_hashes.clear()
+
+    assert db_info.insert_config_items(1, params | {'storm': 6}, transformed=True) is None
+    assert db_info.stored == {'advisory': '10', 'enstorm': 'nowcast', 'storm': '6', 'supervisor_job_status': 'running'}
+    assert db_info.executed == ['SELECT', 'DELETE', 'COPY']
+
+    # a message without the status does not remove it
+    db_info.config_item_hashes.clear()
+
+    del params['supervisor_job_status']
+
+    assert db_info.insert_config_items(1, params, transformed=True) is None
+    assert db_info.stored == {'advisory': '10', 'enstorm': 'nowcast', 'storm': '5', 'supervisor_job_status': 'running'}
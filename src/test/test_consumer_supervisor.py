@@ -0,0 +1,48 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test Consumer Supervisor - Tests the reconnecting of queue consumers.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+from src.common.consumer_supervisor import ConsumerSupervisor
+
+
+def test_reconnects():
+    """
+    tests the backoff and the reconnect and downtime counters
+
+    :return:
+    """
+    # create the supervisor with no waiting
+    supervisor = ConsumerSupervisor()
+    supervisor.base_delay = 0
+    supervisor.max_attempts = 3
+
+    # storage for the attempts that got a connection
+    runs: list = []
+
+    def consume():
+        # the second run connects, the others fail
+        runs.append(supervisor.attempts)
+
+        if len(runs) == 2:
+            supervisor.on_connected()
+
+    # run the consumer until the supervisor gives up
+    supervisor.run(consume, 'test')
+
+    # the backoff started over after the connection on the second run
+    assert runs == [0, 1, 1, 2]
+    assert supervisor.attempts == 3
+    assert supervisor.reconnects == 3
+
+    # the outages were counted
+    assert supervisor.downtime > 0
+    assert supervisor.get_downtime() > supervisor.downtime
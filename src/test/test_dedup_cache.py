@@ -0,0 +1,73 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test Dedup Cache - Tests the skipping of queue messages that have already been handled.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import os
+import tempfile
+
+from src.common.dedup_cache import DedupCache
+
+
+def test_dedup():
+    """
+    tests that duplicate messages are skipped, failures are not remembered and the cache survives a restart
+
+    :return:
+    """
+    with tempfile.TemporaryDirectory() as cache_path:
+        # create the cache with a file
+        os.environ['DEDUP_ENABLED'] = 'True'
+        os.environ['DEDUP_CACHE_PATH'] = os.path.join(cache_path, 'dedup.txt')
+
+        dedup_cache = DedupCache()
+
+        # storage for the handled messages
+        handled: list = []
+
+        def callback(_channel, _method, _properties, body):
+            handled.append(body)
+            return body != b'fail'
+
+        # wrap the callback
+        on_message = dedup_cache.wrap('test', callback)
+
+        # send some messages with duplicates
+        for body in [b'1', b'2', b'1', b'fail', b'fail', b'2']:
+            assert on_message(None, None, None, body) is (body != b'fail')
+
+        # the duplicates were skipped, the failures were not remembered
+        assert handled == [b'1', b'2', b'fail', b'fail']
+
+        # the same message on another queue is not a duplicate
+        assert not dedup_cache.contains(DedupCache.get_fingerprint('other', b'1'))
+
+        # the cache survives a restart
+        dedup_cache = DedupCache()
+
+        # a batch with new, old and repeated messages
+        batches: list = []
+
+        def batch_callback(bodies):
+            batches.append(bodies)
+            return [True] * len(bodies)
+
+        assert dedup_cache.wrap_batch('test', batch_callback)([b'1', b'3', b'3', b'2']) == [True, True, True, True]
+        assert batches == [[b'3']]
+
+        # the cache is bounded
+        dedup_cache.max_size = 2
+        dedup_cache.add(['a', 'b', 'c'])
+
+        assert list(dedup_cache.fingerprints) == ['b', 'c']
+
+        os.environ.pop('DEDUP_ENABLED')
+        os.environ.pop('DEDUP_CACHE_PATH')
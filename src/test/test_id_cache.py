@@ -0,0 +1,58 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test ID Cache - Tests the caching of DB record ids.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import time
+
+from src.common.id_cache import IDCache
+
+
+def test_id_cache():
+    """
+    tests that the ids are bounded, expire and are counted
+
+    :return:
+    """
+    # create a small cache
+    id_cache = IDCache('test', 2, 300)
+
+    # save some ids, the least recently used one is removed
+    id_cache.put('a', 1)
+    id_cache.put('b', 2)
+
+    assert id_cache.get('a') == 1
+
+    id_cache.put('c', 3)
+
+    assert id_cache.get('b') is None and id_cache.get('a') == 1 and id_cache.get('c') == 3
+
+    # a missing id removes the key
+    id_cache.put('a', -1)
+
+    assert id_cache.get('a') is None
+
+    # the lookups were counted
+    assert id_cache.hits == 3 and id_cache.misses == 2 and id_cache.get_stats() == 'test cache size: 1, hits: 3, misses: 2'
+
+    # the ids expire
+    id_cache.ttl = 0.01
+
+    time.sleep(0.02)
+
+    assert id_cache.get('c') is None and not id_cache.ids
+
+    # a cache with no size does not save anything
+    id_cache = IDCache('test', 0, 300)
+
+    id_cache.put('a', 1)
+
+    assert id_cache.get('a') is None
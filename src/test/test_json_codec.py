@@ -0,0 +1,42 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test JSON Codec - Tests that the JSON codec matches the standard library.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import json
+import glob
+
+from src.common import json_codec
+
+
+def test_codec():
+    """
+    tests decoding and encoding the sample messages
+
+    :return:
+    """
+    # for each sample message
+    for file_name in glob.glob('*.json'):
+        # get the raw message
+        with open(file_name, 'rb') as fh:
+            body: bytes = fh.read()
+
+        # the decoded message matches the standard library
+        msg_obj: dict = json_codec.loads(body)
+
+        assert msg_obj == json.loads(body)
+
+        # the encoded message decodes back to the same thing
+        assert json.loads(json_codec.dumps(msg_obj)) == msg_obj
+
+    # the things the fast library does not handle still work
+    assert json_codec.loads(b'{"value": NaN}')['value'] != 0
+    assert json.loads(json_codec.dumps({1: 'int key'})) == {'1': 'int key'}
@@ -0,0 +1,161 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test Lookup Refresher - Tests the reloading of the lookup table data.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import os
+import time
+import logging
+import tempfile
+
+from src.common import lu_refresher as lu_refresher_module
+from src.common.pg_impl import PGImplementation
+from src.common.lu_refresher import LookupRefresher, load_snapshot, save_snapshot, reload_lu_data
+
+
+def get_loads(fake_server) -> int:
+    """
+    gets the number of times the lookup data was loaded
+
+    :param fake_server:
+    :return:
+    """
+    return sum(1 for conn in fake_server.opened for sql_stmt, _ in conn.executed if sql_stmt.startswith('SELECT json_build_object'))
+
+
+def wait_for(condition) -> bool:
+    """
+    waits a bit for a condition to be met
+
+    :param condition:
+    :return:
+    """
+    for _ in range(50):
+        if condition():
+            return True
+
+        time.sleep(.1)
+
+    return False
+
+
+def test_lu_refresher(db_info, fake_server, monkeypatch):
+    """
+    tests that a lookup miss reloads the data without waiting, at most once per interval
+
+    :param db_info:
+    :param fake_server:
+    :param monkeypatch:
+    :return:
+    """
+    # allow a reload right away
+    monkeypatch.setenv('LU_RELOAD_MIN_INTERVAL', '0')
+
+    # the notifications cannot be listened for
+    def connect(_conn_str):
+        raise ConnectionError('no notifications')
+
+    monkeypatch.setattr(lu_refresher_module.psycopg2, 'connect', connect)
+
+    # a site is added
+    fake_server.results['SELECT json_build_object'] = fake_server.LU_DATA | {'site': {'RENCI': 1, 'TACC': 2, 'LSU': 3}}
+
+    lu_refresher = LookupRefresher(db_info, _logger=logging.getLogger())
+
+    try:
+        # a reload swaps in the new data even when the notifications are not working
+        assert lu_refresher.request_reload()
+        assert wait_for(lambda: db_info.legacy_constants['site'].get('LSU') == 3)
+
+        # data that did not all load is not used
+        fake_server.results['SELECT json_build_object'] = fake_server.LU_DATA | {'site': None}
+
+        assert lu_refresher.request_reload()
+        assert wait_for(lambda: get_loads(fake_server) == 3) and db_info.legacy_constants['site']['LSU'] == 3
+
+        # reloads are rate limited
+        lu_refresher.min_interval = 300
+
+        assert not lu_refresher.request_reload()
+    finally:
+        lu_refresher.stop()
+
+    assert not lu_refresher.thread.is_alive()
+
+
+def test_lu_snapshot(db_info, fake_server):
+    """
+    tests that the lookup data is loaded in one call, saved when it changes and loaded from the snapshot
+
+    :param db_info:
+    :param fake_server:
+    :return:
+    """
+    # a site is added
+    fake_server.results['SELECT json_build_object'] = fake_server.LU_DATA | {'site': {'RENCI': 1, 'TACC': 2, 'LSU': 3}}
+
+    with tempfile.TemporaryDirectory() as snapshot_path:
+        db_info.lu_snapshot_path = os.path.join(snapshot_path, 'lu_snapshot.json')
+
+        logger = logging.getLogger()
+
+        # there is no snapshot yet
+        assert load_snapshot(db_info.lu_snapshot_path, logger) is None
+
+        # the reload gets all the tables in one statement, swaps in the data and saves it
+        assert reload_lu_data(db_info, logger) and get_loads(fake_server) == 2
+        assert fake_server.opened[0].executed[-1][0].count('public.get_lu_items') == 4
+        assert db_info.legacy_constants['site']['LSU'] == 3 and db_info.legacy_constants['pct_complete']['3'] == 40
+
+        assert load_snapshot(db_info.lu_snapshot_path, logger) == db_info.legacy_constants
+
+        # a failed load keeps the current data
+        db_info.close_conn('apsviz')
+
+        fake_server.error = ConnectionError('the DB is down')
+
+        assert not reload_lu_data(db_info, logger) and db_info.legacy_constants['site']['LSU'] == 3
+
+        # an incomplete snapshot is not used
+        save_snapshot(db_info.lu_snapshot_path, {'site': None}, logger)
+
+        assert load_snapshot(db_info.lu_snapshot_path, logger) is None
+
+
+def test_lu_snapshot_startup(fake_server, monkeypatch):
+    """
+    tests that a DB object starts from the snapshot without waiting for the DB and checks it in the background
+
+    :param fake_server:
+    :param monkeypatch:
+    :return:
+    """
+    with tempfile.TemporaryDirectory() as snapshot_path:
+        # save a snapshot that is missing a site
+        monkeypatch.setenv('LU_SNAPSHOT_PATH', os.path.join(snapshot_path, 'lu_snapshot.json'))
+
+        save_snapshot(os.environ['LU_SNAPSHOT_PATH'], fake_server.LU_DATA | {'site': {'RENCI': 1}, 'pct_complete': {'3': 40}}, logging.getLogger())
+
+        # the DB is down
+        fake_server.error = ConnectionError('the DB is down')
+
+        # the object is created with the snapshot data without connecting
+        db_info = PGImplementation(('apsviz',), _logger=logging.getLogger())
+
+        assert db_info.legacy_constants['site'] == {'RENCI': 1} and not fake_server.opened
+
+        # the DB comes back, the next start checks the snapshot against it
+        fake_server.error = None
+
+        db_info = PGImplementation(('apsviz',), _logger=logging.getLogger())
+
+        assert wait_for(lambda: db_info.legacy_constants['site'] == fake_server.LU_DATA['site'])
+        assert wait_for(lambda: load_snapshot(os.environ['LU_SNAPSHOT_PATH'], logging.getLogger())['site'] == fake_server.LU_DATA['site'])
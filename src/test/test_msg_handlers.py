@@ -18,6 +18,7 @@ import csv
 from src.common.queue_utils import QueueUtils
 from src.common.pg_impl import PGImplementation
 from src.common.queue_callbacks import QueueCallbacks
+from src.common.msg_schemas import RunPropsMsg
 
 # these are the currently expected ecflow params that were transformed into legacy params
 ecflow_expected_transformed_params: dict = {'physical_location': 'RENCI', 'monitoring.rmqmessaging.locationname': 'RENCI', 'instance_name': 'ec95d',
@@ -78,7 +79,7 @@ def test_insert_ecflow_config_items():
     site_id = db_info.get_lu_id(run_props.get('suite.physical_location'), 'site', context='test_insert_ecflow_config_items()')
 
     # insert an instance record into the DB to get things primed
-    instance_id = db_info.insert_instance(state_id, site_id, run_props, context='test_insert_ecflow_config_items()')
+    instance_id = db_info.insert_instance(state_id, site_id, RunPropsMsg(run_props), context='test_insert_ecflow_config_items()')
 
     # make sure we are in debug mode and have a workflow type
     run_props.update({'workflow_type': 'ECFLOW', 'supervisor_job_status': 'debug', 'insertion_date': queue_utils.get_formatted_date()})
@@ -126,7 +127,7 @@ def test_insert_hecras_config_items():
     site_id = db_info.get_lu_id(run_props.get('suite.physical_location'), 'site', context='test_insert_hecras_config_items()')
 
     # insert an instance record into the DB to get things primed
-    instance_id = db_info.insert_instance(state_id, site_id, run_props, context='test_insert_hecras_config_items()')
+    instance_id = db_info.insert_instance(state_id, site_id, RunPropsMsg(run_props), context='test_insert_hecras_config_items()')
 
     # make sure we are in debug mode and have a workflow type
     run_props.update({'workflow_type': 'HECRAS', 'supervisor_job_status': 'debug', 'insertion_date': queue_utils.get_formatted_date()})
@@ -0,0 +1,62 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test Message Schemas - Tests the decoding and validation of the queue messages.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import pytest
+
+from src.common.msg_schemas import RunTimeStatusMsg, RunPropsMsg
+
+
+def test_run_time_status_msg():
+    """
+    tests decoding a run time status message
+
+    :return:
+    """
+    # get the raw message
+    with open('test_ecflow_run_time.json', 'rb') as fh:
+        msg = RunTimeStatusMsg.decode(fh.read())
+
+    # the values are typed and the empty ones have the defaults
+    assert msg.physical_location == 'AWS-TWI' and msg.event_type == 'FORE' and msg.state == 'RUNN'
+    assert msg.process_id == 10669066 and msg.instance_name == 'egom_coamps_2024_09L'
+    assert msg.date_time == '2024-09-24 12:00:00' and msg.advisory_id == '2024092406'
+    assert msg.storm_name == 'Unnamed' and msg.storm_number == 'coamps_09L' and msg.process == 'N/A'
+    assert msg.sub_pct_complete == 0 and msg.message == 'none'
+
+    # a message with nothing in it gets all the defaults, including a time stamp
+    msg = RunTimeStatusMsg.decode(b'{"uid": "", "date-time": "", "message": ""}')
+
+    assert msg.process_id == 0 and msg.instance_name == 'N/A' and msg.advisory_id == 'N/A' and msg.run_params == 'N/A'
+    assert len(msg.date_time) == 16 and msg.sub_pct_complete is None and msg.message is None
+
+    # slots do not allow other attributes
+    with pytest.raises(AttributeError):
+        setattr(msg, 'storm', 'none')
+
+    # bad messages are rejected
+    for body in [b'[1, 2]', b'{"uid": "abc"}']:
+        with pytest.raises(ValueError):
+            RunTimeStatusMsg.decode(body)
+
+
+def test_run_props_msg():
+    """
+    tests creating a run properties message
+
+    :return:
+    """
+    # create the message from the legacy params
+    msg = RunPropsMsg({'physical_location': 'RENCI', 'instance_name': 'ec95d', 'uid': '90161888'})
+
+    assert msg.physical_location == 'RENCI' and msg.instance_name == 'ec95d' and msg.process_id == 90161888
+    assert msg.run_params == 'N/A' and len(msg.date_time) == 16
@@ -0,0 +1,116 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test Ordered Worker Pool - Tests the per key ordered processing of queue messages.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import json
+import threading
+from collections import namedtuple
+import test_ack_batcher as ack_tester
+
+from src.common.ack_batcher import AckBatcher
+from src.common.ordered_worker_pool import OrderedWorkerPool
+from src.common.queue_callbacks import QueueCallbacks
+
+
+def test_shard_key():
+    """
+    tests the run keys taken from the run time status and run properties messages
+
+    :return:
+    """
+    # create a message
+    body: bytes = json.dumps({'physical_location': 'RENCI', 'uid': '1234', 'instance_name': 'ec95d', 'event_type': 'STRT'}).encode()
+
+    # check the key
+    assert QueueCallbacks.get_run_time_shard_key(body) == 'RENCI|1234|ec95d'
+
+    # a bad message still gets a key
+    assert QueueCallbacks.get_run_time_shard_key(b'not json') == ''
+
+    # a run properties message has the run under the suite params
+    body = json.dumps({'suite.physical_location': 'RENCI', 'suite.uid': '1234', 'suite.instance_name': 'ec95d', 'forcing.advisory': '01'}).encode()
+
+    assert QueueCallbacks.get_run_props_shard_key(body) == 'RENCI|1234|ec95d'
+    assert QueueCallbacks.get_run_props_shard_key(b'not json') == ''
+
+
+def test_ordered_processing():
+    """
+    tests that messages are processed in order per key and are all acknowledged
+
+    :return:
+    """
+    # create a fake channel and the delivery info
+    channel = ack_tester.FakeChannel()
+    method_tpl = namedtuple('Method', ['delivery_tag'])
+
+    # storage for the processed messages per key
+    processed: dict = {}
+
+    def callback(_channel, _method, _properties, body):
+        msg_obj = json.loads(body)
+        processed.setdefault(msg_obj['uid'], []).append(msg_obj['seq'])
+
+    # create the ack batcher and the pool
+    ack_batcher = AckBatcher(1000, 1000)
+    worker_pool = OrderedWorkerPool(4, QueueCallbacks.get_run_time_shard_key)
+    on_message = worker_pool.wrap(callback, ack_batcher)
+
+    # send messages for a number of runs, interleaved
+    tag: int = 0
+    for seq in range(50):
+        for uid in range(8):
+            tag += 1
+            on_message(channel, method_tpl(tag), None, json.dumps({'uid': str(uid), 'seq': seq}).encode())
+
+    # wait for the work to finish
+    worker_pool.stop()
+
+    # each run must have been processed in order
+    for uid in range(8):
+        assert processed[str(uid)] == list(range(50))
+
+    # send the acks and make sure everything was acknowledged
+    ack_batcher.flush()
+
+    assert channel.acks == [(tag, True)]
+
+
+def test_stop_timeout():
+    """
+    tests that stopping the pool does not wait past the timeout for a worker that is stuck
+
+    :return:
+    """
+    method_tpl = namedtuple('Method', ['delivery_tag'])
+
+    # the message for the first key blocks its worker until released
+    release = threading.Event()
+
+    def callback(_channel, _method, _properties, body):
+        if body == b'stuck':
+            release.wait()
+
+    worker_pool = OrderedWorkerPool(2, lambda body: body.decode())
+    on_message = worker_pool.wrap(callback)
+
+    on_message(None, method_tpl(1), None, b'stuck')
+
+    try:
+        # the stuck worker is reported and the stop returns after the timeout
+        assert not worker_pool.stop(timeout=.2)
+        assert sum(1 for worker in worker_pool.workers if worker.is_alive()) == 1
+    finally:
+        release.set()
+
+    # the workers all finish once it is released
+    assert worker_pool.stop(timeout=5)
@@ -0,0 +1,192 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test PG Connection Pool - Tests the lending, recycling and eviction of DB connections.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import time
+import logging
+import threading
+
+from src.common.pg_conn_pool import PGConnectionPool
+from src.common.pg_utils_multi import PGUtilsMultiConnect
+
+
+def get_db_info() -> PGUtilsMultiConnect:
+    """
+    creates a DB object, the fake_server fixture gives it fake connections
+
+    :return:
+    """
+    return PGUtilsMultiConnect('test', ('test',), _logger=logging.getLogger())
+
+
+def test_pool(monkeypatch, fake_server):
+    """
+    tests checking out and returning connections
+
+    :param monkeypatch:
+    :param fake_server:
+    :return:
+    """
+    # a small pool
+    monkeypatch.setenv('PG_POOL_MAX_SIZE', '2')
+
+    # get the connections that are opened
+    opened: list = fake_server.opened
+
+    pool = PGConnectionPool('test', fake_server.connect)
+
+    # a returned connection is reused
+    with pool.connection() as conn:
+        pass
+
+    with pool.connection() as conn_2:
+        assert conn_2 is conn
+
+    # the pool is bounded, the third thread waits for a connection to be returned
+    conn = pool.checkout()
+    conn_2 = pool.checkout()
+
+    assert len(opened) == 2 and pool.size == 2
+
+    got: list = []
+
+    thread = threading.Thread(target=lambda: got.append(pool.checkout()))
+    thread.start()
+    thread.join(0.2)
+
+    assert not got
+
+    pool.checkin(conn_2)
+    thread.join(5)
+
+    assert got == [conn_2] and len(opened) == 2
+
+    # a broken connection is replaced
+    conn.close()
+    pool.checkin(conn)
+
+    assert pool.size == 1
+
+    with pool.connection() as conn:
+        assert conn is opened[-1] and len(opened) == 3
+
+    pool.checkin(conn_2)
+
+    # old connections are closed when they are returned, idle ones when the next connection is checked out
+    pool.max_lifetime = 0
+
+    with pool.connection() as conn:
+        pass
+
+    assert conn.closed and pool.size == 1
+
+    pool.max_lifetime = 3600
+    pool.max_idle = 0
+
+    time.sleep(0.01)
+
+    with pool.connection() as conn:
+        assert not conn.closed
+
+    assert opened[2].closed and pool.size == 1
+
+    # close everything
+    pool.close_all()
+
+    assert conn.closed and pool.size == 0 and not pool.in_use
+
+
+def test_lost_connection(fake_server):
+    """
+    tests that a statement is retried on a new connection when the connection was lost
+
+    :param fake_server:
+    :return:
+    """
+    # get the connections that are opened
+    opened: list = fake_server.opened
+
+    # create the DB object
+    db_info = get_db_info()
+
+    # statements run on the same connection without any probe queries
+    assert db_info.exec_autocommit_sql('test', 'SELECT 1') == 1
+    assert db_info.exec_autocommit_sql('test', 'SELECT 1') == 2
+    assert len(opened) == 1
+
+    # a connection known to be closed is replaced before the statement runs
+    opened[0].closed = 2
+
+    assert db_info.exec_autocommit_sql('test', 'SELECT 1') == 1
+    assert len(opened) == 2 and db_info.dbs['test'].size == 1
+
+    # a statement that keeps failing returns an error
+    assert db_info.exec_autocommit_sql('test', 'lose') == -1
+    assert db_info.dbs['test'].size == 0 and not db_info.dbs['test'].in_use
+
+
+def test_prepared_statements(fake_server):
+    """
+    tests that a registered statement is prepared once per connection
+
+    :param fake_server:
+    :return:
+    """
+    # get the connections that are opened
+    opened: list = fake_server.opened
+
+    # create the DB object
+    db_info = get_db_info()
+
+    # register a statement
+    db_info.register_statement('get_test', 'SELECT id FROM test WHERE name=$1 AND site_id=$2')
+
+    # run it twice, the values are bound and not put in the sql
+    db_info.exec_prepared('test', 'get_test', ("it's \\ \"raw\"", 1))
+    db_info.exec_prepared('test', 'get_test', ('other', 2))
+
+    assert opened[0].executed == [('PREPARE get_test AS SELECT id FROM test WHERE name=$1 AND site_id=$2', None),
+                                  ('EXECUTE get_test (%s, %s)', ("it's \\ \"raw\"", 1)), ('EXECUTE get_test (%s, %s)', ('other', 2))]
+
+    # a new connection prepares it again
+    opened[0].close()
+
+    db_info.exec_prepared('test', 'get_test', ('other', 2))
+
+    assert opened[1].executed[0][0].startswith('PREPARE get_test')
+
+
+def test_copy_rows(fake_server):
+    """
+    tests loading rows with COPY in a transaction
+
+    :param fake_server:
+    :return:
+    """
+    # get the connections that are opened
+    opened: list = fake_server.opened
+
+    # create the DB object
+    db_info = get_db_info()
+
+    # the delete and the load are in one transaction on one connection
+    with db_info.transaction('test'):
+        db_info.exec_sql('test', 'DELETE FROM test WHERE uid = %s', ('uid',))
+
+        count: int = db_info.copy_rows('test', 'public."test"', ['key', 'value'],
+                                       [('a', "it's"), ('b', 'tab\there\nnew \\ line'), ('c', None)])
+
+    assert count == 3
+    assert opened[0].executed == [('DELETE FROM test WHERE uid = %s', ('uid',)),
+                                  ('COPY public."test" (key, value) FROM STDIN', "a\tit's\nb\ttab\\there\\nnew \\\\ line\nc\t\\N\n"),
+                                  ('COMMIT', None)]
+    assert len(opened) == 1 and opened[0].autocommit
@@ -134,6 +134,55 @@ def test_transform_msg_params():
     assert ret_val == expected_params
 
 
+def test_map_msg_params():
+    """
+    tests mapping and reformatting the params in a single pass
+
+    :return:
+    """
+    # instantiate the utility class
+    queue_utils = QueueUtils(_queue_name='')
+
+    # for each set of test data
+    for test_datum in test_data:
+        # load the test json
+        with open(test_datum[0], encoding='UTF-8') as test_fh:
+            run_props = json.loads(test_fh.read())
+
+        # the single pass matches the two steps
+        assert queue_utils.map_msg_params(run_props) == queue_utils.transform_msg_params(queue_utils.extend_msg_to_legacy_equivalent(run_props))
+
+    # a mapped key is reformatted, a bad value is left as is and the message is not changed
+    run_props: dict = {'forcing.stormnumber': 'al05', 'forcing.stormname': 'ernesto', 'stormname': 'old', 'storm': 7}
+
+    assert queue_utils.map_msg_params(run_props) == {'forcing.stormnumber': 'al05', 'forcing.stormname': 'ERNESTO', 'stormname': 'ERNESTO',
+                                                     'storm': 'al05', 'stormnumber': '05', 'forcing.tropicalcyclone.stormname': 'ERNESTO'}
+    assert queue_utils.transform_msg_params(run_props)['storm'] == 7
+    assert run_props['stormname'] == 'old'
+
+
+def test_add_relay_context():
+    """
+    tests adding the relay context to a message body
+
+    :return:
+    """
+    # for each test data file
+    for test_file in ['test_ecflow_run_props.json', 'test_hecras_run_props.json', 'test_ecflow_run_time.json']:
+        # open the data file
+        with open(test_file, 'rb') as test_fh:
+            # get the raw message
+            body: bytes = test_fh.read()
+
+        # add the relay context and make sure it matches a full decode/encode
+        assert json.loads(QueueUtils.add_relay_context(body, 'test')) == json.loads(body) | {'relay_context': 'test'}
+
+    # an empty object, a relayed message and a string all work
+    assert json.loads(QueueUtils.add_relay_context(b'{ }', 'test')) == {'relay_context': 'test'}
+    assert json.loads(QueueUtils.add_relay_context(b'{"relay_context": "old"}', 'test')) == {'relay_context': 'test'}
+    assert json.loads(QueueUtils.add_relay_context('{"test": "test"}', '"quoted"')) == {'test': 'test', 'relay_context': '"quoted"'}
+
+
 def test_relay():
     """
     tests the message relay method
@@ -0,0 +1,358 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test Relay Publisher - Tests the publisher confirm tracking of relayed messages.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+import os
+import time
+import tempfile
+import threading
+from concurrent.futures import Future
+from collections import namedtuple
+import test_ack_batcher as ack_tester
+
+import pytest
+import pika
+from src.common.queue_utils import QueueUtils
+from src.common.general_utils import GeneralUtils
+from src.common.confirm_relay_publisher import ConfirmRelayPublisher
+from src.common.relay_outbox import RelayOutbox
+
+
+class FakePublishChannel:
+    """
+    a fake channel that records the published messages
+    """
+    def __init__(self):
+        self.is_open: bool = True
+        self.declared: list = []
+        self.published: list = []
+
+    def queue_declare(self, queue, arguments=None):
+        """
+        records a queue declaration
+        """
+        self.declared.append((queue, arguments))
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        """
+        records a published message
+        """
+        self.published.append((exchange, routing_key, body, properties))
+
+
+class FakePublisher:
+    """
+    a fake relay publisher that can be made to fail
+    """
+    def __init__(self):
+        self.host: str = 'localhost'
+        self.fail: bool = True
+        self.attempts: int = 0
+        self.published: list = []
+
+        # if a list, the futures of the submitted messages are saved there to be confirmed later
+        self.confirms = None
+
+        # the outbox that spools the failed messages
+        self.outbox = None
+
+    def publish(self, queue_name, body, properties=None, arguments=None):
+        """
+        records a published message or fails
+        """
+        self.attempts += 1
+
+        if self.fail:
+            raise ConnectionError('relay host down')
+
+        self.published.append((queue_name, body) if properties is None else (queue_name, body, properties, arguments))
+
+    def submit(self, queue_name, body):
+        """
+        records a published message and returns its future
+        """
+        future: Future = Future()
+
+        try:
+            self.publish(queue_name, body)
+
+            # confirm it now or later
+            if self.confirms is not None:
+                self.confirms.append(future)
+            else:
+                future.set_result(True)
+        except ConnectionError as e:
+            future.set_exception(e)
+
+        return future
+
+
+def test_confirms():
+    """
+    tests the tracking of acked, nacked and timed out relay messages
+
+    :return:
+    """
+    # create the publisher with a fake channel. the background thread is not started, the loop runs the callbacks right away
+    publisher = ConfirmRelayPublisher('localhost', 'user', 'password')
+    publisher.channel = FakePublishChannel()
+    publisher.max_attempts = 2
+    publisher.loop = ack_tester.FakeLoop()
+    publisher.thread = threading.current_thread()
+
+    # a frame for the confirms
+    frame_tpl = namedtuple('Frame', ['method'])
+
+    # queue and publish some messages
+    futures: list = [publisher.submit('test', str(msg_num).encode()) for msg_num in range(5)]
+
+    # everything was published and is waiting for a confirm
+    assert publisher.channel.declared == [('test', None)]
+    assert len(publisher.channel.published) == 5
+    assert list(publisher.unconfirmed) == [1, 2, 3, 4, 5]
+
+    # ack the first 2 and nack the 3rd
+    publisher.on_confirm(frame_tpl(pika.spec.Basic.Ack(delivery_tag=2, multiple=True)))
+    publisher.on_confirm(frame_tpl(pika.spec.Basic.Nack(delivery_tag=3)))
+
+    # the acked messages are done and the nacked message was published again
+    assert futures[0].result() and futures[1].result() and not futures[2].done()
+    assert publisher.channel.published[-1][2] == b'2'
+    assert list(publisher.unconfirmed) == [4, 5, 6]
+
+    # time out all the unconfirmed messages
+    publisher.confirm_timeout = -1
+    publisher.check_timeouts()
+
+    # they were published again in order, except the one that is out of attempts
+    assert [msg[2] for msg in publisher.channel.published[-2:]] == [b'3', b'4']
+    assert list(publisher.unconfirmed) == [7, 8]
+    assert isinstance(futures[2].exception(), ConnectionError)
+
+    # nack them all, they are all out of attempts
+    publisher.on_confirm(frame_tpl(pika.spec.Basic.Nack(delivery_tag=8, multiple=True)))
+
+    assert len(publisher.channel.published) == 8
+    assert not publisher.pending and not publisher.unconfirmed
+    assert all(isinstance(future.exception(), ConnectionError) for future in futures[3:])
+
+
+def test_confirm_failures():
+    """
+    tests that failed connections use up attempts and that the number of messages held is bounded
+
+    :return:
+    """
+    # create the publisher with room for 2 messages. the relay host is down
+    publisher = ConfirmRelayPublisher('localhost', 'user', 'password')
+    publisher.max_attempts = 2
+    publisher.confirm_timeout = .1
+    publisher.max_pending = 2
+    publisher.loop = ack_tester.FakeLoop()
+    publisher.thread = threading.current_thread()
+
+    futures: list = [publisher.submit('test', str(msg_num).encode()) for msg_num in range(2)]
+
+    # there is no room for another message
+    with pytest.raises(ConnectionError):
+        publisher.submit('test', b'2')
+
+    # each failed connection is an attempt, the messages fail when they are out of attempts
+    publisher.on_connection_error(None, 'refused')
+
+    assert len(publisher.pending) == 2 and not any(future.done() for future in futures)
+
+    publisher.on_connection_error(None, 'refused')
+
+    assert not publisher.pending and all(isinstance(future.exception(), ConnectionError) for future in futures)
+
+    # there is room again. with an outbox the messages fail right away so they can be spooled
+    futures = [publisher.submit('test', b'3')]
+    publisher.outbox = object()
+
+    with pytest.raises(ConnectionError):
+        publisher.submit('test', b'4')
+
+    publisher.on_connection_error(None, 'refused')
+
+    assert isinstance(futures[0].exception(), ConnectionError)
+
+    # once a connection opens the messages are held again while it is lost and reopened
+    publisher.on_confirm_selected(FakePublishChannel())
+    publisher.on_connection_closed(None, 'closed')
+
+    futures = [publisher.submit('test', b'5')]
+
+    assert publisher.pending and not futures[0].done()
+
+
+def test_confirm_startup():
+    """
+    tests that with an outbox the messages are held while the first connection opens rather than failing
+
+    :return:
+    """
+    # create the publisher with an outbox. the connection is still opening
+    publisher = ConfirmRelayPublisher('localhost', 'user', 'password')
+    publisher.outbox = object()
+    publisher.loop = ack_tester.FakeLoop()
+    publisher.thread = threading.current_thread()
+
+    futures: list = [publisher.submit('test', b'1')]
+
+    # the message waits for the connection and is published once it is ready
+    assert len(publisher.pending) == 1 and not futures[0].done()
+
+    publisher.on_confirm_selected(FakePublishChannel())
+
+    assert not publisher.pending and list(publisher.unconfirmed) == [1]
+
+
+def test_confirms_in_flight(monkeypatch):
+    """
+    tests that a relayed message does not wait for its confirm and that a relay that fails later is alerted
+
+    :param monkeypatch:
+    :return:
+    """
+    # relay with confirms to a publisher that does not confirm the messages yet
+    for setting, value in {'RELAY_RABBITMQ_USER': 'user', 'RELAY_RABBITMQ_PW': 'pass', 'RELAY_RABBITMQ_HOST': 'localhost', 'RELAY_ENABLED': 'True',
+                           'RELAY_CONFIRMS_ENABLED': 'True', 'RELAY_OUTBOX_ENABLED': 'False'}.items():
+        monkeypatch.setenv(setting, value)
+
+    publisher = FakePublisher()
+    publisher.fail = False
+    publisher.confirms = []
+
+    monkeypatch.setattr(ConfirmRelayPublisher, 'get_publisher', lambda *args, **kwargs: publisher)
+
+    # record the alerts
+    alerts: list = []
+
+    monkeypatch.setattr(GeneralUtils, 'send_slack_msg', lambda _self, msg, channel: alerts.append(msg))
+
+    queue_utils = QueueUtils(_queue_name='test')
+
+    # the messages are all in flight at once
+    assert all(queue_utils.relay_msg(f'{{"msg": {msg_num}}}'.encode()) for msg_num in range(3)) and len(publisher.confirms) == 3
+
+    # the first two are confirmed and the last one fails
+    publisher.confirms[0].set_result(True)
+    publisher.confirms[1].set_result(True)
+    publisher.confirms[2].set_exception(ConnectionError('relay host down'))
+
+    # only the failure is alerted
+    for _ in range(50):
+        if alerts:
+            break
+
+        time.sleep(.1)
+
+    assert len(alerts) == 1
+
+
+def test_outbox():
+    """
+    tests spooling relay messages while the relay host is down and replaying them in order
+
+    :return:
+    """
+    with tempfile.TemporaryDirectory() as outbox_path:
+        # create the outbox with small segments
+        publisher = FakePublisher()
+        outbox = RelayOutbox(publisher, outbox_path)
+        outbox.segment_bytes = 50
+
+        # relay some messages while the relay host is down
+        for msg_num in range(10):
+            outbox.submit('test', str(msg_num).encode())
+
+        # only the first message tried the relay host, the rest went straight to the outbox
+        assert publisher.attempts == 1
+        assert outbox.get_depth() == 10
+        assert len(outbox.get_segments()) > 1
+
+        # the messages survive a restart
+        outbox.stop()
+        outbox = RelayOutbox(publisher, outbox_path)
+
+        assert outbox.get_depth() == 10
+
+        # bring the relay host back and wait for the outbox to drain
+        publisher.fail = False
+
+        for _ in range(50):
+            if not outbox.get_depth():
+                break
+
+            time.sleep(.1)
+
+        outbox.stop()
+
+        # everything was relayed in order and the segments were removed
+        assert publisher.published == [('test', str(msg_num).encode()) for msg_num in range(10)]
+        assert outbox.get_depth() == 0
+        assert not outbox.get_segments()
+
+
+def test_outbox_confirms(monkeypatch):
+    """
+    tests that the outbox only removes the messages it replayed once they are confirmed and reports its depth
+
+    :param monkeypatch:
+    :return:
+    """
+    with tempfile.TemporaryDirectory() as outbox_path:
+        # each process gets its own outbox directory
+        monkeypatch.setenv('RELAY_OUTBOX_PATH', outbox_path)
+        monkeypatch.setenv('RELAY_OUTBOX_NAME', 'test')
+
+        publisher = FakePublisher()
+        outbox = RelayOutbox.get_outbox(publisher)
+
+        try:
+            assert outbox.path == os.path.join(outbox_path, 'localhost', 'test') and publisher.outbox is outbox
+
+            # spool some messages while the relay host is down
+            for msg_num in range(3):
+                outbox.submit('test', str(msg_num).encode())
+
+            # the relay host comes back but does not confirm the messages yet
+            publisher.confirms = []
+            publisher.fail = False
+
+            for _ in range(50):
+                if len(publisher.confirms) == 3:
+                    break
+
+                time.sleep(.1)
+
+            # the messages were replayed but are still in the outbox
+            assert len(publisher.published) == 3 and outbox.get_depth() == 3 and outbox.get_segments()
+
+            # confirm them
+            for future in publisher.confirms:
+                future.set_result(True)
+
+            for _ in range(50):
+                if not outbox.get_segments() and outbox.reported_depth == 0:
+                    break
+
+                time.sleep(.1)
+
+            # the segment was removed and the depth was reported
+            assert outbox.get_depth() == 0 and not outbox.get_segments()
+
+            with open(os.path.join(outbox.path, 'depth'), 'r', encoding='utf-8') as depth_file:
+                assert depth_file.read() == '0'
+        finally:
+            RelayOutbox.stop_outboxes()
@@ -0,0 +1,203 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test Retry Handler - Tests the delayed retries and dead-lettering of failed queue messages.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+from collections import namedtuple
+import test_ack_batcher as ack_tester
+import test_relay_publisher as relay_tester
+
+import pika
+from src.common.msg_batcher import MsgBatcher
+from src.common.queue_callbacks import QueueCallbacks
+from src.common.retry_handler import RetryHandler, ATTEMPTS_HEADER
+
+
+def test_retry():
+    """
+    tests that failed messages go through the delay queues and then to the dead-letter queue
+
+    :return:
+    """
+    # create the retry handler with a fake publisher
+    publisher = relay_tester.FakePublisher()
+    publisher.fail = False
+
+    retry_handler = RetryHandler()
+    retry_handler.max_attempts = 2
+    retry_handler.base_delay_ms = 1000
+    retry_handler.get_publisher = lambda: publisher
+
+    # wrap a callback that always fails
+    on_message = retry_handler.wrap('test', lambda *args: False)
+
+    # handle the message until it is dead-lettered, each time with the properties of the last retry
+    properties = pika.BasicProperties()
+
+    for _ in range(3):
+        on_message(None, None, properties, b'{}')
+        properties = publisher.published[-1][2]
+
+    # the message went through the delay queues with increasing delays and then to the dead-letter queue
+    assert [msg[0] for msg in publisher.published] == ['test.retry.1000', 'test.retry.2000', 'test.dead']
+    assert [msg[2].headers[ATTEMPTS_HEADER] for msg in publisher.published] == [1, 2, 3]
+    assert [msg[3]['x-message-ttl'] for msg in publisher.published[:2]] == [1000, 2000]
+    assert publisher.published[0][3]['x-dead-letter-routing-key'] == 'test'
+
+    # a successful message is not retried
+    retry_handler.wrap('test', lambda *args: True)(None, None, pika.BasicProperties(), b'{}')
+
+    assert len(publisher.published) == 3
+
+
+def test_batch_retry():
+    """
+    tests that the failed messages of a batch are retried
+
+    :return:
+    """
+    # create the retry handler with a fake publisher
+    publisher = relay_tester.FakePublisher()
+    publisher.fail = False
+
+    retry_handler = RetryHandler()
+    retry_handler.enabled = True
+    retry_handler.get_publisher = lambda: publisher
+
+    # create a msg batcher for a batch callback that fails the second message
+    msg_batcher = MsgBatcher(2, 1000, retry_handler.get_failure_callback('test'))
+    on_message = msg_batcher.wrap(lambda bodies: [body != b'2' for body in bodies])
+
+    # send a batch
+    channel = ack_tester.FakeChannel()
+    method_tpl = namedtuple('Method', ['delivery_tag'])
+
+    for tag in range(1, 3):
+        on_message(channel, method_tpl(tag), pika.BasicProperties(), str(tag).encode())
+
+    # only the failed message was retried
+    assert [(msg[0], msg[1]) for msg in publisher.published] == [('test.retry.10000', b'2')]
+
+
+class FakeDeadLetterChannel:
+    """
+    A connection and channel to a dead-letter queue that records the messages published and acknowledged
+    """
+    def __init__(self, msgs: list):
+        self.msgs: list = msgs
+        self.confirms: bool = False
+        self.published: list = []
+        self.acked: list = []
+
+        # the number of publishes the queue host accepts
+        self.accept: int = len(msgs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def channel(self):
+        """
+        gets the channel
+        """
+        return self
+
+    def confirm_delivery(self):
+        """
+        turns on the publisher confirms
+        """
+        self.confirms = True
+
+    def basic_get(self, _queue_name: str, auto_ack: bool = False):
+        """
+        gets the next message
+        """
+        assert not auto_ack
+
+        if not self.msgs:
+            return None, None, None
+
+        method_tpl = namedtuple('Method', ['delivery_tag'])
+
+        return (method_tpl(len(self.published) + 1), pika.BasicProperties(headers={ATTEMPTS_HEADER: 6, 'other': 1}), self.msgs.pop(0))
+
+    def basic_publish(self, exchange: str, routing_key: str, body: bytes, properties: pika.BasicProperties, mandatory: bool = False):
+        """
+        publishes a message, failing when the queue host does not accept it
+        """
+        assert self.confirms and mandatory and not exchange
+
+        if len(self.published) == self.accept:
+            raise pika.exceptions.NackError([body])
+
+        self.published.append((routing_key, body, properties.headers))
+
+    def basic_ack(self, delivery_tag: int):
+        """
+        acknowledges a message
+        """
+        self.acked.append(delivery_tag)
+
+
+def test_replay_dead_letters(monkeypatch):
+    """
+    tests that dead letters are only removed once the queue host confirms they are back on the original queue
+
+    :param monkeypatch:
+    :return:
+    """
+    # the second message is not accepted by the queue host
+    channel = FakeDeadLetterChannel([b'1', b'2', b'3'])
+    channel.accept = 1
+
+    monkeypatch.setattr(pika, 'BlockingConnection', lambda _params: channel)
+
+    # the replay stops at the message that was not accepted
+    assert RetryHandler().replay_dead_letters(None, 'test', 10) == 1
+
+    # the replayed message has its attempts reset and was the only one removed
+    assert channel.published == [('test', b'1', {'other': 1})] and channel.acked == [1]
+
+
+def test_ignored_msgs(db_info, monkeypatch):
+    """
+    tests that a message that can never be handled is alerted once and not sent to a delay queue
+
+    :param db_info:
+    :param monkeypatch:
+    :return:
+    """
+    # create the retry handler with a fake publisher
+    publisher = relay_tester.FakePublisher()
+    publisher.fail = False
+
+    retry_handler = RetryHandler()
+    retry_handler.get_publisher = lambda: publisher
+
+    # the run properties callback does not support any site and the alerts are recorded
+    queue_callbacks = QueueCallbacks(_queue_name='', _logger=db_info.logger, _db_info=db_info)
+
+    alerts: list = []
+
+    monkeypatch.setattr(db_info, 'get_site_ids', list)
+    monkeypatch.setattr(queue_callbacks.general_utils, 'send_slack_msg', lambda msg, channel: alerts.append(msg))
+
+    on_message = retry_handler.wrap('test', queue_callbacks.ecflow_run_props_callback)
+
+    # an unsupported site, an unknown location and a message that cannot be loaded
+    for body in (b'{"physical_location": "RENCI", "uid": "123", "instance_name": "ec95d"}',
+                 b'{"physical_location": "nowhere", "uid": "123", "instance_name": "ec95d"}', b'not json'):
+        on_message(None, None, pika.BasicProperties(), body)
+
+    # each was alerted once and none were retried
+    assert len(alerts) == 3 and not publisher.published
@@ -0,0 +1,208 @@
+# SPDX-FileCopyrightText: 2022 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2023 Renaissance Computing Institute. All rights reserved.
+# SPDX-FileCopyrightText: 2024 Renaissance Computing Institute. All rights reserved.
+#
+# SPDX-License-Identifier: GPL-3.0-or-later
+# SPDX-License-Identifier: LicenseRef-RENCI
+# SPDX-License-Identifier: MIT
+
+"""
+    Test Run Time Status - Tests applying run time status messages with the server-side function.
+
+    Authors: Lisa Stillwell, Phil Owen @RENCI.org
+"""
+from src.common.pg_impl import PGImplementation
+from src.common.queue_callbacks import QueueCallbacks
+from src.common.msg_schemas import RunTimeStatusMsg
+
+
+def get_db_info(db_info: PGImplementation, monkeypatch) -> PGImplementation:
+    """
+    makes a DB object use the server-side function and record the statements run
+
+    :param db_info:
+    :param monkeypatch:
+    :return:
+    """
+    # use the server-side function
+    db_info.run_time_status_function = True
+
+    # the statements run
+    db_info.executed = []
+
+    def exec_sql(_db_name: str, _sql_stmt: str, params=None, stmt_name: str = None):
+        db_info.executed.append((stmt_name, params))
+
+        # the function returns the instance and event group ids
+        return [10, 20]
+
+    # use the recording function
+    monkeypatch.setattr(db_info, 'exec_sql', exec_sql)
+
+    return db_info
+
+
+def test_apply_run_time_status(db_info, monkeypatch):
+    """
+    tests applying a run time status message in a single call
+
+    :param db_info:
+    :param monkeypatch:
+    :return:
+    """
+    # record the statements
+    db_info = get_db_info(db_info, monkeypatch)
+
+    # create a message
+    msg = RunTimeStatusMsg({'physical_location': 'RENCI', 'event_type': 'RSTR', 'state': 'RUNN', 'uid': '123', 'instance_name': 'ec95d',
+                            'date-time': '2024-09-24 12:00:00', 'advisory_number': '2024092406', 'message': ''})
+
+    # the ids come back as a tuple
+    assert db_info.apply_run_time_status(1, 3, 2, msg) == (10, 20)
+
+    # the function gets the resolved values, the percent complete defaults and no message uses the raw data default
+    assert db_info.executed == [('apply_run_time_status', (1, 3, 2, 'RSTR', 'RUNN', 123, 'ec95d', '2024-09-24 12:00:00', '2024092406', 'N/A',
+                                                           'N/A', 'N/A', 'N/A', 40, 40, None))]
+
+    # the callback uses the function instead of the separate statements
+    queue_callbacks = QueueCallbacks(_queue_name='', _logger=db_info.logger, _db_info=db_info)
+
+    assert queue_callbacks.apply_run_time_status(msg, 'test', []) == 10 and len(db_info.executed) == 2
+
+    # a failed call returns negative ids
+    monkeypatch.setattr(db_info, 'exec_sql', lambda _db_name, _sql_stmt, params=None, stmt_name=None: -1)
+
+    assert db_info.apply_run_time_status(1, 3, 2, msg) == (-1, -1)
+
+
+def test_instance_cache(db_info, monkeypatch):
+    """
+    tests that the instance ids are cached, replaced by a new instance and removed when the instance is defunct
+
+    :param db_info:
+    :param monkeypatch:
+    :return:
+    """
+    # record the statements
+    db_info = get_db_info(db_info, monkeypatch)
+
+    # the run has an instance in the DB
+    monkeypatch.setattr(db_info, 'exec_sql', lambda _db_name, _sql_stmt, params=None, stmt_name=None: 10 if stmt_name != 'insert_instance' else 11)
+
+    msg = RunTimeStatusMsg({'physical_location': 'RENCI', 'event_type': 'STRT', 'state': 'RUNN', 'uid': '123', 'instance_name': 'ec95d'})
+
+    # the first lookup goes to the DB, the next one does not
+    assert db_info.get_existing_instance_id(1, msg) == 10 and db_info.get_existing_instance_id(1, msg) == 10
+    assert db_info.instance_cache.hits == 1 and db_info.instance_cache.misses == 1
+
+    # a STRT creates a new instance that replaces the cached one
+    assert db_info.insert_instance(2, 1, msg) == 11 and db_info.get_existing_instance_id(1, msg) == 11
+
+    # a defunct instance is removed
+    db_info.update_instance(db_info.DEFUNCT_STATE_ID, 1, 11, msg)
+
+    assert db_info.get_existing_instance_id(1, msg) == 10 and db_info.instance_cache.misses == 2
+
+
+def test_event_group_cache(db_info, monkeypatch):
+    """
+    tests that the event group ids are cached and replaced by a new event group
+
+    :param db_info:
+    :param monkeypatch:
+    :return:
+    """
+    # record the statements
+    db_info = get_db_info(db_info, monkeypatch)
+
+    # the instance has an event group in the DB
+    monkeypatch.setattr(db_info, 'exec_sql', lambda _db_name, _sql_stmt, params=None, stmt_name=None: 20 if stmt_name != 'insert_event_group' else 21)
+
+    msg = RunTimeStatusMsg({'physical_location': 'RENCI', 'event_type': 'RSTR', 'state': 'RUNN', 'uid': '123', 'advisory_number': '01'})
+
+    # the first lookup goes to the DB, the next one does not
+    assert db_info.get_existing_event_group_id(10, '01') == 20 and db_info.get_existing_event_group_id(10, '01') == 20
+    assert db_info.event_group_cache.hits == 1 and db_info.event_group_cache.misses == 1
+
+    # a RSTR creates a new event group that replaces the cached one
+    assert db_info.insert_event_group(2, 10, msg) == 21 and db_info.get_existing_event_group_id(10, '01') == 21
+
+    # a new advisory goes to the DB
+    assert db_info.get_existing_event_group_id(10, '02') == 20 and db_info.event_group_cache.misses == 2
+
+    # the message values are bound to the statements, a quote in them is stored as is
+    executed: list = []
+
+    monkeypatch.setattr(db_info, 'exec_sql', lambda _db_name, _sql_stmt, params=None, stmt_name=None: executed.append((stmt_name, params)) or 21)
+
+    msg = RunTimeStatusMsg({'physical_location': 'RENCI', 'event_type': 'FEND', 'state': 'RUNN', 'uid': '123', 'advisory_number': '01',
+                            'storm': "O'NEIL", 'storm_number': '5', 'date-time': '2024-09-24 12:00:00'})
+
+    db_info.update_event_group(9, 21, msg)
+    db_info.insert_event_group(2, 10, msg)
+
+    assert executed == [('update_event_group', (9, "O'NEIL", '01', 21)), ('insert_event_group', (2, 10, '2024-09-24 12:00:00', "O'NEIL", '5', '01'))]
+
+
+def test_failed_relay(db_info, monkeypatch):
+    """
+    tests that a failed relay is alerted but does not fail a message whose status was saved, so it is not retried
+
+    :param db_info:
+    :param monkeypatch:
+    :return:
+    """
+    # record the statements
+    db_info = get_db_info(db_info, monkeypatch)
+
+    # the relay fails and the alerts are recorded
+    queue_callbacks = QueueCallbacks(_queue_name='', _logger=db_info.logger, _db_info=db_info)
+
+    alerts: list = []
+
+    monkeypatch.setattr(queue_callbacks.queue_utils, 'relay_msg', lambda body: False)
+    monkeypatch.setattr(queue_callbacks.general_utils, 'send_slack_msg', lambda msg, channel: alerts.append(msg))
+
+    body = b'{"physical_location": "RENCI", "event_type": "RSTR", "state": "RUNN", "uid": "123", "advisory_number": "01"}'
+
+    # the status was saved once and the relay failure was alerted
+    assert queue_callbacks.ecflow_run_time_status_callback(None, None, None, body) and len(db_info.executed) == 1 and len(alerts) == 1
+
+    # the same goes for the messages of a batch, a message that was not saved still fails
+    assert queue_callbacks.ecflow_run_time_status_batch_callback([body, b'{"physical_location": "nowhere"}']) == [True, False]
+    assert len(db_info.executed) == 2 and len(alerts) == 3
+
+
+def test_batch_alerts(db_info, monkeypatch):
+    """
+    tests that the alerts of a batch are sent once it is committed and only once when it falls back to one message at a time
+
+    :param db_info:
+    :param monkeypatch:
+    :return:
+    """
+    # record the statements
+    db_info = get_db_info(db_info, monkeypatch)
+
+    # the alerts are recorded
+    queue_callbacks = QueueCallbacks(_queue_name='', _logger=db_info.logger, _db_info=db_info)
+
+    alerts: list = []
+
+    monkeypatch.setattr(queue_callbacks.queue_utils, 'relay_msg', lambda body: True)
+    monkeypatch.setattr(queue_callbacks.general_utils, 'send_slack_msg', lambda msg, channel: alerts.append(msg))
+
+    bodies: list = [b'{"physical_location": "RENCI", "event_type": "RSTR", "state": "RUNN", "uid": "123", "advisory_number": "01"}',
+                    b'{"physical_location": "nowhere"}']
+
+    # the batch is committed and the bad message is alerted once
+    assert queue_callbacks.ecflow_run_time_status_batch_callback(bodies) == [True, False] and len(alerts) == 1
+
+    # the batch transaction fails
+    def insert_events(_event_values: list):
+        raise ConnectionError('the DB is down')
+
+    monkeypatch.setattr(db_info, 'insert_events', insert_events)
+
+    # the messages are processed one at a time and the bad message is still alerted once
+    assert queue_callbacks.ecflow_run_time_status_batch_callback(bodies) == [True, False] and len(alerts) == 2
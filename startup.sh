@@ -13,7 +13,11 @@ sleep "$1"
 echo "Starting message handlers..."
 #python src/msg_handler/asgs_status_msg_svc.py &
 #python src/msg_handler/asgs_run_props_msg_svc.py &
-python src/msg_handler/ecflow_run_props_msg_svc.py &
-python src/msg_handler/ecflow_run_time_msg_svc.py &
-python src/msg_handler/hec_ras_msg_svc.py &
+#python src/msg_handler/ecflow_run_props_msg_svc.py &
+#python src/msg_handler/ecflow_run_time_msg_svc.py &
+#python src/msg_handler/hec_ras_msg_svc.py &
+# note: the multi-queue handler consumes all the queues in a single process that shares one DB object (and its
+# connections) across the queue threads. a DB connect retries until it succeeds, so while the DB is unreachable
+# every queue in the process stalls, not just the one that hit the error.
+python src/msg_handler/multi_queue_msg_svc.py &
 while true; do sleep 3600; done;